@@ -0,0 +1,119 @@
+"""
+Admission control and request deadlines for /analyze.
+
+AdmissionController bounds how many /analyze requests run at once and how
+many may wait for a slot; past that, callers get an immediate 503 with
+Retry-After. Each admitted request gets a deadline (ANALYZE_DEADLINE
+seconds), kept in a ContextVar: network calls clamp their timeouts to the
+time left (clamp_timeout) and pipeline stages call check_deadline().
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+MAX_CONCURRENCY = int(os.getenv("ANALYZE_MAX_CONCURRENCY", 4))
+MAX_QUEUE = int(os.getenv("ANALYZE_MAX_QUEUE", 8))
+QUEUE_TIMEOUT = float(os.getenv("ANALYZE_QUEUE_TIMEOUT", 10))
+ANALYZE_DEADLINE = float(os.getenv("ANALYZE_DEADLINE", 90))
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(RuntimeError):
+    """Raised when a request's time budget runs out mid-pipeline."""
+
+
+@contextmanager
+def deadline(seconds):
+    """Run the enclosed block with a deadline `seconds` from now."""
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left in the current request's budget, or None if there is none."""
+    expires = _deadline.get()
+    if expires is None:
+        return None
+    return expires - time.monotonic()
+
+
+def check_deadline(stage=""):
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Request deadline exceeded{f' before {stage}' if stage else ''}")
+
+
+def clamp_timeout(timeout):
+    """`timeout` capped to the time left in the request (never below 0.1s)."""
+    left = remaining()
+    if left is None:
+        return timeout
+    return max(0.1, min(timeout, left))
+
+
+class AdmissionController:
+    """At most `max_concurrency` holders, at most `max_queue` waiters."""
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, max_queue=MAX_QUEUE, queue_timeout=QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        # Exponentially weighted average request duration, for Retry-After
+        self._avg_seconds = 5.0
+        self._stats = {"admitted": 0, "rejected": 0, "timedOut": 0, "maxActive": 0, "maxWaiting": 0}
+
+    def try_acquire(self):
+        """Take a slot, waiting up to queue_timeout. False means shed the request."""
+        with self._cond:
+            if self._active >= self.max_concurrency:
+                if self._waiting >= self.max_queue:
+                    self._stats["rejected"] += 1
+                    return False
+                self._waiting += 1
+                self._stats["maxWaiting"] = max(self._stats["maxWaiting"], self._waiting)
+                try:
+                    admitted = self._cond.wait_for(
+                        lambda: self._active < self.max_concurrency, timeout=self.queue_timeout
+                    )
+                finally:
+                    self._waiting -= 1
+                if not admitted:
+                    self._stats["timedOut"] += 1
+                    return False
+            self._active += 1
+            self._stats["admitted"] += 1
+            self._stats["maxActive"] = max(self._stats["maxActive"], self._active)
+            return True
+
+    def release(self, duration=None):
+        with self._cond:
+            self._active -= 1
+            if duration is not None:
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * duration
+            self._cond.notify()
+
+    def retry_after(self):
+        """Whole seconds until a slot is likely to free up for a new request."""
+        with self._cond:
+            backlog = self._waiting + 1
+            return max(1, round(self._avg_seconds * backlog / max(self.max_concurrency, 1)))
+
+    def stats(self):
+        with self._cond:
+            return {
+                **self._stats,
+                "active": self._active,
+                "waiting": self._waiting,
+                "maxConcurrency": self.max_concurrency,
+                "maxQueue": self.max_queue,
+                "avgSeconds": round(self._avg_seconds, 2),
+            }
@@ -1,9 +1,21 @@
 import os
 import json
-from flask import Flask, request, jsonify
+import time
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
 
+import warmup
+import jobs
+import image_upload
+import memory_governor
+import shared_cache
+import traffic_capture
+import response_encoding
+from image_upload import UploadRejected
+from response_cache import ResponseCache, content_key, idempotency_alias
+from admission import AdmissionController, DeadlineExceeded, check_deadline, deadline, remaining, ANALYZE_DEADLINE
+
 load_dotenv()
 
 # IMPORTANT: No heavy imports at module level!
@@ -16,21 +28,91 @@ load_dotenv()
 # boot — deliberately kept this way on a 512MB Render free-tier instance,
 # where eagerly loading ~400MB+ of torch/sentence-transformers on every boot
 # risks OOM/502s regardless of whether any request ever needs recipe search.
+# Multi-worker deployments with more memory can opt into loading it once in
+# the gunicorn master instead (PRELOAD_MODELS=1, see warmup.py).
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# Werkzeug answers 413 before parsing a body larger than every photo at its
+# size limit plus the form fields (see image_upload.py)
+app.config["MAX_CONTENT_LENGTH"] = image_upload.MAX_PHOTOS * image_upload.UPLOAD_MAX_BYTES + 1024 * 1024
+
+# Bounds concurrent + queued /analyze work; everything else (/health, /ready,
+# /metrics) bypasses it. See admission.py and the thread count in gunicorn.conf.py.
+analyze_admission = AdmissionController()
+
+# Finished /analyze bodies keyed on a hash of the input (see response_cache.py)
+analyze_cache = ResponseCache()
+memory_governor.register("response_cache", analyze_cache.nbytes, analyze_cache.shrink, kind="cache")
+
+
+# gzip/brotli/MessagePack negotiation for the /analyze and /jobs bodies
+# (response_encoding.py). Registered before the trace hooks because Flask runs
+# after_request hooks in reverse, so capture still sees the plain JSON body.
+@app.after_request
+def _encode_response(response):
+    if request.endpoint in ('analyze', 'job_status') and request.method != 'OPTIONS':
+        return response_encoding.encode(request, response)
+    return response
+
+
+# Opt-in traffic shape capture / replay stubs for /analyze (traffic_capture.py)
+@app.before_request
+def _begin_trace():
+    if request.endpoint == 'analyze' and request.method == 'POST':
+        traffic_capture.begin(request)
+
+
+@app.after_request
+def _end_trace(response):
+    if request.endpoint == 'analyze' and request.method == 'POST':
+        traffic_capture.end(request, response)
+    return response
+
+
+@app.teardown_request
+def _discard_trace(exc):
+    traffic_capture.discard()
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"message": "Upload too large."}), 413
 
-class StreamlitUploadedFileWrapper:
-    """Wraps Flask file upload object to support Streamlit file interface (.getvalue())"""
-    def __init__(self, file_storage):
-        self.data = file_storage.read()
-    def getvalue(self):
-        return self.data
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({"status": "ok", "service": "ai-nutritionist-python"}), 200
+    # Liveness: always 200 while the process can answer. Readiness (model
+    # loaded and warmed) is reported alongside it and served on /ready.
+    return jsonify({
+        "status": "ok",
+        "service": "ai-nutritionist-python",
+        "ready": warmup.is_ready(),
+    }), 200
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    state = warmup.readiness()
+    return jsonify(state), 200 if state["ready"] else 503
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    import llm_gateway
+    import recipe_atlas
+    import recipe_query
+    return jsonify({
+        "llm": llm_gateway.stats(),
+        "embedding": recipe_query.embedding_stats(),
+        "atlas": recipe_atlas.stats(),
+        "admission": analyze_admission.stats(),
+        "jobs": jobs.stats(),
+        "responseCache": analyze_cache.stats(),
+        "sharedCache": shared_cache.stats(),
+        "memory": memory_governor.stats(),
+    }), 200
 
 
 @app.route('/analyze', methods=['POST', 'OPTIONS'])
@@ -38,6 +120,136 @@ def analyze():
     if request.method == 'OPTIONS':
         return '', 200
 
+    try:
+        fields = response_encoding.parse_fields(request.args.get('fields') or request.form.get('fields'))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    # Photos are streamed to disk and checked against the size, format and
+    # pixel limits before anything else; rejects never reach admission
+    try:
+        uploads = _accept_uploads()
+    except UploadRejected as e:
+        return jsonify({"message": str(e)}), e.status
+
+    try:
+        # Duplicate submissions are answered from the response cache before
+        # they take an admission slot
+        digests = [upload.sha256 for upload in uploads]
+        key = content_key(request.form, digests, fields)
+        traffic_capture.note(uploads, key)
+        idempotency_key = request.headers.get('Idempotency-Key')
+        alias = idempotency_alias(idempotency_key) if idempotency_key else None
+        cached = analyze_cache.get(key, alias)
+        if not cached and fields is not None:
+            # A cached full response for the same meal answers any subset of it
+            full = analyze_cache.get(content_key(request.form, digests))
+            if full:
+                body = response_encoding.select_body(full[0], fields)
+                cached = body, analyze_cache.put(key, body, alias)
+        if cached:
+            return _cached_response(*cached)
+
+        # Shed load fast instead of letting requests pile up on blocked threads
+        if not analyze_admission.try_acquire():
+            retry_after = analyze_admission.retry_after()
+            return jsonify({"message": "Server is busy, please retry shortly."}), 503, {"Retry-After": str(retry_after)}
+
+        t_start = time.monotonic()
+        try:
+            with deadline(ANALYZE_DEADLINE):
+                return _analyze_once(key, alias, uploads, fields)
+        except DeadlineExceeded as e:
+            return jsonify({"message": str(e)}), 504
+        finally:
+            analyze_admission.release(time.monotonic() - t_start)
+            # Enforce the memory budget right after the request's allocations,
+            # not only on the governor's timer
+            memory_governor.touch("response_cache")
+            memory_governor.check()
+    finally:
+        for upload in uploads:
+            upload.discard()
+
+
+def _photo_files():
+    """Every uploaded meal photo: repeated `photo` fields, plus `photos`."""
+    return [f for f in request.files.getlist('photo') + request.files.getlist('photos') if f]
+
+
+def _accept_uploads():
+    """Stream each photo to a checked temp file (image_upload.accept)."""
+    photo_files = _photo_files()
+    if len(photo_files) > image_upload.MAX_PHOTOS:
+        raise UploadRejected(f"Too many photos: at most {image_upload.MAX_PHOTOS} per meal.")
+    uploads = []
+    try:
+        for photo_file in photo_files:
+            uploads.append(image_upload.accept(photo_file.stream))
+    except BaseException:
+        for upload in uploads:
+            upload.discard()
+        raise
+    return uploads
+
+
+def _cached_response(body, etag, cache_status="HIT"):
+    # If-None-Match is answered in _encode_response, per representation
+    return Response(body, mimetype="application/json", headers={"ETag": etag, "X-Cache": cache_status})
+
+
+def _analyze_once(key, alias, uploads, fields=None):
+    """Run the pipeline for `key`, or wait for an identical in-flight request.
+
+    Waiting is bounded by this request's own deadline. If the owner finished
+    without caching a response (an error, an async job), the next waiter
+    claims the key and computes it, so an identical burst still runs the
+    pipeline one request at a time.
+    """
+    while not analyze_cache.begin(key, wait=max(remaining(), 0.0)):
+        cached = analyze_cache.get(key, alias)
+        if cached:
+            return _cached_response(*cached)
+        check_deadline("identical in-flight request")
+    try:
+        response = _analyze(uploads, fields)
+        # Only complete, successful responses are cached — not errors, not
+        # async responses whose consultation is still pending, and not
+        # responses whose consultation failed.
+        if isinstance(response, Response) and response.status_code == 200:
+            payload = response.get_json(silent=True) or {}
+            if not payload.get("consultationJobId") and not payload.get("consultationError"):
+                etag = analyze_cache.put(key, response.get_data(), alias)
+                return _cached_response(response.get_data(), etag, cache_status="MISS")
+        return response
+    finally:
+        analyze_cache.end(key)
+
+
+def _wants_async():
+    flag = request.args.get('async') or request.form.get('async') or ''
+    return flag.lower() in ('1', 'true', 'yes')
+
+
+def _consultation_job(**kwargs):
+    from llm_model import ai_nutritionist
+    return {"aiConsultation": ai_nutritionist(**kwargs)}
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    # ?wait=N long-polls up to N seconds (capped) for the job to finish
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0.0), 25.0)
+    except ValueError:
+        wait = 0.0
+    job = jobs.get(job_id, wait=wait)
+    if job is None:
+        return jsonify({"message": "Unknown or expired job id"}), 404
+    return jsonify(job), 200
+
+
+def _analyze(uploads, fields=None):
     try:
         # Lazy import heavy modules only when endpoint is called
         from text_extraction import process_input
@@ -47,7 +259,6 @@ def analyze():
 
         # 1. Extract inputs
         text = request.form.get('text')
-        photo_file = request.files.get('photo')
         
         goal = request.form.get('goal', 'lose')
         diet_type = request.form.get('dietType', 'non-veg')
@@ -67,91 +278,126 @@ def analyze():
         cuisine_preference = request.form.get('cuisinePreference', 'Any')
         meal_type = request.form.get('mealType', 'Lunch')
 
-        # 2. Extract food list using vision or text
-        wrapped_file = StreamlitUploadedFileWrapper(photo_file) if photo_file else None
-        extracted_text = process_input(input_data=text, uploaded_file=wrapped_file)
+        # 2. Extract food list using vision or text. Several photos of one
+        # meal are extracted concurrently and their foods merged.
+        extracted_text = process_input(input_data=text, image_paths=[upload.path for upload in uploads])
 
         if not extracted_text or extracted_text.startswith("❌"):
             return jsonify({"message": f"Extraction failed: {extracted_text}"}), 400
 
         # Convert to ingredients list
         detected_foods = [food.strip() for food in extracted_text.split(",") if food.strip()]
+        payload = {"mealType": meal_type, "foodItems": detected_foods}
+
+        # Only the stages the requested fields need run (fields=..., see
+        # response_encoding.py); a foodItems-only request stops here
+        needed = response_encoding.stages(fields)
+        if not needed:
+            return jsonify(response_encoding.select(payload, fields))
 
         # 3. Fetch USDA data for each detected food exactly once, shared between
-        # the legacy text summary and the structured totals below (previously
-        # each fetched the same foods independently, ~doubling USDA latency).
+        # the legacy text summary, the structured totals below and the
+        # consultation (previously each fetched the same foods independently).
+        check_deadline("nutrient lookup")
         foods_data = prefetch_foods_data(extracted_text)
-        nutrition_summary = analyze_meal(extracted_text, foods_data=foods_data)
 
         # 3b. Structured macro + micronutrient totals for the Nutrient Gap Tracker
-        try:
-            nutrient_totals = get_meal_nutrient_totals(extracted_text, foods_data=foods_data)
-        except Exception as e:
-            print(f"Error computing structured nutrient totals: {e}")
-            nutrient_totals = {}
-
-        # 4. Macro totals — sourced from the real USDA-backed structured totals
-        # (nutrient_totals, computed above), not from parsing analyze_meal()'s text.
-        # analyze_meal() always returns "Could not add to database" for every food
-        # because ChromaDB is unconditionally bypassed (see nutrition_info.py
-        # _get_collection()), so regex-parsing it for macros always found nothing
-        # and silently fell back to fixed placeholder numbers for every meal.
-        total_calories = round(nutrient_totals.get("calories", 0))
-        total_protein = round(nutrient_totals.get("protein", 0), 1)
-        total_carbs = round(nutrient_totals.get("carbs", 0), 1)
-        total_fats = round(nutrient_totals.get("fat", 0), 1)
+        nutrient_totals = {}
+        if "nutrients" in needed:
+            try:
+                nutrient_totals = get_meal_nutrient_totals(extracted_text, foods_data=foods_data)
+            except Exception as e:
+                print(f"Error computing structured nutrient totals: {e}")
 
-        # 5. Get diet progress analysis (now a compact structured dict — see
-        # diet_analyzer.py — no more free-text prose to parse) & recommendations
-        diet_analysis = analyze_diet_progress(
-            nutrition_summary=nutrition_summary,
-            user_goal=goal,
-            current_diet=diet_type
-        )
-
-        ai_consultation = ai_nutritionist(
-            user_input=extracted_text,
-            goal=goal,
-            food_type=diet_type,
-            dietary_restrictions=[r.lower() for r in restrictions],
-            allergies=[a.lower() for a in allergies],
-            cuisine_preference=cuisine_preference.lower() if cuisine_preference != "Any" else None
-        )
-
-        # 6. Build response — structured, not prose. `nutrients` holds every
-        # macro/micronutrient in one place; `goalAlignment` + `suggestion` are
-        # the compact goal-fit assessment. `aiConsultation` (the separate,
-        # deliberately detailed recipe-recommendation feature) is unchanged.
-        payload = {
-            "mealType": meal_type,
-            "foodItems": detected_foods,
-            "nutrients": {
-                "calories": total_calories,
-                "protein": total_protein,
-                "carbs": total_carbs,
-                "fats": total_fats,
+            # 4. Macro totals — sourced from the real USDA-backed structured totals
+            # (nutrient_totals, computed above), not from parsing analyze_meal()'s text.
+            # analyze_meal() always returns "Could not add to database" for every food
+            # because ChromaDB is unconditionally bypassed (see nutrition_info.py
+            # _get_collection()), so regex-parsing it for macros always found nothing
+            # and silently fell back to fixed placeholder numbers for every meal.
+            payload["nutrients"] = {
+                "calories": round(nutrient_totals.get("calories", 0)),
+                "protein": round(nutrient_totals.get("protein", 0), 1),
+                "carbs": round(nutrient_totals.get("carbs", 0), 1),
+                "fats": round(nutrient_totals.get("fat", 0), 1),
                 "fiber": nutrient_totals.get("fiber", 0),
                 "iron": nutrient_totals.get("iron", 0),
                 "calcium": nutrient_totals.get("calcium", 0),
                 "vitaminD": nutrient_totals.get("vitaminD", 0),
                 "vitaminC": nutrient_totals.get("vitaminC", 0),
                 "potassium": nutrient_totals.get("potassium", 0),
-            },
-            "goalAlignment": {
+            }
+
+        # 5. Get diet progress analysis (now a compact structured dict — see
+        # diet_analyzer.py — no more free-text prose to parse). `goalAlignment`
+        # + `suggestion` are the compact goal-fit assessment.
+        if "verdict" in needed:
+            check_deadline("diet analysis")
+            diet_analysis = analyze_diet_progress(
+                nutrition_summary=analyze_meal(extracted_text, foods_data=foods_data),
+                user_goal=goal,
+                current_diet=diet_type,
+                nutrient_totals=nutrient_totals,
+            )
+            payload["goalAlignment"] = {
                 "score": diet_analysis["score"],
                 "verdict": diet_analysis["verdict"],
                 "summary": diet_analysis["summary"],
-            },
-            "suggestion": diet_analysis["suggestion"],
-            "aiConsultation": ai_consultation,
-        }
+            }
+            payload["suggestion"] = diet_analysis["suggestion"]
+
+        if "consultation" not in needed:
+            return jsonify(response_encoding.select(payload, fields))
+
+        consultation_args = dict(
+            user_input=extracted_text,
+            goal=goal,
+            food_type=diet_type,
+            dietary_restrictions=[r.lower() for r in restrictions],
+            allergies=[a.lower() for a in allergies],
+            cuisine_preference=cuisine_preference.lower() if cuisine_preference != "Any" else None,
+            foods_data=foods_data,
+        )
+
+        # Async mode: hand the slow consultation to the background job pool
+        # (jobs.py) and answer now; the client polls /jobs/<consultationJobId>.
+        # Falls back to generating inline if the pool is saturated.
+        job_id = None
+        if _wants_async():
+            job_id = jobs.submit(_consultation_job, **consultation_args)
+
+        if job_id:
+            ai_consultation = None
+        else:
+            check_deadline("AI consultation")
+            try:
+                ai_consultation = ai_nutritionist(**consultation_args)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                # The rest of the analysis is still worth returning; the flag
+                # keeps this response out of the response cache
+                ai_consultation = f"Error generating AI response: {e}"
+                payload["consultationError"] = True
+
+        # 6. `aiConsultation` is the separate, deliberately detailed
+        # recipe-recommendation feature
+        payload["aiConsultation"] = ai_consultation
+        if job_id:
+            payload["consultationJobId"] = job_id
+            payload["consultationStatus"] = "pending"
 
-        return jsonify(payload)
+        return jsonify(response_encoding.select(payload, fields))
 
+    except DeadlineExceeded as e:
+        # From any stage, extraction included: the budget ran out, the input
+        # wasn't bad
+        return jsonify({"message": str(e)}), 504
     except Exception as e:
         return jsonify({"message": str(e)}), 500
 
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5001))
     print(f"Starting Python AI Nutritionist API server on port {port}...")
+    warmup.start_warmup()
     app.run(host='0.0.0.0', port=port)
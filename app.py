@@ -1,8 +1,8 @@
 import streamlit as st
-from nutrition_info import analyze_meal
-from text_extraction import process_input
-from llm_model import ai_nutritionist
-from diet_analyzer import analyze_diet_progress  # Add this import
+
+# Pipeline modules are imported inside the cached stage functions below, on
+# first use, so the page renders before any of them (or their dependencies)
+# has loaded.
 
 # --------------------------
 # Streamlit Page Setup
@@ -13,6 +13,89 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# --------------------------
+# Cached pipeline stages
+# --------------------------
+# Streamlit reruns this whole script on every widget interaction. Each stage
+# below is cached on its inputs, so a rerun with the same ingredients and
+# preferences reuses earlier results instead of repeating vision, USDA and
+# Gemini calls. Results expire after an hour so USDA/LLM answers don't go stale.
+CACHE_TTL = 3600
+
+
+class StageFailed(Exception):
+    """Raised instead of returning an error message, so st.cache_data doesn't
+    cache a transient failure for the whole TTL."""
+
+
+class _UploadedBytes:
+    """Minimal stand-in for an UploadedFile, so cached extraction can take raw bytes."""
+    def __init__(self, data):
+        self.data = data
+
+    def getvalue(self):
+        return self.data
+
+
+@st.cache_resource(show_spinner="📦 Loading recipe search model...")
+def load_recipe_search_model():
+    # Warm recipe_query's model once per server process. Nothing is returned,
+    # so this cache holds no reference of its own: a memory-governor unload
+    # really frees the model and recipe_query reloads it on demand. With the
+    # embedding service the model lives in that process instead.
+    import embedding_service
+    if embedding_service.ENABLED:
+        return
+    from recipe_query import embed
+    embed(["warm-up"])
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def cached_extract(meal_text, image_bytes):
+    from text_extraction import process_input
+    uploaded = _UploadedBytes(image_bytes) if image_bytes is not None else None
+    extracted = process_input(input_data=meal_text, uploaded_file=uploaded)
+    if extracted.startswith("❌"):
+        raise StageFailed(extracted)
+    return extracted
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def cached_nutrition(extracted_text):
+    """USDA lookups for the meal, fetched once and shared by both summaries."""
+    from nutrition_info import analyze_meal, get_meal_nutrient_totals, prefetch_foods_data
+    foods_data = prefetch_foods_data(extracted_text)
+    summary = analyze_meal(extracted_text, foods_data=foods_data)
+    totals = get_meal_nutrient_totals(extracted_text, foods_data=foods_data)
+    return foods_data, summary, totals
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def cached_diet_analysis(nutrition_summary, user_goal, current_diet, nutrient_totals):
+    from diet_analyzer import analyze_diet_progress
+    return analyze_diet_progress(
+        nutrition_summary=nutrition_summary,
+        user_goal=user_goal,
+        current_diet=current_diet,
+        nutrient_totals=nutrient_totals,
+    )
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def cached_consultation(extracted_text, user_goal, food_type, restrictions, allergy_list, cuisine, foods_data):
+    from llm_model import ai_nutritionist
+    # Failures raise, so st.cache_data never keeps them
+    return ai_nutritionist(
+        user_input=extracted_text,
+        goal=user_goal,
+        food_type=food_type,
+        dietary_restrictions=list(restrictions),
+        allergies=list(allergy_list),
+        cuisine_preference=cuisine,
+        foods_data=foods_data,
+    )
+
+
 st.title("🥗 Your AI Nutritionist Assistant")
 st.markdown("Get **nutrition insights** or **AI-powered meal recommendations** based on your ingredients.")
 
@@ -104,11 +187,14 @@ if get_nutrition or get_ai_answer:
     else:
         try:
             with st.spinner("🔍 Extracting food items..."):
-                # Get extracted text from process_input
-                extracted_text = process_input(
-                    input_data=meal_text,
-                    uploaded_file=uploaded_file
-                )
+                # Get extracted text from process_input (cached on the input)
+                try:
+                    extracted_text = cached_extract(
+                        meal_text if not uploaded_file else None,
+                        uploaded_file.getvalue() if uploaded_file else None,
+                    )
+                except StageFailed as e:
+                    extracted_text = str(e)
 
             # Check if extraction was successful
             if extracted_text.startswith("❌"):
@@ -125,7 +211,7 @@ if get_nutrition or get_ai_answer:
                     st.subheader("📊 Nutrition Analysis")
 
                     with st.spinner("⚡ Analyzing nutrition..."):
-                        nutrition_summary = analyze_meal(extracted_text)
+                        foods_data, nutrition_summary, nutrient_totals = cached_nutrition(extracted_text)
 
                     # Display Nutrition Information
                     st.markdown("#### 🥦 Nutritional Information")
@@ -145,10 +231,11 @@ if get_nutrition or get_ai_answer:
                             "Non-Vegetarian": "non-veg"
                         }
 
-                        diet_analysis = analyze_diet_progress(
-                            nutrition_summary=nutrition_summary,
-                            user_goal=goal_mapping[goal],
-                            current_diet=diet_mapping[diet]
+                        diet_analysis = cached_diet_analysis(
+                            nutrition_summary,
+                            goal_mapping[goal],
+                            diet_mapping[diet],
+                            nutrient_totals,
                         )
 
                     st.markdown("---")
@@ -174,13 +261,16 @@ if get_nutrition or get_ai_answer:
                                 "Non-Vegetarian": "non-veg"
                             }
 
-                            full_response = ai_nutritionist(
-                                user_input=extracted_text,
-                                goal=goal_mapping[goal],
-                                food_type=diet_mapping[diet],
-                                dietary_restrictions=[r.lower() for r in dietary_restrictions],
-                                allergies=[a.lower() for a in allergies],
-                                cuisine_preference=cuisine_preference.lower() if cuisine_preference != "Any" else None
+                            load_recipe_search_model()
+                            foods_data, _, _ = cached_nutrition(extracted_text)
+                            full_response = cached_consultation(
+                                extracted_text,
+                                goal_mapping[goal],
+                                diet_mapping[diet],
+                                tuple(sorted(r.lower() for r in dietary_restrictions)),
+                                tuple(sorted(a.lower() for a in allergies)),
+                                cuisine_preference.lower() if cuisine_preference != "Any" else None,
+                                foods_data,
                             )
 
                             st.markdown("#### 🎯 Your Personalized Plan")
@@ -1,17 +1,97 @@
 import os
 import re
 import json
-import google.generativeai as genai
 from dotenv import load_dotenv
 
+import llm_gateway
+import shared_cache
+from goal_scorer import describe, score_meal
+
 load_dotenv()
 
+# How analyze_diet_progress() produces its assessment when structured totals
+# are available:
+#   "local"  - verdict, score and prose all from goal_scorer.py; no LLM call
+#   "hybrid" - verdict and score local, Gemini writes only summary/suggestion
+#   "llm"    - the original single Gemini call for everything
+DIET_ANALYSIS_MODE = os.getenv("DIET_ANALYSIS_MODE", "local").lower()
+
+_verdict_cache = shared_cache.get_cache(
+    "llm_verdict", version=1, ttl=float(os.getenv("CONSULTATION_CACHE_TTL", 3600))
+)
+
+_GOAL_MAP = {
+    'lose': 'weight loss',
+    'maintain': 'weight maintenance',
+    'gain': 'weight gain'
+}
+_DIET_MAP = {
+    'vegetarian': 'vegetarian',
+    'vegan': 'vegan',
+    'non-veg': 'non-vegetarian'
+}
+
+
+def _generate_json(prompt):
+    # Parsed verdicts are shared across workers for identical prompts; a reply
+    # that doesn't parse raises here and is never cached
+    return _verdict_cache.get_or_compute(shared_cache.key_for(prompt), lambda: _call_json(prompt))
+
+
+def _call_json(prompt):
+    # Short structured output: admitted ahead of the long consultation
+    response = llm_gateway.generate(prompt, priority=llm_gateway.PRIORITY_HIGH, max_output_tokens=256)
+    text = response.text.strip()
+    # Strip a markdown fence if the model added one despite instructions
+    text = re.sub(r'^```(?:json)?\s*|\s*```$', '', text).strip()
+    return json.loads(text)
+
+
+def _local_assessment(nutrient_totals, nutrition_summary, user_goal, current_diet):
+    result = score_meal(nutrient_totals, user_goal)
+    summary, suggestion = describe(result, user_goal)
+    assessment = {
+        "verdict": result["verdict"],
+        "score": result["score"],
+        "summary": summary,
+        "suggestion": suggestion,
+    }
+    if DIET_ANALYSIS_MODE != "hybrid" or not result["components"]:
+        return assessment
+
+    # Hybrid: the model only phrases the already-decided verdict; any failure
+    # keeps the template prose.
+    try:
+        parsed = _generate_json(f"""
+A meal was scored {result["score"]}/10 ("{result["verdict"]}") for a user with:
+- Goal: {_GOAL_MAP.get(user_goal, user_goal)}
+- Current diet: {_DIET_MAP.get(current_diet, current_diet)}
+
+Nutrition information:
+{nutrition_summary}
+
+Respond with ONLY a single JSON object — no markdown fences — with exactly these keys:
+{{
+  "summary": one or two concise sentences explaining that assessment (plain language, no jargon),
+  "suggestion": one short, concrete, actionable suggestion for their next meal
+}}
+""")
+        assessment["summary"] = parsed.get("summary") or summary
+        assessment["suggestion"] = parsed.get("suggestion") or suggestion
+    except Exception as e:
+        print(f"Diet analysis prose generation failed, using template: {e}")
+    return assessment
+
 
-def analyze_diet_progress(nutrition_summary, user_goal, current_diet):
+def analyze_diet_progress(nutrition_summary, user_goal, current_diet, nutrient_totals=None):
     """
     Returns a compact, structured assessment of how a meal aligns with the
     user's goal — a dict with verdict/score/summary/suggestion — instead of a
     long narrative. Callers no longer need to parse anything out of prose.
+
+    When nutrient_totals (get_meal_nutrient_totals() output) is given, the
+    verdict and score are computed locally (goal_scorer.py) per
+    DIET_ANALYSIS_MODE; without it, the original LLM assessment is used.
     """
     fallback = {
         "verdict": "neutral",
@@ -20,28 +100,18 @@ def analyze_diet_progress(nutrition_summary, user_goal, current_diet):
         "suggestion": "Please try again in a moment.",
     }
 
+    if nutrient_totals is not None and DIET_ANALYSIS_MODE != "llm":
+        return _local_assessment(nutrient_totals, nutrition_summary, user_goal, current_diet)
+
     try:
         api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
         if not api_key:
             return {**fallback, "summary": "API key not found. Please check your environment variables."}
 
-        genai.configure(api_key=api_key)
-
-        goal_map = {
-            'lose': 'weight loss',
-            'maintain': 'weight maintenance',
-            'gain': 'weight gain'
-        }
-        diet_map = {
-            'vegetarian': 'vegetarian',
-            'vegan': 'vegan',
-            'non-veg': 'non-vegetarian'
-        }
-
         prompt = f"""
 Analyze this meal for a user with the following context:
-- Goal: {goal_map.get(user_goal, user_goal)}
-- Current diet: {diet_map.get(current_diet, current_diet)}
+- Goal: {_GOAL_MAP.get(user_goal, user_goal)}
+- Current diet: {_DIET_MAP.get(current_diet, current_diet)}
 
 Nutrition information:
 {nutrition_summary}
@@ -56,13 +126,7 @@ before or after it — with exactly these keys:
 }}
 """
 
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        response = model.generate_content(prompt)
-        text = response.text.strip()
-        # Strip a markdown fence if the model added one despite instructions
-        text = re.sub(r'^```(?:json)?\s*|\s*```$', '', text).strip()
-
-        parsed = json.loads(text)
+        parsed = _generate_json(prompt)
         verdict = parsed.get("verdict", "neutral")
         if verdict not in ("helping", "hindering", "neutral"):
             verdict = "neutral"
@@ -0,0 +1,145 @@
+"""
+Micro-batching for embedding requests.
+
+MicroBatcher queues encode() calls; one worker thread collects up to
+EMBED_BATCH_MAX texts or waits EMBED_BATCH_WAIT_MS after the first request,
+runs a single forward pass and hands each caller its rows. stats() reports
+batch sizes and queue waits.
+"""
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", 32))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", 5))
+
+# Every live batcher, reset by one fork hook (hooks can't be unregistered,
+# so a hook per instance would keep each one alive forever)
+_batchers = weakref.WeakSet()
+
+
+def _reset_after_fork():
+    for batcher in list(_batchers):
+        batcher._reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class MicroBatcher:
+    def __init__(self, encode_batch, max_batch=EMBED_BATCH_MAX, max_wait_ms=EMBED_BATCH_WAIT_MS):
+        """encode_batch: list of texts -> array-like of one row per text."""
+        self.encode_batch = encode_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "batches": 0,
+            "requests": 0,
+            "texts": 0,
+            "maxBatchTexts": 0,
+            "totalWaitSeconds": 0.0,
+            "maxWaitSeconds": 0.0,
+            "totalEncodeSeconds": 0.0,
+            "errors": 0,
+        }
+        _batchers.add(self)
+
+    def _reset_after_fork(self):
+        # The worker thread doesn't survive fork; a child starts its own
+        self._worker = None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def submit(self, texts):
+        """Queue texts for the next batch. Returns a Future of their rows."""
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((list(texts), future, time.monotonic()))
+        return future
+
+    def encode(self, texts, timeout=None):
+        """Rows for texts, computed in whatever batch they land in."""
+        return self.submit(texts).result(timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        size = len(batch[0][0])
+        window_closes = batch[0][2] + self.max_wait
+        while size < self.max_batch:
+            # Requests that queued up behind a running batch are taken right
+            # away; only an unfilled batch waits out the rest of the window.
+            remaining = window_closes - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.monotonic()
+            texts = [text for item_texts, _, _ in batch for text in item_texts]
+            try:
+                rows = self.encode_batch(texts) if texts else []
+                error = None
+            except Exception as e:
+                rows, error = None, e
+            finished = time.monotonic()
+
+            offset = 0
+            for item_texts, future, _ in batch:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(rows[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+
+            waits = [started - queued_at for _, _, queued_at in batch]
+            with self._lock:
+                s = self._stats
+                s["batches"] += 1
+                s["requests"] += len(batch)
+                s["texts"] += len(texts)
+                s["maxBatchTexts"] = max(s["maxBatchTexts"], len(texts))
+                s["totalWaitSeconds"] += sum(waits)
+                s["maxWaitSeconds"] = max(s["maxWaitSeconds"], max(waits))
+                s["totalEncodeSeconds"] += finished - started
+                s["errors"] += error is not None
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        batches = s["batches"] or 1
+        requests = s["requests"] or 1
+        return {
+            "batches": s["batches"],
+            "requests": s["requests"],
+            "texts": s["texts"],
+            "errors": s["errors"],
+            "avgBatchTexts": round(s["texts"] / batches, 2),
+            "avgRequestsPerBatch": round(s["requests"] / batches, 2),
+            "maxBatchTexts": s["maxBatchTexts"],
+            "avgWaitMs": round(s["totalWaitSeconds"] / requests * 1000, 2),
+            "maxWaitMs": round(s["maxWaitSeconds"] * 1000, 2),
+            "avgEncodeMs": round(s["totalEncodeSeconds"] / batches * 1000, 2),
+            "queued": self._queue.qsize(),
+            "maxBatch": self.max_batch,
+            "windowMs": self.max_wait * 1000,
+        }
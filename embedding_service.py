@@ -0,0 +1,296 @@
+"""
+Host-wide embedding service: one process owns the MiniLM model and serves
+encode requests to every gunicorn worker over a Unix domain socket
+(EMBEDDING_SERVICE_SOCKET).
+
+Run it directly (`python embedding_service.py`) or through ensure_running();
+a lock file next to the socket keeps it to one server per path. Requests from
+all connections share one MicroBatcher.
+
+Wire format (all integers big-endian, vectors little-endian float32):
+
+    request:   op:u8  count:u32  then count x (len:u32, utf-8 text)
+    response:  status:u8  rows:u32  dim:u32  then rows*dim float32
+               (status 1 = error: rows is the length of a utf-8 message,
+               dim is 0, and the message follows instead of vectors)
+
+OP_PING answers rows=0 with the model's dimension; OP_STATS answers
+rows=<length>, dim=0 followed by the batcher's stats as JSON.
+"""
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+SOCKET_PATH = os.getenv("EMBEDDING_SERVICE_SOCKET", "")
+ENABLED = bool(SOCKET_PATH)
+MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+CLIENT_TIMEOUT = float(os.getenv("EMBEDDING_SERVICE_TIMEOUT", 10))
+START_TIMEOUT = float(os.getenv("EMBEDDING_SERVICE_START_TIMEOUT", 120))
+
+OP_ENCODE = 1
+OP_PING = 2
+OP_STATS = 3
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+MAX_TEXTS = 1024
+MAX_TEXT_BYTES = 64 * 1024
+
+_REQUEST_HEADER = struct.Struct("!BI")
+_RESPONSE_HEADER = struct.Struct("!BII")
+_LENGTH = struct.Struct("!I")
+
+
+class EmbeddingServiceError(RuntimeError):
+    """The service is unreachable or rejected the request."""
+
+
+def _recv_exact(sock, n):
+    chunks = []
+    while n:
+        chunk = sock.recv(min(n, 1 << 20))
+        if not chunk:
+            raise ConnectionError("embedding service connection closed")
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b"".join(chunks)
+
+
+# ---------- CLIENT ----------
+
+_local = threading.local()
+_spawn_lock = threading.Lock()
+_spawned_at = 0.0
+
+
+def _reset_after_fork():
+    # Sockets opened in the parent must not be shared with a forked worker
+    global _local
+    _local = threading.local()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _connection():
+    sock = getattr(_local, "sock", None)
+    if sock is None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(SOCKET_PATH)
+        except OSError as e:
+            sock.close()
+            _spawn_in_background()
+            raise EmbeddingServiceError(f"embedding service not reachable at {SOCKET_PATH}: {e}") from e
+        _local.sock = sock
+    return sock
+
+
+def _drop_connection():
+    sock = getattr(_local, "sock", None)
+    _local.sock = None
+    if sock is not None:
+        sock.close()
+
+
+def _call(op, texts, timeout):
+    payload = [_REQUEST_HEADER.pack(op, len(texts))]
+    for text in texts:
+        data = text.encode("utf-8")
+        payload.append(_LENGTH.pack(len(data)))
+        payload.append(data)
+    request = b"".join(payload)
+
+    # One retry on a fresh connection: the service may have restarted since
+    # this thread last used its socket.
+    for attempt in (1, 2):
+        sock = _connection()
+        try:
+            sock.settimeout(timeout)
+            sock.sendall(request)
+            status, rows, dim = _RESPONSE_HEADER.unpack(_recv_exact(sock, _RESPONSE_HEADER.size))
+            if status != STATUS_OK:
+                raise EmbeddingServiceError(_recv_exact(sock, rows).decode("utf-8", "replace"))
+            body_size = rows if op == OP_STATS else rows * dim * 4
+            return rows, dim, _recv_exact(sock, body_size)
+        except (OSError, struct.error) as e:
+            _drop_connection()
+            if attempt == 2 or isinstance(e, socket.timeout):
+                raise EmbeddingServiceError(f"embedding service request failed: {e}") from e
+
+
+def encode(texts, timeout=None):
+    """Embed texts through the service. Returns a float32 array of shape (len(texts), dim)."""
+    import numpy as np
+    from admission import clamp_timeout
+
+    texts = list(texts)
+    if len(texts) > MAX_TEXTS:
+        return np.concatenate([encode(texts[i:i + MAX_TEXTS], timeout) for i in range(0, len(texts), MAX_TEXTS)])
+    rows, dim, data = _call(OP_ENCODE, texts, clamp_timeout(timeout or CLIENT_TIMEOUT))
+    return np.frombuffer(data, dtype="<f4").reshape(rows, dim)
+
+
+def ping(timeout=1.0):
+    """The served model's dimension, or None if the service isn't answering."""
+    try:
+        _, dim, _ = _call(OP_PING, [], timeout)
+        return dim
+    except EmbeddingServiceError:
+        return None
+
+
+def stats(timeout=1.0):
+    """The service's micro-batcher stats, or None if it isn't answering."""
+    try:
+        _, _, data = _call(OP_STATS, [], timeout)
+    except EmbeddingServiceError:
+        return None
+    return json.loads(data)
+
+
+def _spawn_in_background():
+    # Started detached in its own session so it outlives the worker that
+    # happened to notice it was missing. Rate-limited so a burst of failed
+    # connects doesn't fork a burst of servers (the lock file would make all
+    # but one exit anyway).
+    global _spawned_at
+    with _spawn_lock:
+        if time.monotonic() - _spawned_at < START_TIMEOUT:
+            return
+        _spawned_at = time.monotonic()
+    print(f"Starting embedding service on {SOCKET_PATH}...")
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__)],
+        start_new_session=True,
+        stdin=subprocess.DEVNULL,
+    )
+
+
+def ensure_running(wait=START_TIMEOUT):
+    """Start the service if nothing answers on SOCKET_PATH and wait until it
+    does. Returns True once it's serving, False on timeout."""
+    if ping() is not None:
+        return True
+    _spawn_in_background()
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(0.5)
+        if ping() is not None:
+            return True
+    print(f"Embedding service did not come up within {wait:.0f}s")
+    return False
+
+
+# ---------- SERVER ----------
+
+class _Handler:
+    def __init__(self, model):
+        from embedding_batcher import MicroBatcher
+        self.model = model
+        self.dim = model.get_sentence_embedding_dimension()
+        # One forward pass at a time, shared by every waiting connection
+        self.batcher = MicroBatcher(lambda texts: self.model.encode(texts, convert_to_numpy=True))
+
+    def encode(self, texts):
+        import numpy as np
+        return np.ascontiguousarray(self.batcher.encode(texts), dtype="<f4")
+
+    def serve(self, conn):
+        with conn:
+            while True:
+                try:
+                    header = _recv_exact(conn, _REQUEST_HEADER.size)
+                except ConnectionError:
+                    return
+                op, count = _REQUEST_HEADER.unpack(header)
+                try:
+                    if count > MAX_TEXTS:
+                        raise ValueError(f"too many texts ({count} > {MAX_TEXTS})")
+                    texts = []
+                    for _ in range(count):
+                        (length,) = _LENGTH.unpack(_recv_exact(conn, _LENGTH.size))
+                        if length > MAX_TEXT_BYTES:
+                            raise ValueError(f"text too long ({length} bytes)")
+                        texts.append(_recv_exact(conn, length).decode("utf-8"))
+
+                    if op == OP_PING:
+                        conn.sendall(_RESPONSE_HEADER.pack(STATUS_OK, 0, self.dim))
+                    elif op == OP_STATS:
+                        body = json.dumps(self.batcher.stats()).encode("utf-8")
+                        conn.sendall(_RESPONSE_HEADER.pack(STATUS_OK, len(body), 0) + body)
+                    elif op == OP_ENCODE:
+                        vectors = self.encode(texts) if texts else None
+                        body = vectors.tobytes() if vectors is not None else b""
+                        conn.sendall(_RESPONSE_HEADER.pack(STATUS_OK, len(texts), self.dim) + body)
+                    else:
+                        raise ValueError(f"unknown op {op}")
+                except ConnectionError:
+                    return
+                except Exception as e:
+                    # The request stream is no longer in a known state after a
+                    # malformed request, so report the error and hang up.
+                    message = str(e).encode("utf-8")
+                    try:
+                        conn.sendall(_RESPONSE_HEADER.pack(STATUS_ERROR, len(message), 0) + message)
+                    except OSError:
+                        pass
+                    return
+
+
+def _acquire_lock(path):
+    import fcntl
+    lock_file = open(path + ".lock", "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def serve(path=SOCKET_PATH):
+    if not path:
+        sys.exit("Set EMBEDDING_SERVICE_SOCKET to the socket path to serve on.")
+
+    lock_file = _acquire_lock(path)
+    if lock_file is None:
+        print(f"Embedding service already running on {path}")
+        return
+
+    t_start = time.time()
+    print(f"Loading SentenceTransformer model ({MODEL_NAME})...")
+    from sentence_transformers import SentenceTransformer
+    handler = _Handler(SentenceTransformer(MODEL_NAME))
+    handler.encode(["warm up"])
+    print(f"Model loaded in {time.time() - t_start:.1f}s")
+
+    # Holding the lock means any socket file left behind is stale
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o660)
+    server.listen(128)
+    print(f"Embedding service listening on {path} (pid {os.getpid()}, dim {handler.dim})")
+
+    try:
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=handler.serve, args=(conn,), daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.unlink(path)
+        lock_file.close()
+
+
+if __name__ == "__main__":
+    serve()
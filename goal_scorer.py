@@ -0,0 +1,125 @@
+"""
+Deterministic, local goal-alignment scoring for a meal.
+
+score_meal() turns the totals from get_meal_nutrient_totals() into a verdict
+and a 1-10 score by comparing calories, protein, macro energy split and fiber
+against a per-meal share of the goal's daily targets.
+
+The targets are generic adult values, not personalized: calories from the
+Dietary Guidelines for Americans 2020-2025 (maintain 2,200 kcal, lose -400,
+gain +600); protein per kg for a 75 kg adult (0.8, 1.2 and ~1.5 g/kg); split
+within the Acceptable Macronutrient Distribution Ranges; FIBER_PER_DAY is the
+FDA Daily Value (28 g), the same as NUTRIENT_RDA fiber in
+js_backend/config/nutrientTargets.js. Change both together.
+"""
+
+GOAL_TARGETS = {
+    "lose": {"calories": 1800, "protein_per_day": 90, "split": {"protein": 0.30, "carbs": 0.40, "fat": 0.30}},
+    "maintain": {"calories": 2200, "protein_per_day": 60, "split": {"protein": 0.20, "carbs": 0.50, "fat": 0.30}},
+    "gain": {"calories": 2800, "protein_per_day": 110, "split": {"protein": 0.25, "carbs": 0.50, "fat": 0.25}},
+}
+FIBER_PER_DAY = 28
+MEALS_PER_DAY = 3
+
+_WEIGHTS = {"calories": 0.4, "protein": 0.25, "balance": 0.2, "fiber": 0.15}
+
+_ADVICE = {
+    "calories_high": "Try a smaller portion or swap an energy-dense item for vegetables next meal.",
+    "calories_low": "Add an energy-dense side such as whole grains, nuts or a starchy vegetable next meal.",
+    "protein": "Add a lean protein source (eggs, legumes, fish, chicken or tofu) to your next meal.",
+    "balance": "Rebalance your next plate toward your goal's protein/carb/fat mix.",
+    "fiber": "Include more fiber next meal: vegetables, fruit, legumes or whole grains.",
+    "none": "Keep building meals like this one.",
+}
+
+
+def _clamp(x):
+    return max(0.0, min(1.0, x))
+
+
+def _calorie_fit(ratio, goal):
+    if goal == "lose":
+        return 1.0 if ratio <= 1.0 else _clamp(1 - (ratio - 1) * 1.5)
+    if goal == "gain":
+        return 1.0 if ratio >= 1.0 else _clamp(1 - (1 - ratio) * 1.5)
+    return _clamp(1 - abs(ratio - 1) * 1.2)
+
+
+def score_meal(totals, user_goal):
+    """Return {"verdict", "score", "components", "weakest", "calorieRatio"} for meal totals.
+
+    `totals` is get_meal_nutrient_totals() output. With no calorie data the
+    result is a neutral 5 — there is nothing to judge.
+    """
+    goal = user_goal if user_goal in GOAL_TARGETS else "maintain"
+    targets = GOAL_TARGETS[goal]
+
+    calories = float(totals.get("calories") or 0)
+    if calories <= 0:
+        return {"verdict": "neutral", "score": 5, "components": {}, "weakest": None, "calorieRatio": None}
+
+    protein = float(totals.get("protein") or 0)
+    carbs = float(totals.get("carbs") or 0)
+    fat = float(totals.get("fat") or 0)
+    fiber = float(totals.get("fiber") or 0)
+
+    meal_calories = targets["calories"] / MEALS_PER_DAY
+    ratio = calories / meal_calories
+
+    macro_kcal = protein * 4 + carbs * 4 + fat * 9
+    if macro_kcal > 0:
+        split = {"protein": protein * 4 / macro_kcal, "carbs": carbs * 4 / macro_kcal, "fat": fat * 9 / macro_kcal}
+        # Half the total absolute deviation is in [0, 1]
+        deviation = sum(abs(split[k] - targets["split"][k]) for k in split) / 2
+        balance = _clamp(1 - deviation * 2)
+    else:
+        balance = 0.5
+
+    components = {
+        "calories": _calorie_fit(ratio, goal),
+        "protein": _clamp(protein / (targets["protein_per_day"] / MEALS_PER_DAY)),
+        "balance": balance,
+        "fiber": _clamp(fiber / (FIBER_PER_DAY / MEALS_PER_DAY)),
+    }
+    overall = sum(_WEIGHTS[k] * v for k, v in components.items())
+    score = max(1, min(10, round(1 + 9 * overall)))
+    verdict = "helping" if score >= 7 else "hindering" if score <= 4 else "neutral"
+
+    weakest = min(components, key=lambda k: components[k] * _WEIGHTS[k] - _WEIGHTS[k])
+    if components[weakest] >= 0.9:
+        weakest = "none"
+    elif weakest == "calories":
+        weakest = "calories_high" if ratio > 1 else "calories_low"
+
+    return {
+        "verdict": verdict,
+        "score": score,
+        "components": {k: round(v, 2) for k, v in components.items()},
+        "weakest": weakest,
+        "calorieRatio": round(ratio, 2),
+    }
+
+
+def describe(result, user_goal):
+    """Template summary + suggestion for a score_meal() result."""
+    goal_text = {"lose": "weight loss", "gain": "weight gain"}.get(user_goal, "weight maintenance")
+    if not result["components"]:
+        return (
+            "Not enough nutrition data was found for this meal to assess it.",
+            "Try listing the foods more specifically so they can be looked up.",
+        )
+
+    ratio = result["calorieRatio"]
+    if ratio > 1.15:
+        energy = f"is about {round((ratio - 1) * 100)}% above a typical meal's calories for {goal_text}"
+    elif ratio < 0.85:
+        energy = f"is about {round((1 - ratio) * 100)}% below a typical meal's calories for {goal_text}"
+    else:
+        energy = f"is close to a typical meal's calories for {goal_text}"
+
+    summary = {
+        "helping": f"This meal supports your goal: it {energy}.",
+        "hindering": f"This meal works against your goal: it {energy}.",
+        "neutral": f"This meal is a mixed fit for your goal: it {energy}.",
+    }[result["verdict"]]
+    return summary, _ADVICE[result["weakest"]]
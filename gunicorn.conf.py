@@ -0,0 +1,40 @@
+# gunicorn picks this file up automatically from the working directory:
+#   gunicorn api_server:app
+# Set PRELOAD_MODELS=1 to load the embedding model once in the master and
+# share it copy-on-write with every worker (see warmup.py). Leave it unset on
+# the 512MB free tier, where eager loading risks OOM at boot.
+# Set EMBEDDING_SERVICE_SOCKET to run the model in one separate process per
+# host instead (see embedding_service.py), started here before the workers.
+# traffic_capture is imported here so its capture-key salt is generated once
+# in the master and shared by every worker.
+import os
+
+import admission
+import embedding_service
+import jobs
+import traffic_capture  # noqa: F401
+import warmup
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5001)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+preload_app = warmup.PRELOAD_ENABLED
+
+# Threaded workers with headroom above what /analyze may occupy (its running
+# + queued requests, capped in admission.py) and what /jobs long-polls may
+# hold (capped in jobs.py), so /health always has a free thread to answer on
+# even when every /analyze slot is blocked upstream.
+worker_class = "gthread"
+threads = admission.MAX_CONCURRENCY + admission.MAX_QUEUE + jobs.JOB_MAX_LONG_POLLS + 2
+
+
+def on_starting(server):
+    # One embedding model per host, shared by every worker over a Unix socket
+    if embedding_service.ENABLED:
+        embedding_service.ensure_running()
+    if warmup.PRELOAD_ENABLED:
+        warmup.preload()
+
+
+def post_fork(server, worker):
+    warmup.start_warmup()
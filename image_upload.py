@@ -0,0 +1,123 @@
+"""
+Bounded-memory handling of uploaded meal photos.
+
+save_upload() streams each photo to a temp file in chunks, computing its
+sha256 and rejecting it (413) past UPLOAD_MAX_BYTES. The header is then
+probed without decoding pixels: unsupported formats get a 415, and images
+over UPLOAD_MAX_PIXELS (UPLOAD_MAX_FULL_DECODE_PIXELS for PNG and WebP,
+which can't be decoded at a reduced scale) get a 413. open_bounded() decodes
+straight to a bounded size, using JPEG draft mode or a thumbnail before the
+RGB conversion.
+"""
+import hashlib
+import os
+import tempfile
+
+MAX_PHOTOS = int(os.getenv("ANALYZE_MAX_PHOTOS", 6))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 10 * 1024 * 1024))
+UPLOAD_MAX_PIXELS = int(os.getenv("UPLOAD_MAX_PIXELS", 24_000_000))
+UPLOAD_MAX_FULL_DECODE_PIXELS = int(os.getenv("UPLOAD_MAX_FULL_DECODE_PIXELS", 8_000_000))
+DECODE_MAX_DIM = int(os.getenv("UPLOAD_DECODE_MAX_DIM", 1536))
+ALLOWED_FORMATS = {"JPEG", "MPO", "PNG", "WEBP"}
+_DRAFT_FORMATS = {"JPEG", "MPO"}  # decodable at a reduced scale
+_CHUNK = 64 * 1024
+
+
+class UploadRejected(ValueError):
+    """An upload outside the limits; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=413):
+        super().__init__(message)
+        self.status = status
+
+
+class SavedUpload:
+    """A photo streamed to disk: its temp path, size, sha256, format and dimensions."""
+
+    def __init__(self, path, size, sha256):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.format = None
+        self.dimensions = None
+
+    def discard(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def save_upload(stream, max_bytes=UPLOAD_MAX_BYTES):
+    """Copy a file-like upload to a temp file in chunks, enforcing `max_bytes`."""
+    h = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(suffix=".upload")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = stream.read(_CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadRejected(f"Photo is larger than the {max_bytes / (1024 * 1024):.0f} MB limit.")
+                h.update(chunk)
+                out.write(chunk)
+        if size == 0:
+            raise UploadRejected("Photo upload is empty.", status=400)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return SavedUpload(path, size, h.hexdigest())
+
+
+def probe(upload, max_pixels=UPLOAD_MAX_PIXELS):
+    """Check format and dimensions from the image header, without decoding it."""
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        # Image.open() only parses the header; pixels load on first access
+        with Image.open(upload.path) as img:
+            upload.format, upload.dimensions = img.format, img.size
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise UploadRejected(f"Photo is not a readable image ({e}).", status=415)
+
+    if upload.format not in ALLOWED_FORMATS:
+        raise UploadRejected(f"Unsupported photo format {upload.format}; use JPEG, PNG or WebP.", status=415)
+    width, height = upload.dimensions
+    if upload.format not in _DRAFT_FORMATS:
+        max_pixels = min(max_pixels, UPLOAD_MAX_FULL_DECODE_PIXELS)
+    if width * height > max_pixels:
+        kind = "" if upload.format in _DRAFT_FORMATS else f" for {upload.format}"
+        raise UploadRejected(f"Photo is {width}x{height}; at most {max_pixels // 1_000_000} megapixels are accepted{kind}.")
+    return upload
+
+
+def accept(stream):
+    """save_upload() + probe(); the temp file is removed if the photo is rejected."""
+    upload = save_upload(stream)
+    try:
+        return probe(upload)
+    except BaseException:
+        upload.discard()
+        raise
+
+
+def open_bounded(path, max_dim=DECODE_MAX_DIM):
+    """Decode an image as RGB no larger than max_dim x max_dim.
+
+    JPEGs are decoded at a reduced DCT scale, so the full-resolution bitmap
+    never exists in memory. Other formats are thumbnailed down to max_dim
+    before the RGB conversion. The file is closed before returning.
+    """
+    from PIL import Image
+
+    with Image.open(path) as img:
+        if img.format in _DRAFT_FORMATS and max(img.size) > max_dim:
+            img.draft("RGB", (max_dim, max_dim))
+        if img.mode == "P":
+            img = img.convert("RGBA")  # palette images can't be resampled smoothly
+        img.thumbnail((max_dim, max_dim), reducing_gap=2.0)
+        # convert() always returns a copy, independent of the file
+        return img.convert("RGB")
@@ -0,0 +1,193 @@
+"""
+Background jobs for the slow part of /analyze (the AI consultation).
+
+With async mode /analyze returns nutrients + goal alignment right away along
+with a job id, and the consultation is generated here on a small local
+thread pool. The client then polls GET /jobs/<id>, or long-polls it with
+?wait=<seconds>, until the job is done.
+
+Job state lives in a small SQLite file (JOB_DB_PATH, WAL mode) instead of a
+dict, because with several gunicorn workers the poll can land on a different
+worker than the one running the job. The store is bounded: finished and
+stale jobs expire after JOB_TTL seconds and the table is trimmed to
+JOB_MAX_STORED rows on every insert.
+
+A long-poll holds a server thread, so at most JOB_MAX_LONG_POLLS run at once
+per worker (gunicorn.conf.py adds them to the thread count); past that, a
+poll gets the current status straight away. A poll for a job running in
+this process sleeps on the job's Event and wakes the moment it finishes;
+one for a job on another worker re-reads the store every
+JOB_REMOTE_POLL_INTERVAL seconds.
+"""
+import contextvars
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import deadline
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(tempfile.gettempdir(), "ai_nutritionist_jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", 16))
+JOB_MAX_STORED = int(os.getenv("JOB_MAX_STORED", 1000))
+JOB_TTL = float(os.getenv("JOB_TTL", 3600))
+JOB_DEADLINE = float(os.getenv("JOB_DEADLINE", 180))
+JOB_MAX_LONG_POLLS = int(os.getenv("JOB_MAX_LONG_POLLS", 4))
+JOB_REMOTE_POLL_INTERVAL = float(os.getenv("JOB_REMOTE_POLL_INTERVAL", 1.0))
+
+_local = threading.local()
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+_finished = {}  # job id -> Event, for jobs running in this process
+_long_polls = threading.BoundedSemaphore(max(JOB_MAX_LONG_POLLS, 1))
+_stats = {"longPolls": 0, "longPollsRefused": 0}
+
+
+def _connect():
+    # One connection per thread; sqlite3 connections can't be shared across threads
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(JOB_DB_PATH, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, status TEXT NOT NULL, result TEXT, error TEXT,"
+            " created REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_created ON jobs(created)")
+        _local.conn = conn
+    return conn
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+        return _executor
+
+
+def _set_status(job_id, status, result=None, error=None):
+    _connect().execute(
+        "UPDATE jobs SET status = ?, result = ?, error = ?, updated = ? WHERE id = ?",
+        (status, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+    )
+
+
+def _run(job_id, fn, kwargs):
+    global _pending
+    try:
+        _set_status(job_id, "running")
+        with deadline(JOB_DEADLINE):
+            result = fn(**kwargs)
+        _set_status(job_id, "done", result=result)
+    except Exception as e:
+        _set_status(job_id, "error", error=str(e))
+    finally:
+        with _executor_lock:
+            _pending -= 1
+            finished = _finished.pop(job_id, None)
+        if finished is not None:
+            finished.set()
+
+
+def submit(fn, **kwargs):
+    """Queue fn(**kwargs) and return its job id, or None if the pool is full.
+
+    fn's return value must be JSON-serializable; it becomes the job result.
+    """
+    global _pending
+    with _executor_lock:
+        if _pending >= JOB_MAX_PENDING:
+            return None
+        _pending += 1
+
+    job_id = uuid.uuid4().hex
+    with _executor_lock:
+        _finished[job_id] = threading.Event()
+    now = time.time()
+    try:
+        conn = _connect()
+        conn.execute("DELETE FROM jobs WHERE created < ?", (now - JOB_TTL,))
+        conn.execute(
+            "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (JOB_MAX_STORED - 1,),
+        )
+        conn.execute(
+            "INSERT INTO jobs (id, status, created, updated) VALUES (?, 'pending', ?, ?)",
+            (job_id, now, now),
+        )
+        # The submitting request's context (traffic trace) follows the job
+        _get_executor().submit(contextvars.copy_context().run, _run, job_id, fn, kwargs)
+    except Exception as e:
+        # A locked or full store: undo the bookkeeping so the caller runs fn itself
+        print(f"Job submit failed, falling back to synchronous: {e}")
+        with _executor_lock:
+            _pending -= 1
+            _finished.pop(job_id, None)
+        try:
+            _connect().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        except Exception:
+            pass
+        return None
+    return job_id
+
+
+def get(job_id, wait=0.0):
+    """Job state as a dict, or None if unknown/expired.
+
+    With wait > 0, blocks up to that many seconds for the job to finish,
+    unless JOB_MAX_LONG_POLLS polls are already waiting.
+    """
+    polling = wait > 0 and JOB_MAX_LONG_POLLS > 0 and _long_polls.acquire(blocking=False)
+    with _executor_lock:
+        if polling:
+            _stats["longPolls"] += 1
+        elif wait > 0:
+            _stats["longPollsRefused"] += 1
+    try:
+        return _get(job_id, wait if polling else 0.0)
+    finally:
+        if polling:
+            _long_polls.release()
+
+
+def _get(job_id, wait):
+    give_up = time.monotonic() + wait
+    while True:
+        row = _connect().execute(
+            "SELECT status, result, error, created, updated FROM jobs WHERE id = ? AND created >= ?",
+            (job_id, time.time() - JOB_TTL),
+        ).fetchone()
+        if row is None:
+            return None
+        status, result, error, created, updated = row
+        remaining = give_up - time.monotonic()
+        if status in ("done", "error") or remaining <= 0:
+            job = {"jobId": job_id, "status": status, "createdAt": created, "updatedAt": updated}
+            if result is not None:
+                job["result"] = json.loads(result)
+            if error is not None:
+                job["error"] = error
+            return job
+        with _executor_lock:
+            finished = _finished.get(job_id)
+        if finished is not None:
+            finished.wait(remaining)
+        else:
+            time.sleep(min(remaining, JOB_REMOTE_POLL_INTERVAL))
+
+
+def stats():
+    with _executor_lock:
+        pending = _pending
+    counts = dict(_connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+    return {"pendingInProcess": pending, "workers": JOB_WORKERS, "stored": counts,
+            "maxLongPolls": JOB_MAX_LONG_POLLS, **_stats}
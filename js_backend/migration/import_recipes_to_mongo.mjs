@@ -3,6 +3,12 @@
 // RecipeEmbedding collection in MongoDB Atlas. Does not touch any existing
 // collection. Safe to re-run — duplicate recipeIds are skipped, not treated
 // as fatal errors.
+//
+// If the dump has a manifest next to it (recipes_dump.manifest.json, written
+// by the sharded exporter), the file's size and sha256 are checked against it
+// before anything is inserted, and the record count afterwards; a mismatch
+// aborts the import. Pass --skip-verify to import an unverified dump anyway.
+import crypto from "crypto";
 import dotenv from "dotenv";
 import mongoose from "mongoose";
 import fs from "fs";
@@ -14,12 +20,48 @@ import RecipeEmbedding from "../models/RecipeEmbedding.js";
 const __dirname = path.dirname(fileURLToPath(import.meta.url));
 dotenv.config({ path: path.join(__dirname, "..", "..", ".env") });
 
-const DUMP_PATH = process.argv[2]
-  ? path.resolve(process.argv[2])
+const args = process.argv.slice(2);
+const SKIP_VERIFY = args.includes("--skip-verify");
+const dumpArg = args.find((a) => !a.startsWith("--"));
+const DUMP_PATH = dumpArg
+  ? path.resolve(dumpArg)
   : path.join(__dirname, "..", "..", "migration", "recipes_dump.ndjson");
+const MANIFEST_PATH = DUMP_PATH.replace(/\.ndjson$/, ".manifest.json");
 const BATCH_SIZE = 1000;
 
+// Returns the manifest entry for the dump, or null when there is no manifest.
+// Throws if the file doesn't match it.
+async function verifyDump() {
+  if (MANIFEST_PATH === DUMP_PATH || !fs.existsSync(MANIFEST_PATH)) {
+    console.log(`No manifest at ${MANIFEST_PATH}; importing without verification.`);
+    return null;
+  }
+  const manifest = JSON.parse(fs.readFileSync(MANIFEST_PATH, "utf-8"));
+  const expected = manifest.merged;
+  if (!expected || expected.file !== path.basename(DUMP_PATH)) {
+    throw new Error(`Manifest ${MANIFEST_PATH} does not describe ${path.basename(DUMP_PATH)}`);
+  }
+
+  const hash = crypto.createHash("sha256");
+  let size = 0;
+  for await (const chunk of fs.createReadStream(DUMP_PATH)) {
+    hash.update(chunk);
+    size += chunk.length;
+  }
+  const sha256 = hash.digest("hex");
+  if (size !== expected.bytes || sha256 !== expected.sha256) {
+    throw new Error(
+      `Dump does not match manifest: ${size} bytes / sha256 ${sha256}, ` +
+        `expected ${expected.bytes} bytes / sha256 ${expected.sha256}`
+    );
+  }
+  console.log(`Verified ${path.basename(DUMP_PATH)} against manifest (${expected.records} records, sha256 ok).`);
+  return expected;
+}
+
 async function main() {
+  const expected = SKIP_VERIFY ? null : await verifyDump();
+
   await mongoose.connect(process.env.MONGO_URI);
   console.log(`Connected to database: ${mongoose.connection.name}`);
 
@@ -91,11 +133,16 @@ async function main() {
     console.log(otherErrors.slice(0, 20));
   }
 
+  if (expected && attempted !== expected.records) {
+    console.log(`WARNING: read ${attempted} records but the manifest lists ${expected.records}.`);
+    process.exitCode = 1;
+  }
+
   const finalCount = await RecipeEmbedding.countDocuments();
   console.log(`\nFinal RecipeEmbedding collection count: ${finalCount}`);
 
   await mongoose.disconnect();
-  process.exit(0);
+  process.exit(process.exitCode || 0);
 }
 
 main().catch(async (e) => {
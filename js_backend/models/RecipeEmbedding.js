@@ -3,12 +3,30 @@ import mongoose from "mongoose";
 // Migrated recipe corpus for the Recipe RAG feature (see recipe_query.py).
 // `embedding` holds the original 384-dim sentence-transformers/all-MiniLM-L6-v2
 // vector carried over from the local ChromaDB store — not re-embedded.
+// `tags` is the ingredient tag bitset from recipe_tags.py; `tagBits` lists its
+// set bit positions so Atlas $vectorSearch can pre-filter with $nin.
+// `nutrition` is the precomputed per-serving nutrient profile from
+// migration/compute_recipe_nutrition.py (absent until that job has run).
 const recipeEmbeddingSchema = new mongoose.Schema({
   recipeId: { type: String, required: true, unique: true },
   title: String,
   source: String,
   link: String,
   documentText: { type: String, required: true },
+  tags: { type: Number, default: 0 },
+  tagBits: { type: [Number], default: [] },
+  nutrition: {
+    servings: Number,
+    coverage: Number,
+    partial: Boolean,
+    perServing: {
+      calories: Number,
+      protein: Number,
+      carbs: Number,
+      fat: Number,
+      fiber: Number,
+    },
+  },
   embedding: {
     type: [Number],
     required: true,
@@ -5,33 +5,46 @@ import fs from "fs";
 
 const router = express.Router();
 
-// store uploaded photo temporarily
+// store uploaded photos temporarily; a meal may be sent as several photos
+// (angles / plates), which the Python service extracts concurrently
 const upload = multer({ dest: "uploads/" });
+const MAX_PHOTOS = Number(process.env.ANALYZE_MAX_PHOTOS || 6);
 
-router.post("/analyze", upload.single("photo"), async (req, res) => {
+router.post("/analyze", upload.array("photo", MAX_PHOTOS), async (req, res) => {
+  const photoPaths = (req.files || []).map((f) => f.path);
   try {
-    const { text } = req.body;
-    const photoPath = req.file?.path;
-
     // send to Python service
     const formData = new FormData();
-    if (photoPath) formData.append("photo", fs.createReadStream(photoPath));
+    for (const photoPath of photoPaths) formData.append("photo", fs.createReadStream(photoPath));
     
     // Append all properties from req.body (text, goal, preferences, etc.)
     for (const [key, value] of Object.entries(req.body)) {
       formData.append(key, value);
     }
 
+    // Relay the body as the Python service encoded it (gzip/brotli, JSON or
+    // MessagePack per the caller's Accept headers) instead of decoding and
+    // re-serializing it; ?fields= narrows the response and the work behind it
     const response = await axios.post("http://localhost:5001/analyze", formData, {
-      headers: formData.getHeaders(),
+      headers: {
+        ...formData.getHeaders(),
+        accept: req.get("accept") || "application/json",
+        "accept-encoding": req.get("accept-encoding") || "identity",
+      },
+      params: req.query.fields ? { fields: req.query.fields } : undefined,
+      responseType: "arraybuffer",
+      decompress: false,
     });
 
-    // cleanup temp file
-    if (photoPath) fs.unlinkSync(photoPath);
-
-    res.json(response.data);
+    for (const header of ["content-type", "content-encoding", "vary", "etag", "x-cache"]) {
+      if (response.headers[header]) res.set(header, response.headers[header]);
+    }
+    res.status(response.status).send(Buffer.from(response.data));
   } catch (err) {
     res.status(500).json({ message: err.message });
+  } finally {
+    // cleanup temp files
+    for (const photoPath of photoPaths) fs.unlink(photoPath, () => {});
   }
 });
 
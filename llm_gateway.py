@@ -0,0 +1,222 @@
+"""
+Process-wide gateway for Gemini calls: shared clients, quota budget, priority.
+
+generate() reuses one client and one GenerativeModel per model name, and
+waits on token buckets for requests/minute and tokens/minute
+(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE). Waiting calls are admitted
+by priority, then arrival order; a 429 pauses admission for everyone for a
+short back-off before the retry. stats() reports queue depth and wait times
+per priority. google.generativeai loads on the first call.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+
+import shared_cache
+import traffic_capture
+from admission import check_deadline, remaining
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+_PRIORITY_NAMES = {PRIORITY_HIGH: "high", PRIORITY_NORMAL: "normal", PRIORITY_LOW: "low"}
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", 15))
+TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", 250000))
+QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", 60))
+MAX_RETRIES = 2
+RATE_LIMIT_BACKOFF = 10.0
+
+# Gemini bills an inline image as a fixed ~258 tokens
+_IMAGE_TOKENS = 258
+
+
+class QueueTimeout(RuntimeError):
+    """Raised when a call can't be admitted within its queue timeout."""
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `per_minute` / 60 per second."""
+
+    def __init__(self, per_minute):
+        self.capacity = max(per_minute, 1.0)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` tokens are available (0 if they are now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+_lock = threading.Lock()
+_cond = threading.Condition(_lock)
+_waiting = []
+_sequence = itertools.count()
+_request_bucket = TokenBucket(REQUESTS_PER_MINUTE)
+_token_bucket = TokenBucket(TOKENS_PER_MINUTE)
+_paused_until = 0.0
+_stats = {
+    "admitted": 0,
+    "rateLimited": 0,
+    "timeouts": 0,
+    "errors": 0,
+    "waits": {name: {"count": 0, "totalSeconds": 0.0, "maxSeconds": 0.0} for name in _PRIORITY_NAMES.values()},
+}
+
+_genai = None
+_models = {}
+
+
+def get_model(model_name=DEFAULT_MODEL):
+    """Shared, configured GenerativeModel for `model_name`."""
+    global _genai
+    with _lock:
+        if _genai is None:
+            import google.generativeai as genai
+            api_key = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
+            if not api_key:
+                raise ValueError("Google API key not found in environment variables")
+            genai.configure(api_key=api_key)
+            _genai = genai
+        if model_name not in _models:
+            _models[model_name] = _genai.GenerativeModel(model_name)
+        return _models[model_name]
+
+
+def estimate_tokens(contents, max_output_tokens=0):
+    """Input tokens of a prompt (str or list of str/images) plus expected output."""
+    from prompt_builder import estimate_tokens as text_tokens
+
+    parts = contents if isinstance(contents, (list, tuple)) else [contents]
+    total = sum(text_tokens(p) if isinstance(p, str) else _IMAGE_TOKENS for p in parts)
+    return total + max_output_tokens
+
+
+def _acquire(priority, tokens, timeout):
+    entry = (priority, next(_sequence))
+    deadline = time.monotonic() + timeout
+    t_start = time.monotonic()
+
+    with _cond:
+        heapq.heappush(_waiting, entry)
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    _stats["timeouts"] += 1
+                    raise QueueTimeout(f"LLM call not admitted within {timeout:.0f}s")
+                if _waiting[0] == entry:
+                    wait = max(
+                        _paused_until - now,
+                        _request_bucket.wait_time(1, now),
+                        _token_bucket.wait_time(tokens, now),
+                    )
+                    if wait <= 0:
+                        _request_bucket.take(1)
+                        _token_bucket.take(tokens)
+                        break
+                else:
+                    wait = deadline - now
+                _cond.wait(min(wait, deadline - now))
+        finally:
+            _waiting.remove(entry)
+            heapq.heapify(_waiting)
+            _cond.notify_all()
+
+        waited = time.monotonic() - t_start
+        _stats["admitted"] += 1
+        bucket = _stats["waits"][_PRIORITY_NAMES.get(priority, "normal")]
+        bucket["count"] += 1
+        bucket["totalSeconds"] += waited
+        bucket["maxSeconds"] = max(bucket["maxSeconds"], waited)
+
+
+def _is_rate_limited(error):
+    return getattr(error, "code", None) == 429 or "429" in str(error) or "ResourceExhausted" in type(error).__name__
+
+
+@traffic_capture.upstream("llm")
+def generate(contents, priority=PRIORITY_NORMAL, model_name=DEFAULT_MODEL,
+             max_output_tokens=1024, timeout=QUEUE_TIMEOUT):
+    """Queue, rate-limit and run model.generate_content(contents).
+
+    Returns the SDK response. Raises QueueTimeout if the call can't be
+    admitted in time, or the SDK error if it still fails after retries.
+    Inside a request with a deadline (admission.py), both the queue wait and
+    the Gemini call itself are capped to the time the request has left.
+    """
+    global _paused_until
+    model = get_model(model_name)
+    tokens = estimate_tokens(contents, max_output_tokens)
+
+    for attempt in range(MAX_RETRIES + 1):
+        check_deadline("LLM call")
+        left = remaining()
+        _acquire(priority, tokens, timeout if left is None else min(timeout, left))
+        try:
+            left = remaining()
+            if left is None:
+                return model.generate_content(contents)
+            return model.generate_content(contents, request_options={"timeout": max(left, 1.0)})
+        except Exception as e:
+            if not _is_rate_limited(e) or attempt == MAX_RETRIES:
+                with _lock:
+                    _stats["errors"] += 1
+                raise
+            with _cond:
+                _stats["rateLimited"] += 1
+                _paused_until = max(_paused_until, time.monotonic() + RATE_LIMIT_BACKOFF * (attempt + 1))
+            print(f"Gemini rate limited; pausing admission and retrying ({attempt + 1}/{MAX_RETRIES})")
+
+
+def generate_text(prompt, cache=None, priority=PRIORITY_NORMAL, model_name=DEFAULT_MODEL, max_output_tokens=1024):
+    """generate() for a text-only prompt, returning response.text.
+
+    With `cache` (a shared_cache namespace) an identical prompt to the same
+    model is answered from the cache shared by all workers, spending no quota.
+    Errors propagate and empty answers aren't cached.
+    """
+    def call():
+        return generate(prompt, priority=priority, model_name=model_name,
+                        max_output_tokens=max_output_tokens).text
+
+    if cache is None:
+        return call()
+    return cache.get_or_compute(shared_cache.key_for(model_name, max_output_tokens, prompt), call, cache_if=bool)
+
+
+def stats():
+    with _lock:
+        waits = {
+            name: {
+                "count": w["count"],
+                "avgSeconds": round(w["totalSeconds"] / w["count"], 3) if w["count"] else 0.0,
+                "maxSeconds": round(w["maxSeconds"], 3),
+            }
+            for name, w in _stats["waits"].items()
+        }
+        return {
+            "queueDepth": len(_waiting),
+            "admitted": _stats["admitted"],
+            "rateLimited": _stats["rateLimited"],
+            "timeouts": _stats["timeouts"],
+            "errors": _stats["errors"],
+            "waits": waits,
+            "budget": {"requestsPerMinute": REQUESTS_PER_MINUTE, "tokensPerMinute": TOKENS_PER_MINUTE},
+            "paused": max(0.0, round(_paused_until - time.monotonic(), 1)),
+        }
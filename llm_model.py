@@ -6,8 +6,16 @@ load_dotenv()
 # All heavy imports are done lazily inside functions, not at module level.
 # This ensures the Flask server can bind to a port immediately on Render.
 
+CONSULTATION_CACHE_TTL = float(os.getenv("CONSULTATION_CACHE_TTL", 3600))
 
-def ai_nutritionist(user_input, goal, food_type, dietary_restrictions=None, allergies=None, cuisine_preference=None):
+
+def _consultation_cache():
+    import shared_cache
+    return shared_cache.get_cache("llm_consultation", version=1, ttl=CONSULTATION_CACHE_TTL)
+
+
+def ai_nutritionist(user_input, goal, food_type, dietary_restrictions=None, allergies=None, cuisine_preference=None,
+                    foods_data=None):
     """
     Enhanced AI Nutritionist with Gemini
     user_input: text or food list (e.g., "banana, milk, rice, chicken")
@@ -16,34 +24,53 @@ def ai_nutritionist(user_input, goal, food_type, dietary_restrictions=None, alle
     dietary_restrictions: list of restrictions e.g., ["low-carb", "gluten-free"]
     allergies: list of allergies e.g., ["nuts", "dairy"]
     cuisine_preference: preferred cuisine style e.g., "mediterranean", "asian"
+    foods_data: optional prefetch_foods_data() result, to reuse USDA lookups
+        the caller already made
     """
     # Lazy imports — only loaded when this function is called
-    import google.generativeai as genai
-    from nutrition_info import analyze_meal
-    from recipe_query import search_recipe
+    import llm_gateway
+    from nutrition_info import prefetch_foods_data
+    from prompt_builder import build_context
+    from recipe_nutrition import meal_calorie_ceiling
+    from recipe_query import search_recipes
     from text_extraction import process_input
 
-    # Configure Gemini
-    api_key = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
-    genai.configure(api_key=api_key)
-
     print("Processing user input...")
 
     # Step 1: Extract ingredients from ORIGINAL user input
     ingredients = process_input(user_input)
     print(f"Extracted ingredients: {ingredients}")
+    # process_input() returns a comma-separated string; joining that directly
+    # would put ", " between every character of the recipe query.
+    ingredients = [i.strip() for i in ingredients.split(",") if i.strip()]
 
     # Step 2: Get nutrition info
     print("Fetching nutritional info...")
-    nutrition_info = analyze_meal(user_input)  # Pass original input, not processed list
+    if foods_data is None:
+        foods_data = prefetch_foods_data(user_input)  # Pass original input, not processed list
     print("Nutrition info retrieved")
 
-    # Step 3: Retrieve recipe suggestions using ORIGINAL ingredients
+    # Step 3: Retrieve recipe suggestions using ORIGINAL ingredients, already
+    # filtered to the user's diet type, allergies and restrictions, and ranked
+    # by how well each recipe's precomputed nutrients fit the goal
     recipe_query = ", ".join(ingredients)
-    recipes = search_recipe(recipe_query, top_k=5)
+    recipes = search_recipes(
+        recipe_query,
+        top_k=5,
+        food_type=food_type,
+        allergies=allergies,
+        dietary_restrictions=dietary_restrictions,
+        goal=goal,
+        max_calories=meal_calorie_ceiling(goal),
+    )
     print("Recipes retrieved")
 
-    # Step 4: Build enhanced LLM prompt
+    # Step 4: Compact the variable sections to a token budget (recipe title +
+    # key ingredients instead of full directions, nutrients as a table) — see
+    # prompt_builder.py — then build the enhanced LLM prompt
+    context, section_tokens = build_context(ingredients, foods_data, recipes)
+    print(f"Prompt context tokens (est.): {section_tokens}")
+
     prompt = f"""
 # EXPERT AI NUTRITIONIST CONSULTATION
 
@@ -55,13 +82,13 @@ def ai_nutritionist(user_input, goal, food_type, dietary_restrictions=None, alle
 - **Cuisine Preference**: {cuisine_preference or "Flexible"}
 
 ## AVAILABLE INGREDIENTS
-{', '.join(ingredients)}
+{context["ingredients"]}
 
 ## NUTRITIONAL ANALYSIS
-{nutrition_info}
+{context["nutrition"]}
 
-## RECIPE SUGGESTIONS (from database)
-{recipes}
+## RECIPE SUGGESTIONS (from database, title (estimated nutrients per serving): key ingredients)
+{context["recipes"]}
 
 ## YOUR TASK:
 As an expert nutritionist, provide comprehensive meal recommendations that are:
@@ -106,16 +133,18 @@ As an expert nutritionist, provide comprehensive meal recommendations that are:
 Keep the tone professional yet encouraging, and ensure all recommendations are evidence-based and practical for home cooking.
 """
 
-    # Generate response using Gemini - FIXED MODEL NAME
-    try:
-        print("GenAI response...")
-        # Use the correct Gemini model name
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        response = model.generate_content(prompt)
-        print(" AI response generated")
-        return response.text
-    except Exception as e:
-        return f"Error generating AI response: {str(e)}"
+    # Generate response using Gemini
+    print("GenAI response...")
+    # Shared, rate-limited client; the long consultation yields to shorter
+    # calls when the quota is contended. An identical prompt from any worker
+    # in the last CONSULTATION_CACHE_TTL is answered from the shared cache
+    # instead. Failures (quota pauses, queue timeouts, the request deadline)
+    # propagate, so they are never cached as if they were a consultation.
+    text = llm_gateway.generate_text(
+        prompt, cache=_consultation_cache(), priority=llm_gateway.PRIORITY_LOW, max_output_tokens=2048
+    )
+    print(" AI response generated")
+    return text
 
 
 # Enhanced example with additional parameters
@@ -0,0 +1,220 @@
+"""
+Memory budget manager for a worker running in a small (512MB) box.
+
+Heavy components register with a size estimate and a way to give memory
+back: "cache" components shrink, "resource" components unload and reload
+lazily. With MEMORY_BUDGET_MB set, check() shrinks caches above
+MEMORY_SOFT_LIMIT of the budget and unloads the least recently used resource
+at the budget; MEMORY_IDLE_UNLOAD unloads idle resources. Without a budget it
+only measures. Usage is PSS (MEMORY_METRIC=uss for private pages only), and a
+resource whose unload didn't lower it is never evicted again. A daemon thread
+runs check() every MEMORY_CHECK_INTERVAL seconds.
+"""
+import gc
+import os
+import threading
+import time
+
+MEMORY_BUDGET_MB = float(os.getenv("MEMORY_BUDGET_MB") or 0)   # 0: no budget, measure only
+MEMORY_METRIC = os.getenv("MEMORY_METRIC", "pss").lower()
+MEMORY_SOFT_LIMIT = float(os.getenv("MEMORY_SOFT_LIMIT", 0.85))
+MEMORY_IDLE_UNLOAD = float(os.getenv("MEMORY_IDLE_UNLOAD", 0))
+MEMORY_CHECK_INTERVAL = float(os.getenv("MEMORY_CHECK_INTERVAL", 5))
+
+_MB = 1024 * 1024
+
+_lock = threading.RLock()
+_components = {}
+_peak_usage = 0
+_monitor = None
+_stats = {"shrinks": 0, "unloads": 0, "idleUnloads": 0, "ineffectiveUnloads": 0, "checks": 0}
+
+
+def enabled():
+    return MEMORY_BUDGET_MB > 0 or MEMORY_IDLE_UNLOAD > 0
+
+
+def rss_bytes():
+    """Current resident set size of this process (0 if unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # ru_maxrss is the peak, not the current value, but it's the best
+        # portable fallback (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+    except Exception:
+        return 0
+
+
+def usage_bytes():
+    """This process's memory: PSS (or USS with MEMORY_METRIC=uss), else RSS."""
+    fields = ("Pss:",) if MEMORY_METRIC != "uss" else ("Private_Clean:", "Private_Dirty:")
+    try:
+        total = 0
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith(fields):
+                    total += int(line.split()[1]) * 1024
+        if total:
+            return total
+    except (OSError, ValueError, IndexError):
+        pass
+    return rss_bytes()
+
+
+def register(name, size, release, kind="resource"):
+    """Track a heavy component.
+
+    size: () -> bytes currently held (estimate; 0 when unloaded)
+    release: for "resource", () -> None unloading it entirely;
+             for "cache", (fraction) -> None dropping that share of entries
+    Re-registering a name replaces its callbacks and marks it used.
+    """
+    with _lock:
+        previous = _components.get(name, {})
+        _components[name] = {
+            "size": size,
+            "release": release,
+            "kind": kind,
+            "lastUsed": time.monotonic(),
+            "peak": previous.get("peak", 0),
+            # False once an unload failed to lower usage; never evicted again
+            "relieves": previous.get("relieves", True),
+        }
+
+
+def touch(name):
+    """Mark a component as just used (for LRU and idle unloading)."""
+    component = _components.get(name)
+    if component is not None:
+        component["lastUsed"] = time.monotonic()
+
+
+def _size(component):
+    try:
+        size = int(component["size"]() or 0)
+    except Exception:
+        size = 0
+    component["peak"] = max(component["peak"], size)
+    return size
+
+
+def _unload(name, component):
+    """Unload a resource; returns usage afterwards and records whether it helped."""
+    size = _size(component)
+    before = usage_bytes()
+    print(f"Memory governor: unloading {name} ({size / _MB:.0f}MB)")
+    component["release"]()
+    gc.collect()
+    after = usage_bytes()
+    if before - after < size / 2:
+        component["relieves"] = False
+        _stats["ineffectiveUnloads"] += 1
+        print(f"Memory governor: unloading {name} freed {(before - after) / _MB:.0f}MB; won't evict it again")
+    return after
+
+
+def _evictable(component):
+    return component["kind"] == "resource" and component["relieves"] and _size(component)
+
+
+def check():
+    """Enforce the budget once. Returns usage in bytes, or None with the governor off."""
+    global _peak_usage
+    if not enabled():
+        return None
+    if _monitor is None:
+        _ensure_monitor()
+    with _lock:
+        _stats["checks"] += 1
+        now = time.monotonic()
+
+        if MEMORY_IDLE_UNLOAD > 0:
+            for name, c in _components.items():
+                if _evictable(c) and now - c["lastUsed"] > MEMORY_IDLE_UNLOAD:
+                    _unload(name, c)
+                    _stats["idleUnloads"] += 1
+
+        usage = usage_bytes()
+        if MEMORY_BUDGET_MB <= 0:
+            _peak_usage = max(_peak_usage, usage)
+            return usage
+
+        budget = MEMORY_BUDGET_MB * _MB
+        if usage > budget * MEMORY_SOFT_LIMIT:
+            for name, c in _components.items():
+                if c["kind"] == "cache" and _size(c):
+                    c["release"](0.5)
+                    _stats["shrinks"] += 1
+            gc.collect()
+            usage = usage_bytes()
+
+        while usage >= budget:
+            loaded = [(c["lastUsed"], name) for name, c in _components.items() if _evictable(c)]
+            if not loaded:
+                break
+            _, name = min(loaded)
+            usage = _unload(name, _components[name])
+            _stats["unloads"] += 1
+
+        _peak_usage = max(_peak_usage, usage)
+        return usage
+
+
+def _monitor_loop():
+    while True:
+        time.sleep(MEMORY_CHECK_INTERVAL)
+        try:
+            check()
+        except Exception as e:
+            print(f"Memory governor check failed: {e}")
+
+
+def _ensure_monitor():
+    # Started by the first check() (after a worker's first request) rather
+    # than on registration, so a gunicorn master that preloads and registers
+    # the model never starts a thread before fork.
+    global _monitor
+    with _lock:
+        if _monitor is None or not _monitor.is_alive():
+            _monitor = threading.Thread(target=_monitor_loop, name="memory-governor", daemon=True)
+            _monitor.start()
+
+
+def _reset_after_fork():
+    global _monitor
+    _monitor = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def stats():
+    global _peak_usage
+    with _lock:
+        usage = usage_bytes()
+        _peak_usage = max(_peak_usage, usage)
+        components = {
+            name: {
+                "kind": c["kind"],
+                "currentMB": round(_size(c) / _MB, 1),
+                "peakMB": round(c["peak"] / _MB, 1),
+                "idleSeconds": round(time.monotonic() - c["lastUsed"], 1),
+                "evictable": c["relieves"],
+            }
+            for name, c in _components.items()
+        }
+        return {
+            "metric": MEMORY_METRIC,
+            "usageMB": round(usage / _MB, 1),
+            "peakUsageMB": round(_peak_usage / _MB, 1),
+            "rssMB": round(rss_bytes() / _MB, 1),
+            "budgetMB": MEMORY_BUDGET_MB or None,
+            "components": components,
+            **_stats,
+        }
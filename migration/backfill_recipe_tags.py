@@ -0,0 +1,50 @@
+"""
+One-off backfill: computes the ingredient tag bitset (recipe_tags.py) for
+recipes already imported into the `recipeEmbeddings` collection before
+tagging existed, and writes `tags` + `tagBits` onto each document.
+
+Safe to re-run — documents that already have `tagBits` are skipped. After it
+finishes, add `{"type": "filter", "path": "tagBits"}` to the Atlas
+recipe_vector_index definition so recipe_query.search_recipe() can pre-filter.
+"""
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from recipe_tags import compute_tags, ingredients_section, tag_bits  # noqa: E402
+
+BATCH_SIZE = 1000
+
+
+def main():
+    load_dotenv()
+    client = MongoClient(os.getenv("MONGO_URI"))
+    collection = client.get_default_database()["recipeEmbeddings"]
+
+    query = {"tagBits": {"$exists": False}}
+    total = collection.count_documents(query)
+    print(f"{total} recipes need tags.")
+
+    updated = 0
+    t_start = time.time()
+    ops = []
+    for doc in collection.find(query, {"_id": 1, "documentText": 1}):
+        tags = compute_tags(ingredients_section(doc.get("documentText", "")))
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"tags": tags, "tagBits": tag_bits(tags)}}))
+        if len(ops) >= BATCH_SIZE:
+            updated += collection.bulk_write(ops, ordered=False).modified_count
+            ops = []
+            print(f"  updated {updated}/{total} ({time.time() - t_start:.1f}s elapsed)")
+    if ops:
+        updated += collection.bulk_write(ops, ordered=False).modified_count
+
+    print(f"\nDone in {time.time() - t_start:.1f}s. Tagged {updated} recipes.")
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Batch job: precomputes a nutrient profile (recipe_nutrition.py) for every
+recipe in the corpus dump and stores it next to the embedding.
+
+    python migration/compute_recipe_nutrition.py [--ndjson PATH] [--mongo]
+                                                 [--max-lookups N] [--force]
+
+1. Counts every distinct ingredient name across the dump.
+2. Resolves names through nutrition_info.fetch_food_data() (USDA, per
+   100 g), most frequent first. The top handful of names covers most
+   ingredient lines. Results, including misses, go into a JSON cache
+   (--cache), so re-runs and interrupted runs never repeat a lookup.
+   --max-lookups caps the USDA calls made in one run, to stay inside the
+   API key's hourly limit. Names left unresolved are picked up next run.
+3. Writes a `nutrition` field onto each NDJSON record (atomically, via a
+   temp file) and, with --mongo, onto the matching `recipeEmbeddings`
+   documents. The dump's manifest (see dump_chroma_recipes.py), if there
+   is one, gets the rewritten file's new checksum so the importer still
+   verifies it.
+
+Safe to re-run: records that already have a complete profile are left
+alone unless --force is given. Profiles computed while some of their
+ingredients were still unresolved are marked `partial` and recomputed.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from recipe_nutrition import PROFILE_NUTRIENTS, compute_profile, ingredient_lines, parse_ingredient  # noqa: E402
+
+DEFAULT_NDJSON = os.path.join(ROOT, "migration", "recipes_dump.ndjson")
+DEFAULT_CACHE = os.path.join(ROOT, "migration", "ingredient_nutrients.json")
+BATCH_SIZE = 1000
+
+
+def _read_records(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _load_cache(path):
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def _save_cache(path, cache):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    os.replace(tmp, path)
+
+
+def resolve_ingredients(names, cache, cache_path, max_lookups):
+    """Fill `cache` (name -> per-100g nutrients or None) for `names`, most
+    frequent first. Returns the number of USDA lookups made."""
+    from nutrition_info import fetch_food_data
+
+    lookups = 0
+    t_start = time.time()
+    for name, _ in names.most_common():
+        if name in cache:
+            continue
+        if max_lookups is not None and lookups >= max_lookups:
+            break
+        item = fetch_food_data(name)
+        cache[name] = {k: item["nutrients"].get(k, 0) for k in PROFILE_NUTRIENTS} if item else None
+        lookups += 1
+        if lookups % 100 == 0:
+            _save_cache(cache_path, cache)
+            print(f"  resolved {lookups} ingredients ({time.time() - t_start:.1f}s elapsed)")
+    _save_cache(cache_path, cache)
+    return lookups
+
+
+def _update_manifest(ndjson_path, sha256, size, records):
+    manifest_path = ndjson_path[:-len(".ndjson")] + ".manifest.json" if ndjson_path.endswith(".ndjson") else None
+    if not manifest_path or not os.path.exists(manifest_path):
+        return
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    merged = manifest.get("merged")
+    if not merged or merged.get("file") != os.path.basename(ndjson_path):
+        return
+    merged.update({"sha256": sha256, "bytes": size, "records": records})
+    manifest["nutritionAddedAt"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    tmp = manifest_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, manifest_path)
+    print(f"Updated checksum in {manifest_path}")
+
+
+def _update_mongo(profiles):
+    from dotenv import load_dotenv
+    from pymongo import MongoClient, UpdateOne
+
+    load_dotenv()
+    client = MongoClient(os.getenv("MONGO_URI"))
+    collection = client.get_default_database()["recipeEmbeddings"]
+    items = list(profiles.items())
+    updated = 0
+    for i in range(0, len(items), BATCH_SIZE):
+        ops = [UpdateOne({"recipeId": rid}, {"$set": {"nutrition": profile}}) for rid, profile in items[i:i + BATCH_SIZE]]
+        updated += collection.bulk_write(ops, ordered=False).modified_count
+        print(f"  updated {updated}/{len(items)} documents in Atlas")
+    client.close()
+
+
+def _needs_profile(record, force):
+    nutrition = record.get("nutrition")
+    return force or not nutrition or nutrition.get("partial")
+
+
+def _names(document_text):
+    names = []
+    for line in ingredient_lines(document_text):
+        grams, name = parse_ingredient(line)
+        if grams is not None and name:
+            names.append(name)
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute per-recipe nutrient profiles.")
+    parser.add_argument("--ndjson", default=os.getenv("RECIPE_INDEX_PATH", DEFAULT_NDJSON))
+    parser.add_argument("--cache", default=DEFAULT_CACHE)
+    parser.add_argument("--max-lookups", type=int, default=None)
+    parser.add_argument("--mongo", action="store_true", help="also write profiles to recipeEmbeddings")
+    parser.add_argument("--force", action="store_true", help="recompute profiles that already exist")
+    args = parser.parse_args()
+
+    t_start = time.time()
+    names = Counter()
+    pending = 0
+    for record in _read_records(args.ndjson):
+        if not _needs_profile(record, args.force):
+            continue
+        pending += 1
+        names.update(_names(record["documentText"]))
+    print(f"{pending} recipes need profiles ({len(names)} distinct ingredients).")
+    if not pending:
+        return
+
+    cache = _load_cache(args.cache)
+    lookups = resolve_ingredients(names, cache, args.cache, args.max_lookups)
+    unresolved = sum(1 for name in names if name not in cache)
+    print(f"Made {lookups} USDA lookups; {unresolved} ingredients still unresolved.")
+
+    profiles = {}
+    h, size, records = hashlib.sha256(), 0, 0
+    tmp_path = args.ndjson + ".tmp"
+    with open(tmp_path, "wb") as out:
+        for record in _read_records(args.ndjson):
+            if _needs_profile(record, args.force):
+                profile = compute_profile(record["documentText"], cache.get)
+                if profile is not None:
+                    if any(name not in cache for name in _names(record["documentText"])):
+                        profile["partial"] = True
+                    record["nutrition"] = profile
+                    profiles[record["recipeId"]] = profile
+            line = (json.dumps(record) + "\n").encode("utf-8")
+            out.write(line)
+            h.update(line)
+            size += len(line)
+            records += 1
+    os.replace(tmp_path, args.ndjson)
+    print(f"Wrote {len(profiles)} profiles to {args.ndjson}")
+    _update_manifest(args.ndjson, h.hexdigest(), size, records)
+
+    if args.mongo:
+        _update_mongo(profiles)
+
+    print(f"\nDone in {time.time() - t_start:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
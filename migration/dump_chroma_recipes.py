@@ -5,71 +5,246 @@ file, so the Node-side import script can bulk-insert them into MongoDB Atlas
 without needing a Python<->Node bridge or a new pymongo dependency.
 
 Does not modify chroma_recipe_db in any way — read-only.
+
+    python migration/dump_chroma_recipes.py [--chroma PATH] [--out-dir DIR]
+                                            [--workers N] [--shard-size N]
+
+The export is sharded and parallel:
+  1. All recipe ids are listed once (ids only, no embeddings) and sorted, so
+     the shard plan is the same on every run.
+  2. Each shard of --shard-size ids is fetched by id (no growing offset
+     scans) and JSON-encoded in a separate worker process, and written to
+     recipes_dump.shards/shard-NNNNN.ndjson.
+  3. A finished shard leaves a checkpoint (shard-NNNNN.json) with its record
+     count, sha256 and a hash of its id list. A re-run skips every shard
+     whose checkpoint still matches its id list and file size, so an interrupted
+     export resumes where it stopped.
+  4. Shards are concatenated into recipes_dump.ndjson, and
+     recipes_dump.manifest.json records per-shard and total record counts
+     and checksums. js_backend/migration/import_recipes_to_mongo.mjs
+     verifies the dump against this manifest before importing.
 """
+import argparse
+import hashlib
 import json
+import os
+import sys
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-import chromadb
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from recipe_tags import compute_tags, ingredients_section, tag_bits  # noqa: E402
 
-CHROMA_PATH = r"C:\Ai_Nutritionist\chroma_recipe_db"
-OUTPUT_PATH = r"C:\Ai_Nutritionist\migration\recipes_dump.ndjson"
-BATCH_SIZE = 2000
+CHROMA_PATH = os.getenv("CHROMA_PATH", os.path.join(ROOT, "chroma_recipe_db"))
+OUTPUT_DIR = os.path.join(ROOT, "migration")
+DUMP_NAME = "recipes_dump"
+SHARD_SIZE = 5000
+FETCH_SIZE = 1000
+ID_PAGE_SIZE = 50000
+EMBEDDING_DIM = 384
 
+_collection = None
 
-def main():
-    client = chromadb.PersistentClient(path=CHROMA_PATH)
-    collection = client.get_collection("recipes")
-    total = collection.count()
-    print(f"Source collection 'recipes' has {total} records.")
 
-    written = 0
+def _open_collection(chroma_path):
+    import chromadb
+    client = chromadb.PersistentClient(path=chroma_path)
+    return client.get_collection("recipes")
+
+
+def _init_worker(chroma_path):
+    # One read-only Chroma client per worker process
+    global _collection
+    _collection = _open_collection(chroma_path)
+
+
+def _to_record(recipe_id, embedding, document, metadata):
+    """(NDJSON record, None) or (None, reason it was skipped)."""
+    # ChromaDB returns embeddings as numpy arrays, not JSON-serializable as-is
+    embedding = embedding.tolist() if embedding is not None else None
+    metadata = metadata or {}
+
+    if embedding is None or len(embedding) != EMBEDDING_DIM:
+        return None, f"bad embedding (len={len(embedding) if embedding is not None else None})"
+    if not document:
+        return None, "missing document text"
+
+    # Stores ingested before tagging existed have no "tags" metadata
+    tags = metadata.get("tags")
+    if tags is None:
+        tags = compute_tags(ingredients_section(document))
+
+    return {
+        "recipeId": recipe_id,
+        "title": metadata.get("title", ""),
+        "source": metadata.get("source", ""),
+        "link": metadata.get("link", ""),
+        "documentText": document,
+        "embedding": embedding,
+        "tags": tags,
+        "tagBits": tag_bits(tags),
+    }, None
+
+
+def _ids_hash(ids):
+    return hashlib.sha256("\n".join(ids).encode("utf-8")).hexdigest()
+
+
+def _write_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _export_shard(task):
+    """Worker: fetch one shard's ids from Chroma, encode, write, checkpoint."""
+    index, ids, shard_path, checkpoint_path = task
+    h = hashlib.sha256()
+    written, size = 0, 0
     skipped = []
-    t_start = time.time()
 
-    with open(OUTPUT_PATH, "w", encoding="utf-8") as out:
-        offset = 0
-        while offset < total:
-            batch = collection.get(
-                limit=BATCH_SIZE,
-                offset=offset,
+    tmp = shard_path + ".tmp"
+    with open(tmp, "wb") as out:
+        for start in range(0, len(ids), FETCH_SIZE):
+            batch = _collection.get(
+                ids=ids[start:start + FETCH_SIZE],
                 include=["embeddings", "documents", "metadatas"],
             )
-            ids = batch["ids"]
-            embeddings = batch["embeddings"]
-            documents = batch["documents"]
-            metadatas = batch["metadatas"]
-
-            for i in range(len(ids)):
-                recipe_id = ids[i]
-                embedding = embeddings[i]
-                # ChromaDB returns embeddings as numpy arrays, not JSON-serializable as-is
-                embedding = embedding.tolist() if embedding is not None else None
-                document = documents[i]
-                metadata = metadatas[i] or {}
-
-                if embedding is None or len(embedding) != 384:
-                    skipped.append((recipe_id, f"bad embedding (len={len(embedding) if embedding is not None else None})"))
-                    continue
-                if not document:
-                    skipped.append((recipe_id, "missing document text"))
+            for recipe_id, embedding, document, metadata in zip(
+                batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"]
+            ):
+                record, reason = _to_record(recipe_id, embedding, document, metadata)
+                if record is None:
+                    skipped.append([recipe_id, reason])
                     continue
-
-                record = {
-                    "recipeId": recipe_id,
-                    "title": metadata.get("title", ""),
-                    "source": metadata.get("source", ""),
-                    "link": metadata.get("link", ""),
-                    "documentText": document,
-                    "embedding": embedding,
-                }
-                out.write(json.dumps(record) + "\n")
+                line = (json.dumps(record) + "\n").encode("utf-8")
+                out.write(line)
+                h.update(line)
                 written += 1
+                size += len(line)
+    os.replace(tmp, shard_path)
+
+    checkpoint = {
+        "shard": index,
+        "file": os.path.basename(shard_path),
+        "records": written,
+        "bytes": size,
+        "sha256": h.hexdigest(),
+        "idsSha256": _ids_hash(ids),
+        "skipped": skipped,
+    }
+    _write_json(checkpoint_path, checkpoint)
+    return checkpoint
+
+
+def _valid_checkpoint(checkpoint_path, shard_path, ids):
+    """The checkpoint, if it still matches this shard's ids and file."""
+    if not (os.path.exists(checkpoint_path) and os.path.exists(shard_path)):
+        return None
+    try:
+        with open(checkpoint_path, encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except ValueError:
+        return None
+    if checkpoint.get("idsSha256") != _ids_hash(ids) or os.path.getsize(shard_path) != checkpoint.get("bytes"):
+        return None
+    return checkpoint
+
+
+def _list_ids(collection):
+    # Ids only, paged — far cheaper than paging whole records with offsets
+    ids, offset = [], 0
+    while True:
+        page = collection.get(limit=ID_PAGE_SIZE, offset=offset, include=[])["ids"]
+        ids.extend(page)
+        if len(page) < ID_PAGE_SIZE:
+            break
+        offset += ID_PAGE_SIZE
+    # "recipe_9" before "recipe_10": length first, then lexical
+    return sorted(ids, key=lambda rid: (len(rid), rid))
+
+
+def _merge(shard_paths, output_path):
+    h = hashlib.sha256()
+    size = 0
+    tmp = output_path + ".tmp"
+    with open(tmp, "wb") as out:
+        for path in shard_paths:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    out.write(chunk)
+                    h.update(chunk)
+                    size += len(chunk)
+    os.replace(tmp, output_path)
+    return h.hexdigest(), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the Chroma recipe store to sharded NDJSON.")
+    parser.add_argument("--chroma", default=CHROMA_PATH, help="ChromaDB persist directory")
+    parser.add_argument("--out-dir", default=OUTPUT_DIR)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--no-merge", action="store_true", help="leave the shards unmerged")
+    args = parser.parse_args()
+
+    t_start = time.time()
+    shard_dir = os.path.join(args.out_dir, DUMP_NAME + ".shards")
+    os.makedirs(shard_dir, exist_ok=True)
+
+    ids = _list_ids(_open_collection(args.chroma))
+    print(f"Source collection 'recipes' has {len(ids)} records.")
+
+    shards = [ids[i:i + args.shard_size] for i in range(0, len(ids), args.shard_size)]
+    tasks, checkpoints = [], {}
+    for index, shard_ids in enumerate(shards):
+        shard_path = os.path.join(shard_dir, f"shard-{index:05d}.ndjson")
+        checkpoint_path = os.path.join(shard_dir, f"shard-{index:05d}.json")
+        checkpoint = _valid_checkpoint(checkpoint_path, shard_path, shard_ids)
+        if checkpoint is not None:
+            checkpoints[index] = checkpoint
+        else:
+            tasks.append((index, shard_ids, shard_path, checkpoint_path))
+    print(f"{len(shards)} shards: {len(checkpoints)} already done, {len(tasks)} to export "
+          f"with {args.workers} workers.")
+
+    if tasks:
+        with ProcessPoolExecutor(
+            max_workers=min(args.workers, len(tasks)), initializer=_init_worker, initargs=(args.chroma,)
+        ) as pool:
+            futures = [pool.submit(_export_shard, task) for task in tasks]
+            for future in as_completed(futures):
+                checkpoint = future.result()
+                checkpoints[checkpoint["shard"]] = checkpoint
+                print(f"  shard {checkpoint['shard']:05d}: {checkpoint['records']} records "
+                      f"({len(checkpoints)}/{len(shards)} done, {time.time() - t_start:.1f}s elapsed)")
+
+    ordered = [checkpoints[i] for i in range(len(shards))]
+    written = sum(c["records"] for c in ordered)
+    skipped = [entry for c in ordered for entry in c["skipped"]]
 
-            offset += BATCH_SIZE
-            elapsed = time.time() - t_start
-            print(f"  processed {min(offset, total)}/{total} ({elapsed:.1f}s elapsed)")
+    manifest = {
+        "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "source": os.path.abspath(args.chroma),
+        "embeddingDim": EMBEDDING_DIM,
+        "sourceRecords": len(ids),
+        "records": written,
+        "skipped": len(skipped),
+        "shards": [{k: c[k] for k in ("file", "records", "bytes", "sha256")} for c in ordered],
+        "shardDir": os.path.basename(shard_dir),
+    }
+    if not args.no_merge:
+        output_path = os.path.join(args.out_dir, DUMP_NAME + ".ndjson")
+        sha256, size = _merge([os.path.join(shard_dir, c["file"]) for c in ordered], output_path)
+        manifest["merged"] = {"file": os.path.basename(output_path), "records": written, "bytes": size,
+                              "sha256": sha256}
+        print(f"Merged shards into {output_path}")
+    manifest_path = os.path.join(args.out_dir, DUMP_NAME + ".manifest.json")
+    _write_json(manifest_path, manifest)
 
-    print(f"\nDone in {time.time()-t_start:.1f}s. Wrote {written} records to {OUTPUT_PATH}.")
+    print(f"\nDone in {time.time()-t_start:.1f}s. Wrote {written} records; manifest at {manifest_path}.")
     print(f"Skipped {len(skipped)} records.")
     if skipped:
         print("Skipped records (id, reason):")
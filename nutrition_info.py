@@ -1,26 +1,40 @@
 import os
 import re
-import requests
 from dotenv import load_dotenv
 
+import shared_cache
+import usda_client
+from admission import check_deadline
+
 # ----------------------------------------------------
 # 🔧 Setup
 # ----------------------------------------------------
 load_dotenv()
 
-USDA_API_KEY = os.getenv("USDA_API_KEY")
-BASE_URL = "https://api.nal.usda.gov/fdc/v1/foods/search"
-
-# Maps our tracked micronutrient keys to the USDA FoodData Central nutrient name
-# and the unit we report it in. Extend this to track more nutrients over time.
+# Maps our tracked micronutrient keys to the USDA FoodData Central nutrient name,
+# its FDC nutrient id (what usda_client matches on) and the unit we report it
+# in. Extend this to track more nutrients over time.
 TRACKED_NUTRIENTS = {
-    "fiber": {"usda_name": "Fiber, total dietary", "unit": "g"},
-    "iron": {"usda_name": "Iron, Fe", "unit": "mg"},
-    "calcium": {"usda_name": "Calcium, Ca", "unit": "mg"},
-    "vitaminD": {"usda_name": "Vitamin D (D2 + D3)", "unit": "mcg"},
-    "vitaminC": {"usda_name": "Vitamin C, total ascorbic acid", "unit": "mg"},
-    "potassium": {"usda_name": "Potassium, K", "unit": "mg"},
+    "fiber": {"usda_name": "Fiber, total dietary", "usda_id": 1079, "unit": "g"},
+    "iron": {"usda_name": "Iron, Fe", "usda_id": 1089, "unit": "mg"},
+    "calcium": {"usda_name": "Calcium, Ca", "usda_id": 1087, "unit": "mg"},
+    "vitaminD": {"usda_name": "Vitamin D (D2 + D3)", "usda_id": 1114, "unit": "mcg"},
+    "vitaminC": {"usda_name": "Vitamin C, total ascorbic acid", "usda_id": 1162, "unit": "mg"},
+    "potassium": {"usda_name": "Potassium, K", "usda_id": 1092, "unit": "mg"},
+}
+
+# Macro nutrient ids, in order of preference. Foundation foods often report
+# energy only as Atwater kcal (2047/2048) and fat/carbs under alternate ids;
+# kJ energy (1062) is never used.
+MACRO_NUTRIENT_IDS = {
+    "calories": (1008, 2047, 2048),
+    "protein": (1003,),
+    "fat": (1004, 1085),
+    "carbs": (1005, 1050),
 }
+_NUTRIENT_IDS = [i for ids in MACRO_NUTRIENT_IDS.values() for i in ids] + [
+    spec["usda_id"] for spec in TRACKED_NUTRIENTS.values()
+]
 
 # Lazy ChromaDB initialization — don't load at import time
 _client = None
@@ -32,68 +46,57 @@ def _get_collection():
     return None
 
 
-# Shared HTTP session for USDA calls. requests.get() opens a fresh TCP+TLS
-# connection every call (~0.9-1.2s handshake, confirmed by measurement); reusing
-# one Session lets urllib3 keep the connection alive across calls, so only the
-# first request in a process pays the handshake.
-_usda_session = None
+# USDA lookups are shared by every worker on the host (shared_cache.py); bump
+# the version whenever the shape of fetch_food_data()'s result changes
+USDA_CACHE_TTL = float(os.getenv("USDA_CACHE_TTL", 7 * 86400))
+_usda_cache = shared_cache.get_cache("usda", version=1, ttl=USDA_CACHE_TTL)
+
 
+def fetch_food_data(food_name):
+    """Fetch food data from USDA FoodData Central API, through the shared cache.
 
-def _get_usda_session():
-    global _usda_session
-    if _usda_session is None:
-        _usda_session = requests.Session()
-    return _usda_session
+    Only successful lookups are cached; a network error or empty result is
+    retried on the next call.
+    """
+    key = re.sub(r"\s+", " ", food_name.lower()).strip()
+    return _usda_cache.get_or_compute(key, lambda: _fetch_food_data(food_name))
 
 
 # Fetch from USDA API
-def fetch_food_data(food_name):
-    """Fetch food data from USDA FoodData Central API."""
-    params = {
-        "query": food_name,
-        "pageSize": 5,  # Increased to get better matches
-        "api_key": USDA_API_KEY,
-        "dataType": ["Foundation", "SR Legacy"]  # Filter for better quality data
-    }
+def _fetch_food_data(food_name):
+    """Fetch food data from USDA FoodData Central API.
 
+    usda_client ranks the search results locally and keeps only the nutrient
+    ids tracked here, so the best candidate is used, not just the first one.
+    """
     try:
-        session = _get_usda_session()
-        response = session.get(BASE_URL, params=params, timeout=10)
-
-        if response.status_code != 200:
-            print(f"USDA API Error ({response.status_code}): {response.text}")
+        candidates = usda_client.search(food_name, _NUTRIENT_IDS)
+        if candidates is None:
             return None
-
-        data = response.json()
-        if "foods" not in data or not data["foods"]:
+        if not candidates:
             print(f"No food data found for '{food_name}'")
             return None
 
-        # Get the best match (first result)
-        item = data["foods"][0]
+        item = candidates[0]
+        values = item["nutrients"]
 
-        # Extract nutrients more reliably
-        nutrients = {}
-        for nutrient in item.get("foodNutrients", []):
-            name = nutrient.get("nutrientName")
-            value = nutrient.get("value")
-            if name and value is not None:
-                nutrients[name] = value
+        def first(ids):
+            return next((values[i] for i in ids if i in values), "N/A")
 
-        # Build document text
-        energy = nutrients.get('Energy', 'N/A')
-        protein = nutrients.get('Protein', 'N/A')
-        fat = nutrients.get('Total lipid (fat)', 'N/A')
-        carbs = nutrients.get('Carbohydrate, by difference', 'N/A')
+        energy = first(MACRO_NUTRIENT_IDS["calories"])
+        protein = first(MACRO_NUTRIENT_IDS["protein"])
+        fat = first(MACRO_NUTRIENT_IDS["fat"])
+        carbs = first(MACRO_NUTRIENT_IDS["carbs"])
 
         # Micronutrients tracked for the Nutrient Gap Tracker (may be missing per food)
         micros = {
-            key: nutrients.get(spec["usda_name"], 0) or 0
+            key: values.get(spec["usda_id"], 0) or 0
             for key, spec in TRACKED_NUTRIENTS.items()
         }
 
+        # Build document text
         doc = (
-            f"{item.get('description', 'Unknown').upper()} (FDC ID: {item.get('fdcId', 'N/A')}): "
+            f"{(item['description'] or 'Unknown').upper()} (FDC ID: {item.get('fdcId') or 'N/A'}): "
             f"Energy: {energy} kcal, "
             f"Protein: {protein} g, "
             f"Fat: {fat} g, "
@@ -101,7 +104,7 @@ def fetch_food_data(food_name):
         )
 
         return {
-            "id": str(item.get("fdcId", food_name)),
+            "id": str(item.get("fdcId") or food_name),
             "document": doc,
             "name": food_name.lower(),
             "nutrients": {
@@ -122,7 +125,7 @@ def fetch_food_data(food_name):
             }
         }
 
-    except requests.exceptions.RequestException as e:
+    except IOError as e:  # requests.exceptions.RequestException subclasses IOError
         print(f"Network error fetching '{food_name}': {e}")
         return None
     except Exception as e:
@@ -221,7 +224,12 @@ def prefetch_foods_data(meal_text):
     if not meal_text or not isinstance(meal_text, str):
         return {}
     foods = extract_foods_from_text(meal_text)
-    return {food: fetch_food_data(food) for food in foods}
+    foods_data = {}
+    for food in foods:
+        # Stop issuing USDA calls once the request's time budget is spent
+        check_deadline("USDA lookup")
+        foods_data[food] = fetch_food_data(food)
+    return foods_data
 
 
 # Analyze a meal - improved version
@@ -0,0 +1,111 @@
+"""
+Compact, token-budgeted context sections for the ai_nutritionist prompt.
+
+Recipes are deduplicated by title and cut to "Title: key ingredients" (plus
+per-serving calories and protein when a nutrient profile exists), then
+trimmed to a token budget; nutrition is one compact table row per food.
+Each section reports its estimated token count.
+"""
+import json
+import os
+import re
+
+from recipe_nutrition import usable
+from recipe_tags import ingredients_section
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 600))
+MAX_RECIPE_INGREDIENTS = 8
+
+_QUANTITY_RE = re.compile(
+    r"^[\d\s/.,½¼¾⅓⅔-]*"
+    r"(c|cups?|tbsp|tsp|tablespoons?|teaspoons?|oz|ounces?|lbs?|pounds?|pkg|packages?|"
+    r"cans?|jars?|qt|pt|g|kg|ml|l|sticks?|dash|pinch|large|small|medium)?\.?\s+",
+    re.I,
+)
+
+
+def estimate_tokens(text):
+    """Rough Gemini token count (~4 characters per token for English)."""
+    return (len(text) + 3) // 4 if text else 0
+
+
+def _ingredient_names(document_text, limit):
+    section = ingredients_section(document_text).strip()
+    try:
+        lines = json.loads(section)
+    except ValueError:
+        lines = section.split(",")
+
+    names = []
+    for line in lines:
+        name = re.sub(r"\(.*?\)", "", str(line))
+        name = _QUANTITY_RE.sub("", name.strip()).split(",")[0].strip(" .;")
+        if name and name.lower() not in names:
+            names.append(name.lower())
+        if len(names) >= limit:
+            break
+    return names
+
+
+def summarize_recipes(recipes, max_ingredients=MAX_RECIPE_INGREDIENTS):
+    """One line per distinct recipe: "- Title (~kcal, protein/serving): ingredient, ..."."""
+    lines, seen = [], set()
+    for recipe in recipes:
+        title = (recipe.get("title") or "").strip()
+        if not title:
+            match = re.search(r"Title:\s*(.+)", recipe.get("documentText", ""))
+            title = match.group(1).strip() if match else "Untitled"
+        key = re.sub(r"\W+", " ", title.lower()).strip()
+        if key in seen:
+            continue
+        seen.add(key)
+        ingredients = _ingredient_names(recipe.get("documentText", ""), max_ingredients)
+        profile = recipe.get("nutrition")
+        if usable(profile):
+            per = profile["perServing"]
+            title += f" (~{round(per['calories'])} kcal, {round(per['protein'])} g protein/serving)"
+        lines.append(f"- {title}: {', '.join(ingredients)}")
+    return lines
+
+
+def nutrient_table(foods_data):
+    """Compact per-food macro table from prefetch_foods_data() output."""
+    rows = ["food | kcal | protein g | carbs g | fat g"]
+    for food, item in (foods_data or {}).items():
+        if not item:
+            rows.append(f"{food} | ? | ? | ? | ?")
+            continue
+        n = item["nutrients"]
+        rows.append(
+            f"{food} | {round(n.get('calories', 0))} | {round(n.get('protein', 0), 1)} | "
+            f"{round(n.get('carbs', 0), 1)} | {round(n.get('fat', 0), 1)}"
+        )
+    if len(rows) == 1:
+        return "No nutrition data available."
+    return "\n".join(rows)
+
+
+def build_context(ingredients, foods_data, recipes, budget=PROMPT_TOKEN_BUDGET):
+    """Return ({section: text}, {section: estimated tokens}).
+
+    Ingredients and the nutrient table are always kept; recipes get whatever
+    is left of the budget, dropped from the lowest-ranked end first and cut
+    to fewer ingredients if even the best one doesn't fit.
+    """
+    sections = {
+        "ingredients": ", ".join(ingredients),
+        "nutrition": nutrient_table(foods_data),
+    }
+    remaining = budget - sum(estimate_tokens(text) for text in sections.values())
+
+    recipe_lines = summarize_recipes(recipes)
+    kept = []
+    for line in recipe_lines:
+        if estimate_tokens("\n".join(kept + [line])) > remaining:
+            break
+        kept.append(line)
+    if not kept and recipe_lines:
+        kept = summarize_recipes(recipes[:1], max_ingredients=4)
+    sections["recipes"] = "\n".join(kept) or "No matching recipes found; suggest custom recipes."
+
+    return sections, {name: estimate_tokens(text) for name, text in sections.items()}
@@ -3,7 +3,9 @@ import pandas as pd
 import chromadb
 from chromadb.config import Settings
 from tqdm import tqdm
-from sentence_transformers import SentenceTransformer
+
+import embedding_service
+from recipe_tags import compute_tags
 
 
 DATA_PATH = "dataset/full_dataset.csv"
@@ -18,7 +20,15 @@ collection = client.get_or_create_collection("recipes")
 
 
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+# Reuse the host's embedding service when one is configured instead of
+# loading a second copy of the model next to the running API.
+if embedding_service.ENABLED:
+    embedding_service.ensure_running()
+    encode = embedding_service.encode
+else:
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer("all-MiniLM-L6-v2")
+    encode = lambda docs: model.encode(docs, show_progress_bar=False)
 
 
 
@@ -41,10 +51,13 @@ def add_batch(batch_df, start_index):
         metas.append({
             "source": "recipe_dataset",
             "link": row.get("link", ""),
-            "title": row["title"]
+            "title": row["title"],
+            # Ingredient tag bitset (allergens, meat, dairy, gluten...) used to
+            # pre-filter recipe search by diet and allergies — see recipe_tags.py
+            "tags": compute_tags(row["ingredients"])
         })
 
-    embeddings = model.encode(docs, show_progress_bar=False).tolist()
+    embeddings = encode(docs).tolist()
 
     collection.add(
         ids=ids,
@@ -0,0 +1,408 @@
+"""
+Tuned MongoDB Atlas Vector Search retrieval for recipe search.
+
+  - One client per process with explicit pool bounds and timeouts
+    (MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS); maxTimeMS is
+    capped to the request deadline, and warm_pool() opens the minimum pool
+    during warm-up.
+  - A projection that cuts documentText at "Directions:" on the server.
+  - CandidateTuner adapts numCandidates: a sample of searches
+    (ATLAS_RECALL_SAMPLE) is re-run as exact search in the background, and
+    the ratio tracks ATLAS_RECALL_TARGET and ATLAS_LATENCY_TARGET_MS.
+  - ExactIndex, a brute-force numpy fallback for servers without
+    $vectorSearch, scoring (1 + cosine) / 2 like Atlas.
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import memory_governor
+from admission import clamp_timeout
+from recipe_tags import tag_bits
+
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 16))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 2))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 3000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 10000))
+ATLAS_QUERY_TIMEOUT = float(os.getenv("ATLAS_QUERY_TIMEOUT", 5))
+
+ATLAS_LATENCY_TARGET_MS = float(os.getenv("ATLAS_LATENCY_TARGET_MS", 150))
+ATLAS_RECALL_TARGET = float(os.getenv("ATLAS_RECALL_TARGET", 0.95))
+ATLAS_RECALL_SAMPLE = float(os.getenv("ATLAS_RECALL_SAMPLE", 0.02))
+ATLAS_MIN_CANDIDATES = int(os.getenv("ATLAS_MIN_CANDIDATES", 50))
+ATLAS_MAX_CANDIDATES = int(os.getenv("ATLAS_MAX_CANDIDATES", 2000))
+
+INDEX_NAME = "recipe_vector_index"
+COLLECTION_NAME = "recipeEmbeddings"
+EMBEDDING_DIM = 384
+
+# Title + ingredients only; prompt_builder never reads the directions
+PROMPT_TEXT = {"$arrayElemAt": [{"$split": ["$documentText", "\nDirections:"]}, 0]}
+RESULT_PROJECTION = {"_id": 0, "recipeId": 1, "title": 1, "documentText": PROMPT_TEXT, "nutrition": 1}
+
+_client = None
+_client_lock = threading.Lock()
+_vector_search_supported = None   # None until the first search tells us
+_exact_index = None
+_exact_lock = threading.Lock()
+_audit_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="atlas-audit")
+_audit_slot = threading.Semaphore(1)
+
+
+def _reset_after_fork():
+    # A MongoClient must not be used across fork(); each worker opens its own
+    global _client, _audit_pool, _audit_slot
+    _client = None
+    _audit_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="atlas-audit")
+    _audit_slot = threading.Semaphore(1)
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            from pymongo import MongoClient
+            _client = MongoClient(
+                os.getenv("MONGO_URI"),
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                maxIdleTimeMS=300_000,
+                waitQueueTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                connectTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                retryReads=True,
+                appname="ai-nutritionist-python",
+            )
+        return _client
+
+
+def get_collection():
+    return get_client().get_default_database()[COLLECTION_NAME]
+
+
+def warm_pool(connections=MONGO_MIN_POOL_SIZE):
+    """Open `connections` pooled connections now and probe $vectorSearch support."""
+    client = get_client()
+    client.admin.command("ping")
+    if connections > 1:
+        # Concurrent commands each check out their own connection
+        with ThreadPoolExecutor(max_workers=connections) as pool:
+            list(pool.map(lambda _: client.admin.command("ping"), range(connections)))
+    probe = np.random.default_rng(0).normal(size=EMBEDDING_DIM)
+    vector_search((probe / np.linalg.norm(probe)).tolist(), 1, 0, num_candidates=1)
+
+
+def _max_time_ms(timeout=ATLAS_QUERY_TIMEOUT):
+    return int(clamp_timeout(timeout) * 1000)
+
+
+def _is_unsupported(error):
+    # Plain mongod: "Unrecognized pipeline stage name: '$vectorSearch'" (40324),
+    # or newer servers' "only allowed on Atlas"-style refusals
+    message = str(error)
+    return getattr(error, "code", None) == 40324 or ("vectorSearch" in message and (
+        "nrecognized" in message or "not allowed" in message or "only" in message or "not supported" in message))
+
+
+# ----------------------------------------------------------------------------
+# Adaptive numCandidates
+# ----------------------------------------------------------------------------
+
+class CandidateTuner:
+    """numCandidates = limit * ratio, with the ratio steered by recall and latency."""
+
+    def __init__(self, latency_target_ms=ATLAS_LATENCY_TARGET_MS, recall_target=ATLAS_RECALL_TARGET,
+                 min_candidates=ATLAS_MIN_CANDIDATES, max_candidates=ATLAS_MAX_CANDIDATES,
+                 initial_ratio=20.0, min_ratio=2.0, max_ratio=100.0, window=200, adjust_every=50,
+                 min_audits=5, recall_margin=0.02):
+        self.latency_target_ms = latency_target_ms
+        self.recall_target = recall_target
+        self.min_candidates = min_candidates
+        self.max_candidates = max_candidates
+        self.ratio = initial_ratio
+        self.min_ratio = min_ratio
+        self.max_ratio = max_ratio
+        self.adjust_every = adjust_every
+        self.min_audits = min_audits
+        self.recall_margin = recall_margin
+        self._latencies = deque(maxlen=window)
+        self._since_adjust = 0
+        self._recall = None           # mean recall of audits at the current ratio
+        self._audits = 0              # audits at the current ratio
+        self._lock = threading.Lock()
+        self._stats = {"searches": 0, "audits": 0, "raised": 0, "lowered": 0}
+
+    def num_candidates(self, limit):
+        with self._lock:
+            return self._num_candidates(limit)
+
+    def _num_candidates(self, limit):
+        # Atlas requires limit <= numCandidates <= 10000
+        n = int(limit * self.ratio)
+        return max(limit, min(max(n, self.min_candidates), self.max_candidates, 10000))
+
+    def observe_latency(self, ms):
+        with self._lock:
+            self._latencies.append(ms)
+            self._since_adjust += 1
+            self._stats["searches"] += 1
+            if self._since_adjust >= self.adjust_every:
+                self._adjust()
+
+    def observe_recall(self, recall, ratio):
+        with self._lock:
+            self._stats["audits"] += 1
+            if ratio != self.ratio:
+                return  # measured before the last adjustment
+            self._audits += 1
+            self._recall = recall if self._recall is None else self._recall + (recall - self._recall) / self._audits
+            if self._audits >= self.min_audits:
+                self._adjust()
+
+    def _p90(self):
+        if len(self._latencies) < 20:
+            return None
+        return float(np.percentile(self._latencies, 90))
+
+    def _adjust(self):
+        self._since_adjust = 0
+        p90 = self._p90()
+        slow = p90 is not None and p90 > self.latency_target_ms
+        measured = self._recall is not None and self._audits >= self.min_audits
+
+        if measured and self._recall < self.recall_target:
+            # Quality first; but past the latency budget there's nothing to trade
+            factor = 1.0 if slow else 1.25
+        elif slow:
+            factor = 0.8
+        elif measured and self._recall >= self.recall_target + self.recall_margin:
+            factor = 0.9
+        else:
+            return
+        ratio = min(max(self.ratio * factor, self.min_ratio), self.max_ratio)
+        if ratio == self.ratio:
+            return
+        self._stats["raised" if ratio > self.ratio else "lowered"] += 1
+        self.ratio = ratio
+        # Fresh measurements for the new ratio
+        self._latencies.clear()
+        self._recall = None
+        self._audits = 0
+
+    def stats(self):
+        with self._lock:
+            p90 = self._p90()
+            return {
+                **self._stats,
+                "ratio": round(self.ratio, 2),
+                "numCandidatesAt5": self._num_candidates(5),
+                "p90Ms": round(p90, 1) if p90 is not None else None,
+                "recall": round(float(self._recall), 4) if self._recall is not None else None,
+                "latencyTargetMs": self.latency_target_ms,
+                "recallTarget": self.recall_target,
+            }
+
+
+tuner = CandidateTuner()
+
+
+# ----------------------------------------------------------------------------
+# Brute-force fallback
+# ----------------------------------------------------------------------------
+
+class ExactIndex:
+    """Every embedding in the collection, scored exactly in memory."""
+
+    def __init__(self, recipe_ids, embeddings, tags):
+        self.recipe_ids = recipe_ids
+        self.row_of = {rid: i for i, rid in enumerate(recipe_ids)}
+        self.embeddings = embeddings
+        self.tags = tags
+
+    @classmethod
+    def from_collection(cls, collection):
+        recipe_ids, vectors, tags = [], [], []
+        for doc in collection.find({}, {"_id": 0, "recipeId": 1, "embedding": 1, "tags": 1}, batch_size=2000):
+            embedding = doc.get("embedding")
+            if not embedding or len(embedding) != EMBEDDING_DIM:
+                continue
+            recipe_ids.append(doc["recipeId"])
+            vectors.append(embedding)
+            tags.append(doc.get("tags") or 0)
+        embeddings = np.asarray(vectors, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return cls(recipe_ids, embeddings, np.asarray(tags, dtype=np.uint32))
+
+    def nbytes(self):
+        return self.embeddings.nbytes + self.tags.nbytes + sum(len(r) for r in self.recipe_ids)
+
+    def search(self, query_vector, limit, exclude_mask=0, recipe_ids=None):
+        """[(recipeId, score)] best first, optionally only among `recipe_ids`."""
+        query = np.asarray(query_vector, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        if recipe_ids is not None:
+            rows = np.array([self.row_of[r] for r in recipe_ids if r in self.row_of], dtype=np.int64)
+        else:
+            rows = np.arange(len(self.recipe_ids))
+        if exclude_mask and len(rows):
+            rows = rows[(self.tags[rows] & np.uint32(exclude_mask)) == 0]
+        if not len(rows):
+            return []
+        scores = self.embeddings[rows] @ query
+        n = min(limit, len(rows))
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top])]
+        return [(self.recipe_ids[rows[i]], (1.0 + float(scores[i])) / 2) for i in top]
+
+
+def _get_exact_index():
+    global _exact_index
+    with _exact_lock:
+        if _exact_index is None:
+            print("Loading recipe embeddings for exact search (no $vectorSearch on this server)...")
+            _exact_index = ExactIndex.from_collection(get_collection())
+            print(f"Exact recipe index loaded ({len(_exact_index.recipe_ids)} recipes)")
+            memory_governor.register("atlas_exact_index", lambda: _exact_index.nbytes() if _exact_index else 0,
+                                     _unload_exact_index)
+    memory_governor.touch("atlas_exact_index")
+    return _exact_index
+
+
+def _unload_exact_index():
+    global _exact_index
+    _exact_index = None
+
+
+def fetch_results(scored):
+    """Projected result dicts for [(recipeId, score)], in that order."""
+    if not scored:
+        return []
+    docs = {d["recipeId"]: d for d in get_collection().find(
+        {"recipeId": {"$in": [rid for rid, _ in scored]}}, RESULT_PROJECTION, max_time_ms=_max_time_ms())}
+    return [_result(docs[rid], score) for rid, score in scored if rid in docs]
+
+
+def _result(doc, score):
+    result = {"recipeId": doc["recipeId"], "title": doc.get("title", ""), "documentText": doc["documentText"],
+              "score": score}
+    if doc.get("nutrition"):
+        result["nutrition"] = doc["nutrition"]
+    return result
+
+
+# ----------------------------------------------------------------------------
+# Search
+# ----------------------------------------------------------------------------
+
+def _filter(exclude_mask, recipe_ids=None):
+    filters = []
+    if recipe_ids is not None:
+        filters.append({"recipeId": {"$in": list(recipe_ids)}})
+    if exclude_mask:
+        filters.append({"tagBits": {"$nin": tag_bits(exclude_mask)}})
+    if not filters:
+        return None
+    return {"$and": filters} if len(filters) > 1 else filters[0]
+
+
+def _aggregate(vector_search, project, timeout=ATLAS_QUERY_TIMEOUT):
+    pipeline = [{"$vectorSearch": vector_search}, {"$project": {**project, "score": {"$meta": "vectorSearchScore"}}}]
+    return list(get_collection().aggregate(pipeline, maxTimeMS=_max_time_ms(timeout)))
+
+
+def _run(query_vector, limit, exclude_mask, recipe_ids=None, num_candidates=None, project=RESULT_PROJECTION):
+    """Approximate (or, without num_candidates, exact) $vectorSearch; brute force where unsupported."""
+    global _vector_search_supported
+    if _vector_search_supported is not False:
+        from pymongo.errors import OperationFailure
+
+        vector_search = {"index": INDEX_NAME, "path": "embedding", "queryVector": query_vector, "limit": limit}
+        if num_candidates is None:
+            vector_search["exact"] = True
+        else:
+            vector_search["numCandidates"] = num_candidates
+        search_filter = _filter(exclude_mask, recipe_ids)
+        if search_filter:
+            # Pre-filter inside $vectorSearch so excluded recipes never take a
+            # top-k slot. Requires `tagBits` (and `recipeId`, for hybrid
+            # search) declared as filter fields on recipe_vector_index.
+            vector_search["filter"] = search_filter
+        try:
+            docs = _aggregate(vector_search, project)
+            _vector_search_supported = True
+            return docs
+        except OperationFailure as e:
+            if not _is_unsupported(e):
+                raise
+            print(f"$vectorSearch unavailable ({e}); using exact in-memory search")
+            _vector_search_supported = False
+
+    scored = _get_exact_index().search(query_vector, limit, exclude_mask, recipe_ids)
+    if project is not RESULT_PROJECTION:
+        return [{"recipeId": rid, "score": score} for rid, score in scored]
+    return fetch_results(scored)
+
+
+def vector_search(query_vector, limit, exclude_mask=0, num_candidates=None):
+    """Top `limit` recipes, best first, with numCandidates from the tuner.
+
+    An explicit `num_candidates` bypasses the tuner (recipe_eval.py sweeps).
+    """
+    tuned = num_candidates is None
+    ratio = tuner.ratio
+    n = tuner.num_candidates(limit) if tuned else num_candidates
+    t_start = time.perf_counter()
+    results = _run(query_vector, limit, exclude_mask, num_candidates=n)
+    if tuned and _vector_search_supported:
+        tuner.observe_latency((time.perf_counter() - t_start) * 1000)
+        _maybe_audit(query_vector, limit, exclude_mask, [r["recipeId"] for r in results], ratio)
+    return results
+
+
+def exact_scores(query_vector, recipe_ids, exclude_mask=0):
+    """[{"recipeId", "score"}] for exactly these recipes (hybrid dense stage)."""
+    return _run(query_vector, len(recipe_ids), exclude_mask, recipe_ids=recipe_ids, project={"_id": 0, "recipeId": 1})
+
+
+def _maybe_audit(query_vector, limit, exclude_mask, approx_ids, ratio):
+    # At most one audit in flight; skipped rather than queued under load
+    if ATLAS_RECALL_SAMPLE <= 0 or random.random() >= ATLAS_RECALL_SAMPLE or not _audit_slot.acquire(False):
+        return
+
+    def audit():
+        try:
+            exact = _aggregate(
+                {"index": INDEX_NAME, "path": "embedding", "queryVector": query_vector, "limit": limit,
+                 "exact": True, **({"filter": _filter(exclude_mask)} if exclude_mask else {})},
+                {"_id": 0, "recipeId": 1}, timeout=30,
+            )
+            exact_ids = {d["recipeId"] for d in exact}
+            if exact_ids:
+                tuner.observe_recall(len(exact_ids & set(approx_ids)) / len(exact_ids), ratio)
+        except Exception as e:
+            print(f"Atlas recall audit failed: {e}")
+        finally:
+            _audit_slot.release()
+
+    try:
+        _audit_pool.submit(audit)
+    except RuntimeError:
+        _audit_slot.release()
+
+
+def stats():
+    return {
+        "vectorSearch": _vector_search_supported,
+        "exactIndexLoaded": _exact_index is not None,
+        "tuner": tuner.stats(),
+    }
@@ -0,0 +1,212 @@
+"""
+Offline quality-vs-latency evaluation for recipe search.
+
+Changing numCandidates, the index type or the quantization used to be a
+guess. This tool measures it against the exported corpus
+(RECIPE_INDEX_PATH), entirely locally:
+
+  1. Builds a realistic query set: ingredient lists ("chicken, rice,
+     broccoli") sampled from random corpus recipes, or read from a file
+     (--queries, one query per line).
+  2. Embeds the queries with the production model (recipe_query.embed). With
+     --synthetic-vectors it uses slightly perturbed embeddings of the source
+     recipes instead, so no model is needed.
+  3. Computes brute-force float32 ground truth (exact top-k cosine) over the
+     whole corpus.
+  4. Sweeps configurations: exact, int8 and binary quantization at several
+     rescoring depths, and hybrid BM25+dense at several shortlist sizes. With
+     --atlas and MONGO_URI set, it also sweeps Atlas numCandidates.
+
+For each configuration it reports recall@k, nDCG@k (gain = the exact cosine
+of each returned recipe), p50/p99 latency, single-thread QPS and index
+memory. The table is printed and a JSON report is written.
+
+    python recipe_eval.py [--k 10] [--num-queries 200] [--output eval.json]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from recipe_index import LocalRecipeIndex
+from recipe_nutrition import ingredient_lines, parse_ingredient
+
+DEFAULT_PATH = os.getenv("RECIPE_INDEX_PATH", "migration/recipes_dump.ndjson")
+
+QUANTIZED_SWEEP = {"int8": (25, 50, 100, 200), "binary": (50, 100, 200, 400, 800)}
+HYBRID_SHORTLISTS = (50, 100, 200, 400)
+ATLAS_NUM_CANDIDATES = (50, 100, 200, 400, 800)
+
+
+def sample_queries(index, num_queries, seed=0):
+    """(query text, source row) pairs: 2-5 ingredients of random recipes."""
+    rng = random.Random(seed)
+    queries = []
+    rows = list(range(len(index)))
+    rng.shuffle(rows)
+    for row in rows:
+        names = []
+        for line in ingredient_lines(index.documents[row]):
+            _, name = parse_ingredient(line)
+            if name and name not in names:
+                names.append(name)
+        if len(names) < 2:
+            continue
+        queries.append((", ".join(rng.sample(names, min(len(names), rng.randint(2, 5)))), row))
+        if len(queries) >= num_queries:
+            break
+    return queries
+
+
+def embed_queries(texts, index, rows, synthetic, seed=0):
+    if synthetic:
+        rng = np.random.default_rng(seed)
+        vectors = index.embeddings[rows] + rng.normal(0, 0.05, (len(rows), index.embeddings.shape[1]))
+    else:
+        import recipe_query
+        vectors = np.asarray(recipe_query.embed(texts), dtype=np.float32)
+    vectors = vectors.astype(np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def _dcg(gains):
+    return sum(g / np.log2(i + 2) for i, g in enumerate(gains))
+
+
+def evaluate(search, queries, vectors, truth, exact_embeddings, id_rows, k):
+    """Run `search(text, vector)` for every query and score it against truth."""
+    latencies, recalls, ndcgs = [], [], []
+    for (text, _), vector, (truth_rows, truth_scores) in zip(queries, vectors, truth):
+        t_start = time.perf_counter()
+        results = search(text, vector)
+        latencies.append(time.perf_counter() - t_start)
+
+        rows = [id_rows[r["recipeId"]] for r in results[:k] if r.get("recipeId") in id_rows]
+        recalls.append(len(set(rows) & set(truth_rows)) / k)
+        gains = [float(np.dot(exact_embeddings[row], vector)) for row in rows]
+        ideal = _dcg(truth_scores)
+        ndcgs.append(_dcg(gains) / ideal if ideal > 0 else 0.0)
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "recall@k": round(float(np.mean(recalls)), 4),
+        "ndcg@k": round(float(np.mean(ndcgs)), 4),
+        "p50Ms": round(float(np.percentile(latencies, 50)), 3),
+        "p99Ms": round(float(np.percentile(latencies, 99)), 3),
+        "qps": round(len(latencies) / (latencies.sum() / 1000), 1),
+    }
+
+
+def run(path, k=10, num_queries=200, queries_file=None, synthetic=False, atlas=False, seed=0):
+    print(f"Loading corpus from {path}...")
+    exact = LocalRecipeIndex.from_ndjson(path, quantization="none")
+    id_rows = {rid: row for row, rid in enumerate(exact.recipe_ids)}
+
+    if queries_file:
+        with open(queries_file, encoding="utf-8") as f:
+            queries = [(line.strip(), None) for line in f if line.strip()][:num_queries]
+        if synthetic:
+            raise SystemExit("--synthetic-vectors needs sampled queries (their source recipes), not --queries")
+    else:
+        queries = sample_queries(exact, num_queries, seed)
+    vectors = embed_queries([q for q, _ in queries], exact, [r for _, r in queries], synthetic, seed)
+    print(f"{len(queries)} queries, {len(exact)} recipes, k={k}")
+
+    # Brute-force ground truth
+    truth = []
+    for vector in vectors:
+        scores = exact.embeddings @ vector
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        truth.append((top.tolist(), scores[top].tolist()))
+
+    # Quantized variants rescore from memory-mapped vectors, as in production
+    vectors_file = tempfile.NamedTemporaryFile(suffix=".npy", delete=False)
+    vectors_file.close()
+    np.save(vectors_file.name, exact.embeddings)
+    mapped = np.load(vectors_file.name, mmap_mode="r")
+
+    configs = [("local exact", {}, exact, "dense")]
+    for quantization, depths in QUANTIZED_SWEEP.items():
+        for depth in depths:
+            configs.append((f"local {quantization}", {"rescoreCandidates": depth},
+                            _quantized(exact, mapped, quantization, depth), "dense"))
+    for shortlist in HYBRID_SHORTLISTS:
+        configs.append(("local hybrid", {"shortlist": shortlist}, exact, ("hybrid", shortlist)))
+
+    report = []
+    try:
+        for name, params, index, mode in configs:
+            if mode == "dense":
+                search = lambda text, vector, index=index: index.search(vector, k)  # noqa: E731
+            else:
+                search = lambda text, vector, size=mode[1]: exact.hybrid_search(text, vector, k, 0, size)  # noqa: E731
+            row = {"config": name, **params, **evaluate(search, queries, vectors, truth, exact.embeddings, id_rows, k),
+                   "memoryMB": round(_vector_bytes(index) / 1048576, 1)}
+            report.append(row)
+            _print_row(row)
+
+        if atlas:
+            from recipe_query import _atlas_search
+            for num_candidates in ATLAS_NUM_CANDIDATES:
+                search = lambda text, vector, n=num_candidates: _atlas_search(vector.tolist(), k, 0, n)  # noqa: E731
+                row = {"config": "atlas", "numCandidates": num_candidates,
+                       **evaluate(search, queries, vectors, truth, exact.embeddings, id_rows, k), "memoryMB": None}
+                report.append(row)
+                _print_row(row)
+    finally:
+        del mapped
+        os.unlink(vectors_file.name)
+    return {"corpus": path, "recipes": len(exact), "queries": len(queries), "k": k,
+            "synthetic": synthetic, "results": report}
+
+
+def _quantized(exact, mapped, quantization, rescore_candidates):
+    # Rescoring is pointed at the memory-mapped copy, matching
+    # LocalRecipeIndex.from_ndjson()
+    index = LocalRecipeIndex(
+        exact.recipe_ids, exact.titles, exact.documents, exact.embeddings, exact.tags,
+        lexical=exact.lexical, quantization=quantization, rescore_candidates=rescore_candidates,
+    )
+    index.embeddings = mapped
+    return index
+
+
+def _vector_bytes(index):
+    if index.codes is not None:
+        return index.codes.nbytes + (index.scales.nbytes if index.scales is not None else 0)
+    return index.embeddings.nbytes
+
+
+def _print_row(row):
+    params = ", ".join(f"{k}={v}" for k, v in row.items()
+                       if k not in ("config", "recall@k", "ndcg@k", "p50Ms", "p99Ms", "qps", "memoryMB"))
+    memory = f"{row['memoryMB']:>8.1f}" if row["memoryMB"] is not None else "       -"
+    print(f"{row['config']:<14}{params:<24}recall {row['recall@k']:.3f}  ndcg {row['ndcg@k']:.3f}  "
+          f"p50 {row['p50Ms']:>7.2f}ms  p99 {row['p99Ms']:>7.2f}ms  {row['qps']:>8.1f} qps  {memory} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recipe search quality-vs-latency sweep.")
+    parser.add_argument("path", nargs="?", default=DEFAULT_PATH)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--queries", help="file with one ingredient query per line")
+    parser.add_argument("--synthetic-vectors", action="store_true",
+                        help="perturbed source-recipe embeddings instead of the model")
+    parser.add_argument("--atlas", action="store_true", help="also sweep Atlas numCandidates (needs MONGO_URI)")
+    parser.add_argument("--output", default="recipe_eval.json")
+    args = parser.parse_args()
+
+    report = run(args.path, args.k, args.num_queries, args.queries, args.synthetic_vectors, args.atlas)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
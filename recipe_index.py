@@ -0,0 +1,369 @@
+"""
+Local in-memory recipe vector index, an alternative to Atlas Vector Search.
+
+Loads the NDJSON corpus written by migration/dump_chroma_recipes.py (one
+recipe per line with its 384-dim MiniLM embedding) into a single normalized
+float32 matrix and scores queries with one matrix-vector product. Selected
+with RECIPE_SEARCH_BACKEND=local (see recipe_query.py).
+
+Each recipe's ingredient tag bitset (recipe_tags.py) sits in a parallel
+uint32 array, so diet/allergy filtering is a vectorized mask applied while
+scoring — excluded rows never compete for the top-k.
+
+An ingredient BM25 index (recipe_lexical.py) is built alongside, for
+hybrid_search(). Precomputed per-serving nutrient profiles
+(recipe_nutrition.py), when the dump has them, are kept in one more parallel
+float32 matrix (NaN rows where a recipe has none) and returned with each hit.
+
+Quantization (RECIPE_INDEX_QUANTIZATION) shrinks the in-memory vectors:
+
+  - "int8":   one signed byte per dimension plus a float32 scale per row (~4x)
+  - "binary": one sign bit per dimension, packed (32x)
+
+Queries are first scored approximately on the compact codes (an int8 dot
+product, or Hamming distance by popcount), scanned in fixed-size row blocks
+so no full float copy is ever made. Then the best RECIPE_RESCORE_CANDIDATES
+are rescored exactly against the float32 vectors. Those float vectors stay
+on disk in a .f32.npy file next to the dump and are memory-mapped, so only
+the rows being rescored are ever paged in. Loading streams rows into
+preallocated arrays, and the .f32.npy is only rewritten when the dump has
+changed, atomically, so workers loading side by side never see a truncated
+file. recall_report() measures how
+often the quantized top-k matches brute force.
+"""
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from recipe_lexical import IngredientIndex, rrf_fuse
+from recipe_nutrition import PROFILE_NUTRIENTS
+from recipe_tags import compute_tags, ingredients_section
+
+EMBEDDING_DIM = 384
+
+QUANTIZATION = os.getenv("RECIPE_INDEX_QUANTIZATION", "none").lower()
+RESCORE_CANDIDATES = int(os.getenv("RECIPE_RESCORE_CANDIDATES", 100))
+_SCAN_BLOCK = 16384
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(x):
+        return _POPCOUNT_TABLE[x]
+
+# Columns of the nutrition matrix: coverage, then per-serving PROFILE_NUTRIENTS
+_NUTRITION_COLUMNS = ("coverage",) + PROFILE_NUTRIENTS
+
+
+class LocalRecipeIndex:
+    def __init__(self, recipe_ids, titles, documents, embeddings, tags, lexical=None, nutrition=None,
+                 quantization="none", rescore_candidates=RESCORE_CANDIDATES):
+        self.recipe_ids = recipe_ids
+        self.titles = titles
+        self.documents = documents
+        self.embeddings = embeddings
+        self.tags = tags
+        self.lexical = lexical
+        self.nutrition = nutrition
+        self.quantization = quantization
+        self.rescore_candidates = rescore_candidates
+        self.codes = None
+        self.scales = None
+        if quantization == "int8":
+            self.scales = np.maximum(np.abs(embeddings).max(axis=1), 1e-12).astype(np.float32) / 127
+            self.codes = np.empty(embeddings.shape, dtype=np.int8)
+            for start in range(0, len(embeddings), _SCAN_BLOCK):
+                block = embeddings[start:start + _SCAN_BLOCK]
+                self.codes[start:start + _SCAN_BLOCK] = np.rint(block / self.scales[start:start + _SCAN_BLOCK, None])
+        elif quantization == "binary":
+            self.codes = np.empty((len(embeddings), (EMBEDDING_DIM + 7) // 8), dtype=np.uint8)
+            for start in range(0, len(embeddings), _SCAN_BLOCK):
+                self.codes[start:start + _SCAN_BLOCK] = np.packbits(embeddings[start:start + _SCAN_BLOCK] > 0, axis=1)
+        elif quantization != "none":
+            raise ValueError(f"unknown quantization {quantization!r} (expected none, int8 or binary)")
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    @classmethod
+    def from_ndjson(cls, path, quantization=QUANTIZATION):
+        vectors_path = os.path.splitext(path)[0] + ".f32.npy"
+        cached = _cached_vectors(path, vectors_path) if quantization != "none" else None
+        rows = _read_rows(path, keep_vectors=cached is None)
+        if cached is not None and len(cached) != len(rows["recipe_ids"]):
+            cached = None  # same mtime but different contents: rebuild
+            rows = _read_rows(path, keep_vectors=True)
+
+        if quantization == "none":
+            embeddings = rows["vectors"]
+            _normalize(embeddings)
+        elif cached is not None:
+            embeddings = cached
+        else:
+            # Keep the exact vectors for rescoring on disk, not in RAM
+            embeddings = _write_vectors(path, vectors_path, rows.pop("vectors"))
+        return cls(
+            rows["recipe_ids"], rows["titles"], rows["documents"], embeddings, rows["tags"],
+            lexical=IngredientIndex.build(rows["ingredients"]),
+            nutrition=rows["nutrition"],
+            quantization=quantization,
+        )
+
+    def nbytes(self):
+        """Approximate memory held by the index (arrays + text)."""
+        text = sum(len(d) + len(t) for d, t in zip(self.documents, self.titles))
+        lexical = self.lexical.nbytes() if self.lexical else 0
+        nutrition = self.nutrition.nbytes if self.nutrition is not None else 0
+        # Memory-mapped float vectors are paged in on demand, not held
+        vectors = 0 if isinstance(self.embeddings, np.memmap) else self.embeddings.nbytes
+        codes = (self.codes.nbytes if self.codes is not None else 0) + (self.scales.nbytes if self.scales is not None else 0)
+        return vectors + codes + self.tags.nbytes + text + lexical + nutrition
+
+    def _result(self, i, score):
+        result = {"recipeId": self.recipe_ids[i], "title": self.titles[i], "documentText": self.documents[i],
+                  "score": float(score)}
+        if self.nutrition is not None and not np.isnan(self.nutrition[i, 0]):
+            row = self.nutrition[i].tolist()
+            result["nutrition"] = {
+                "coverage": round(row[0], 2),
+                "perServing": {k: round(v, 1) for k, v in zip(PROFILE_NUTRIENTS, row[1:])},
+            }
+        return result
+
+    def allowed(self, exclude_mask=0):
+        """Boolean row mask of recipes with none of the excluded tags."""
+        if not exclude_mask:
+            return None
+        return (self.tags & np.uint32(exclude_mask)) == 0
+
+    def _approx_scores(self, query):
+        """Approximate similarity of every row from the quantized codes."""
+        scores = np.empty(len(self), dtype=np.float32)
+        if self.quantization == "int8":
+            for start in range(0, len(self), _SCAN_BLOCK):
+                block = self.codes[start:start + _SCAN_BLOCK].astype(np.float32)
+                scores[start:start + _SCAN_BLOCK] = (block @ query) * self.scales[start:start + _SCAN_BLOCK]
+        else:
+            query_bits = np.packbits(query > 0)
+            for start in range(0, len(self), _SCAN_BLOCK):
+                block = self.codes[start:start + _SCAN_BLOCK]
+                hamming = _popcount(block ^ query_bits).sum(axis=1, dtype=np.int32)
+                scores[start:start + _SCAN_BLOCK] = EMBEDDING_DIM - 2 * hamming
+        return scores
+
+    def _scores(self, query, allowed):
+        """(scores, rows they belong to) for a normalized query.
+
+        Unquantized: exact scores for every row (rows is None, i.e. all).
+        Quantized: exact scores for the rescore_candidates best rows by
+        approximate score. Excluded rows score -inf either way.
+        """
+        if self.quantization == "none":
+            scores = self.embeddings @ query
+            if allowed is not None:
+                scores[~allowed] = -np.inf
+            return scores, None
+
+        approx = self._approx_scores(query)
+        if allowed is not None:
+            approx[~allowed] = -np.inf
+        n = min(self.rescore_candidates, len(approx))
+        # Sorted so memory-mapped rows are read in file order
+        rows = np.sort(np.argpartition(-approx, n - 1)[:n])
+        rows = rows[np.isfinite(approx[rows])]
+        return np.asarray(self.embeddings[rows]) @ query, rows
+
+    def search(self, query_vector, top_k=5, exclude_mask=0):
+        """Top-k recipes by cosine similarity, skipping excluded tags.
+
+        Returns a list of {"recipeId", "title", "documentText", "score"}
+        dicts (plus "nutrition" when profiled), the same shape as the Atlas
+        results from recipe_atlas.py.
+        """
+        if not len(self):
+            return []
+        query = np.array(query_vector, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+
+        scores, rows = self._scores(query, self.allowed(exclude_mask))
+        top_k = min(top_k, len(scores))
+        if not top_k:
+            return []
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        rows = top if rows is None else rows[top]
+
+        return [self._result(row, scores[i]) for row, i in zip(rows, top) if np.isfinite(scores[i])]
+
+    def hybrid_search(self, query_text, query_vector, top_k=5, exclude_mask=0, shortlist_size=200):
+        """Ingredient-overlap shortlist, dense rescoring, reciprocal rank fusion.
+
+        Only the lexical shortlist is dense-scored, so this touches a few
+        hundred embedding rows instead of the whole matrix. Falls back to the
+        full dense scan when fewer than top_k recipes share any ingredient
+        with the query.
+        """
+        allowed = self.allowed(exclude_mask)
+        lexical_rows = self.lexical.shortlist(query_text, shortlist_size, allowed)
+        if len(lexical_rows) < top_k:
+            return self.search(query_vector, top_k, exclude_mask)
+
+        query = np.array(query_vector, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        dense_scores = np.asarray(self.embeddings[lexical_rows]) @ query
+        dense_rows = lexical_rows[np.argsort(-dense_scores)]
+        score_by_row = dict(zip(lexical_rows.tolist(), dense_scores.tolist()))
+
+        fused = rrf_fuse([lexical_rows.tolist(), dense_rows.tolist()])[:top_k]
+        return [self._result(i, score_by_row[i]) for i in fused]
+
+
+def _count_lines(path):
+    with open(path, "rb") as f:
+        return sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 20), b"")) + 1
+
+
+def _trim(array, n):
+    return array if len(array) == n else array[:n].copy()
+
+
+def _read_rows(path, keep_vectors=True):
+    """Parse the dump into lists and preallocated arrays (filled row by row)."""
+    capacity = _count_lines(path)
+    vectors = np.empty((capacity, EMBEDDING_DIM), dtype=np.float32) if keep_vectors else None
+    tags = np.empty(capacity, dtype=np.uint32)
+    nutrition = np.full((capacity, len(_NUTRITION_COLUMNS)), np.nan, dtype=np.float32)
+    recipe_ids, titles, documents, ingredients = [], [], [], []
+    n = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            embedding = record.get("embedding")
+            if not embedding or len(embedding) != EMBEDDING_DIM:
+                continue
+            recipe_ids.append(record["recipeId"])
+            titles.append(record.get("title", ""))
+            documents.append(record["documentText"])
+            ingredients.append(ingredients_section(record["documentText"]))
+            if vectors is not None:
+                vectors[n] = embedding
+            # Older dumps predate ingest-time tagging; tag them on load.
+            record_tags = record.get("tags")
+            tags[n] = record_tags if record_tags is not None else compute_tags(ingredients[-1])
+            profile = record.get("nutrition")
+            if profile:
+                nutrition[n] = [profile["coverage"]] + [profile["perServing"][k] for k in PROFILE_NUTRIENTS]
+            n += 1
+    return {
+        "recipe_ids": recipe_ids, "titles": titles, "documents": documents, "ingredients": ingredients,
+        "vectors": _trim(vectors, n) if vectors is not None else None,
+        "tags": _trim(tags, n), "nutrition": _trim(nutrition, n),
+    }
+
+
+def _normalize(embeddings):
+    for start in range(0, len(embeddings), _SCAN_BLOCK):
+        block = embeddings[start:start + _SCAN_BLOCK]
+        block /= np.maximum(np.linalg.norm(block, axis=1, keepdims=True), 1e-12)
+
+
+def _cached_vectors(path, vectors_path):
+    """The memory-mapped .f32.npy for this dump, if it was built from it.
+
+    The file is stamped with the dump's mtime when written, so an unchanged
+    dump is loaded without rewriting a file other workers may have mapped.
+    """
+    try:
+        if os.stat(vectors_path).st_mtime_ns != os.stat(path).st_mtime_ns:
+            return None
+        vectors = np.load(vectors_path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    if vectors.dtype != np.float32 or vectors.ndim != 2 or vectors.shape[1] != EMBEDDING_DIM:
+        return None
+    return vectors
+
+
+def _write_vectors(path, vectors_path, vectors):
+    """Normalize `vectors`, save them for `path`, and return them memory-mapped.
+
+    Written to a temp file and renamed into place, so a worker that already
+    mapped the old file keeps reading it intact. When the dump's directory
+    is read-only, the temp file lives in the system temp dir and is unlinked
+    once mapped.
+    """
+    _normalize(vectors)
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(vectors_path) or ".", suffix=".tmp")
+        shared = True
+    except OSError:
+        fd, tmp_path = tempfile.mkstemp(suffix=".f32.npy")
+        shared = False
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, vectors)
+        del vectors
+        if shared:
+            os.chmod(tmp_path, 0o644)  # mkstemp creates it 0600
+            dump_mtime = os.stat(path).st_mtime_ns
+            os.utime(tmp_path, ns=(dump_mtime, dump_mtime))
+            os.replace(tmp_path, vectors_path)
+            tmp_path = vectors_path
+        return np.load(tmp_path, mmap_mode="r")
+    finally:
+        if not shared or tmp_path != vectors_path:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+
+def recall_report(path, k=10, num_queries=200, noise=0.05, seed=0):
+    """Recall@k of each quantization against brute-force float32 search.
+
+    Queries are corpus vectors with a little Gaussian noise, so the exact
+    neighbours are realistic but not simply the query recipe itself.
+    Returns {quantization: {"recall@k", "vectorBytes", "compression"}}.
+    """
+    exact = LocalRecipeIndex.from_ndjson(path, quantization="none")
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(exact), size=min(num_queries, len(exact)), replace=False)
+    queries = exact.embeddings[rows] + rng.normal(0, noise, (len(rows), EMBEDDING_DIM)).astype(np.float32)
+
+    truth = [{r["documentText"] for r in exact.search(q, k)} for q in queries]
+    float_bytes = exact.embeddings.nbytes
+    report = {"none": {"recall@k": 1.0, "vectorBytes": float_bytes, "compression": 1.0}}
+    for quantization in ("int8", "binary"):
+        index = LocalRecipeIndex(
+            exact.recipe_ids, exact.titles, exact.documents, exact.embeddings, exact.tags,
+            quantization=quantization,
+        )
+        hits = sum(len(expected & {r["documentText"] for r in index.search(q, k)}) for q, expected in zip(queries, truth))
+        code_bytes = index.codes.nbytes + (index.scales.nbytes if index.scales is not None else 0)
+        report[quantization] = {
+            "recall@k": round(hits / (k * len(queries)), 4),
+            "vectorBytes": code_bytes,
+            "compression": round(float_bytes / code_bytes, 1),
+        }
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Recall@k of quantized recipe search vs. brute force.")
+    parser.add_argument("path", nargs="?", default=os.getenv("RECIPE_INDEX_PATH", "migration/recipes_dump.ndjson"))
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"Rescoring {RESCORE_CANDIDATES} candidates per query (RECIPE_RESCORE_CANDIDATES)")
+    for name, row in recall_report(args.path, args.k, args.queries).items():
+        print(f"{name:>7}: recall@{args.k} {row['recall@k']:.3f}  "
+              f"{row['vectorBytes'] / 1048576:.1f}MB  ({row['compression']}x smaller)")
@@ -0,0 +1,149 @@
+"""
+BM25 inverted index over recipe ingredients, for hybrid recipe retrieval.
+
+search_recipe() queries are literally ingredient lists ("banana, milk, rice"),
+so exact ingredient overlap is a strong, cheap signal that pure MiniLM
+similarity often misses. This index finds overlapping recipes with a few
+array additions per query term; recipe_query.py then runs dense scoring only
+on that shortlist and merges the two rankings with reciprocal rank fusion.
+
+Postings are stored as numpy arrays with the BM25 term-frequency part
+precomputed, so scoring a query is just idf * weight added into one dense
+score array — no per-document Python work.
+"""
+import json
+import re
+from collections import defaultdict
+
+import numpy as np
+
+from recipe_tags import ingredients_section
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+# Quantities, units and prep words that appear in nearly every ingredient line
+# and say nothing about what the recipe is.
+_STOPWORDS = {
+    "c", "cup", "cups", "tbsp", "tsp", "tablespoon", "tablespoons", "teaspoon",
+    "teaspoons", "oz", "ounce", "ounces", "lb", "lbs", "pound", "pounds", "pkg",
+    "package", "can", "cans", "jar", "qt", "pt", "g", "kg", "ml", "l", "large",
+    "small", "medium", "chopped", "diced", "sliced", "minced", "fresh", "frozen",
+    "to", "taste", "and", "or", "of", "the", "a", "an", "for", "with", "in",
+    "about", "into", "cut", "finely", "whole", "optional", "divided", "pieces",
+    "piece", "slices", "slice", "stick", "sticks", "dash", "pinch", "beaten",
+    "melted", "softened", "drained", "grated", "shredded", "peeled",
+}
+
+_TOKEN_RE = re.compile(r"[a-z]+")
+
+
+def _normalize(token):
+    # Cheap singularization so "bananas" matches "banana" and "tomatoes"
+    # matches "tomato"; good enough for ingredient names.
+    if len(token) > 4 and token.endswith("oes"):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    """Ingredient terms in text, lowercased and singularized, minus stopwords."""
+    if not text:
+        return []
+    return [
+        _normalize(token)
+        for token in _TOKEN_RE.findall(text.lower())
+        if token not in _STOPWORDS and len(token) > 1
+    ]
+
+
+class IngredientIndex:
+    def __init__(self, postings, num_docs):
+        # postings: term -> (doc ids int32 array, precomputed tf weight float32 array, idf)
+        self.postings = postings
+        self.num_docs = num_docs
+
+    @classmethod
+    def build(cls, ingredient_texts):
+        """Build from one ingredient text per recipe, in index row order."""
+        term_docs = defaultdict(list)
+        term_tfs = defaultdict(list)
+        doc_lengths = np.zeros(len(ingredient_texts), dtype=np.float32)
+
+        for doc_id, text in enumerate(ingredient_texts):
+            counts = defaultdict(int)
+            for term in tokenize(text):
+                counts[term] += 1
+            doc_lengths[doc_id] = sum(counts.values())
+            for term, count in counts.items():
+                term_docs[term].append(doc_id)
+                term_tfs[term].append(count)
+
+        num_docs = len(ingredient_texts)
+        avg_length = float(doc_lengths.mean()) if num_docs else 0.0
+        postings = {}
+        for term, docs in term_docs.items():
+            docs = np.asarray(docs, dtype=np.int32)
+            tf = np.asarray(term_tfs[term], dtype=np.float32)
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[docs] / max(avg_length, 1e-6))
+            weight = tf * (BM25_K1 + 1) / (tf + norm)
+            idf = float(np.log(1 + (num_docs - len(docs) + 0.5) / (len(docs) + 0.5)))
+            postings[term] = (docs, weight.astype(np.float32), idf)
+        return cls(postings, num_docs)
+
+    @classmethod
+    def from_ndjson(cls, path):
+        """Build from the corpus dump, returning (index, recipe ids in row order)."""
+        recipe_ids, texts = [], []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                recipe_ids.append(record["recipeId"])
+                texts.append(ingredients_section(record["documentText"]))
+        return cls.build(texts), recipe_ids
+
+    def nbytes(self):
+        """Approximate memory held by the postings arrays."""
+        return sum(docs.nbytes + weight.nbytes + len(term) + 64 for term, (docs, weight, _) in self.postings.items())
+
+    def scores(self, query):
+        """Dense array of BM25 scores for every recipe (0 = no overlap)."""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            docs, weight, idf = posting
+            scores[docs] += idf * weight
+        return scores
+
+    def shortlist(self, query, size, allowed=None):
+        """Row ids of the `size` best lexical matches, best first.
+
+        `allowed` is an optional boolean row mask (see recipe_tags.py); rows
+        outside it are never returned.
+        """
+        scores = self.scores(query)
+        if allowed is not None:
+            scores[~allowed] = 0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > size:
+            candidates = candidates[np.argpartition(-scores[candidates], size - 1)[:size]]
+        return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def rrf_fuse(rankings, k=RRF_K):
+    """Reciprocal rank fusion of several best-first lists of ids.
+
+    Returns ids sorted by fused score, best first.
+    """
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            fused[item] += 1.0 / (k + rank + 1)
+    return sorted(fused, key=fused.get, reverse=True)
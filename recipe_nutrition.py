@@ -0,0 +1,202 @@
+"""
+Per-recipe nutrient profiles, precomputed offline for the whole corpus.
+
+compute_profile() parses a recipe's ingredient lines into grams, resolves
+each ingredient per 100 g, and returns per-serving totals plus `coverage`,
+the share of lines that resolved (profiles below MIN_COVERAGE are never used
+for ranking). migration/compute_recipe_nutrition.py stores one per recipe.
+At query time apply_goal_fit() drops candidates over a calorie ceiling and
+re-ranks the rest by blending similarity with the goal_scorer score.
+"""
+import json
+import os
+import re
+
+from goal_scorer import GOAL_TARGETS, MEALS_PER_DAY, score_meal
+from recipe_tags import ingredients_section
+
+RECIPE_DEFAULT_SERVINGS = int(os.getenv("RECIPE_DEFAULT_SERVINGS", 4))
+NUTRITION_RANK_WEIGHT = float(os.getenv("RECIPE_NUTRITION_RANK_WEIGHT", 0.3))
+MIN_COVERAGE = 0.6
+
+PROFILE_NUTRIENTS = ("calories", "protein", "carbs", "fat", "fiber")
+
+# Grams per unit. Volume units assume water-like density unless the
+# ingredient has its own entry in _CUP_GRAMS.
+_UNIT_GRAMS = {
+    "c": 240, "cup": 240, "cups": 240,
+    "tbsp": 15, "tablespoon": 15, "tablespoons": 15, "t": 15,
+    "tsp": 5, "teaspoon": 5, "teaspoons": 5,
+    "oz": 28.35, "ounce": 28.35, "ounces": 28.35,
+    "lb": 453.6, "lbs": 453.6, "pound": 453.6, "pounds": 453.6,
+    "g": 1, "gram": 1, "grams": 1, "kg": 1000,
+    "ml": 1, "l": 1000, "qt": 946, "quart": 946, "pt": 473, "pint": 473,
+    "stick": 113, "sticks": 113,
+    "can": 400, "cans": 400, "pkg": 250, "package": 250, "packages": 250, "jar": 350, "box": 400,
+    "clove": 3, "cloves": 3, "slice": 30, "slices": 30,
+    "dash": 0.5, "pinch": 0.3,
+}
+
+# Cup weights for common dry or dense ingredients (first match wins)
+_CUP_GRAMS = (
+    ("brown sugar", 220), ("powdered sugar", 120), ("sugar", 200), ("flour", 125),
+    ("peanut butter", 258), ("butter", 227), ("oil", 218), ("rice", 185), ("oats", 80),
+    ("cheese", 113), ("pecans", 110), ("walnuts", 117), ("nuts", 120), ("chocolate chips", 170),
+    ("honey", 340), ("raisins", 145), ("cornmeal", 150),
+)
+
+# Typical weight of one unit-less item ("2 eggs", "1 onion")
+_ITEM_GRAMS = (
+    ("egg", 50), ("onion", 110), ("potato", 170), ("tomato", 120), ("carrot", 60),
+    ("banana", 118), ("apple", 180), ("lemon", 60), ("lime", 45), ("garlic", 3),
+    ("chicken breast", 175), ("pepper", 120), ("zucchini", 200), ("tortilla", 45),
+)
+_DEFAULT_ITEM_GRAMS = 100
+
+_FRACTIONS = {"½": 0.5, "¼": 0.25, "¾": 0.75, "⅓": 1 / 3, "⅔": 2 / 3, "⅛": 0.125}
+_QUANTITY_RE = re.compile(r"^\s*(\d+\s+\d+/\d+|\d+/\d+|\d+(?:\.\d+)?|[½¼¾⅓⅔⅛])(?:\s*-\s*[\d/.]+)?\s*")
+_UNIT_RE = re.compile(r"^(" + "|".join(sorted(map(re.escape, _UNIT_GRAMS), key=len, reverse=True)) + r")\b\.?\s*")
+_PREP_RE = re.compile(
+    r"\b(chopped|diced|sliced|minced|fresh|frozen|large|small|medium|finely|coarsely|beaten|melted|"
+    r"softened|drained|grated|shredded|peeled|packed|firmly|lightly|cooked|uncooked|boneless|skinless|"
+    r"ground|crushed|divided|optional|to taste|of)\b"
+)
+_SERVINGS_RE = re.compile(r"\b(?:serves|servings?:?|makes|yields?)\s+(\d{1,2})\b", re.I)
+
+
+def _parse_quantity(text):
+    match = _QUANTITY_RE.match(text)
+    if not match:
+        return None, text
+    raw = match.group(1)
+    if raw in _FRACTIONS:
+        value = _FRACTIONS[raw]
+    elif " " in raw:
+        whole, fraction = raw.split()
+        num, den = fraction.split("/")
+        value = int(whole) + int(num) / max(int(den), 1)
+    elif "/" in raw:
+        num, den = raw.split("/")
+        value = int(num) / max(int(den), 1)
+    else:
+        value = float(raw)
+    return value, text[match.end():]
+
+
+def _lookup(table, name, default=None):
+    for key, grams in table:
+        if key in name:
+            return grams
+    return default
+
+
+def parse_ingredient(line):
+    """(grams or None, ingredient name) for one ingredient line."""
+    text = re.sub(r"\(.*?\)", "", str(line)).lower().strip()
+    quantity, rest = _parse_quantity(text)
+    unit_match = _UNIT_RE.match(rest)
+    unit = unit_match.group(1) if unit_match else None
+    if unit_match:
+        rest = rest[unit_match.end():]
+
+    name = _PREP_RE.sub(" ", rest.split(",")[0])
+    name = re.sub(r"[^a-z ]+", " ", name)
+    name = re.sub(r"\s+", " ", name).strip()
+    if quantity is None or not name:
+        return None, name
+
+    if unit is None:
+        grams = quantity * _lookup(_ITEM_GRAMS, name, _DEFAULT_ITEM_GRAMS)
+    elif unit in ("c", "cup", "cups"):
+        grams = quantity * _lookup(_CUP_GRAMS, name, _UNIT_GRAMS[unit])
+    else:
+        grams = quantity * _UNIT_GRAMS[unit]
+    return grams, name
+
+
+def ingredient_lines(document_text):
+    section = ingredients_section(document_text).strip()
+    try:
+        lines = json.loads(section)
+    except ValueError:
+        lines = section.split(",")
+    return [str(line) for line in lines if str(line).strip()] if isinstance(lines, list) else []
+
+
+def parse_servings(document_text):
+    match = _SERVINGS_RE.search(document_text or "")
+    servings = int(match.group(1)) if match else 0
+    return servings if 0 < servings <= 24 else None
+
+
+def compute_profile(document_text, resolve):
+    """Nutrient profile for one recipe, or None if it has no ingredient lines.
+
+    resolve: ingredient name -> {nutrient: amount per 100 g} or None.
+    """
+    lines = ingredient_lines(document_text)
+    if not lines:
+        return None
+
+    totals = dict.fromkeys(PROFILE_NUTRIENTS, 0.0)
+    resolved = 0
+    for line in lines:
+        grams, name = parse_ingredient(line)
+        if grams is None:
+            continue
+        per_100g = resolve(name)
+        if not per_100g:
+            continue
+        for key in PROFILE_NUTRIENTS:
+            totals[key] += float(per_100g.get(key) or 0) * grams / 100
+        resolved += 1
+
+    servings = parse_servings(document_text) or RECIPE_DEFAULT_SERVINGS
+    return {
+        "servings": servings,
+        "coverage": round(resolved / len(lines), 2),
+        "perServing": {key: round(value / servings, 1) for key, value in totals.items()},
+    }
+
+
+def usable(profile):
+    return bool(profile) and profile.get("coverage", 0) >= MIN_COVERAGE
+
+
+def meal_calorie_ceiling(goal):
+    """Per-serving calorie ceiling used to filter recipes for a goal (None = no ceiling)."""
+    if goal != "lose":
+        return None
+    return round(GOAL_TARGETS["lose"]["calories"] / MEALS_PER_DAY * 1.25)
+
+
+def goal_fit(profile, goal):
+    """goal_scorer score (1-10) of one serving, or None without a usable profile."""
+    if not usable(profile):
+        return None
+    return score_meal(profile["perServing"], goal)["score"]
+
+
+def apply_goal_fit(results, top_k, goal=None, max_calories=None, cosine_scores=False):
+    """Filter and re-rank search results (dicts with "score" and optional
+    "nutrition") by calorie ceiling and goal fit. Recipes without a usable
+    profile are never filtered out and rank as a neutral fit.
+
+    The fit (0-1) is blended with similarity on the same 0-1 scale. Atlas
+    and its brute-force fallback already score (1 + cosine) / 2; pass
+    cosine_scores=True for raw cosine in [-1, 1] (the local index), which
+    is mapped onto that scale first.
+    """
+    if max_calories:
+        results = [
+            r for r in results
+            if not usable(r.get("nutrition")) or r["nutrition"]["perServing"]["calories"] <= max_calories
+        ]
+    if goal:
+        def blended(result):
+            fit = goal_fit(result.get("nutrition"), goal)
+            fit = 0.5 if fit is None else fit / 10
+            similarity = (1 + result["score"]) / 2 if cosine_scores else result["score"]
+            return (1 - NUTRITION_RANK_WEIGHT) * similarity + NUTRITION_RANK_WEIGHT * fit
+        results = sorted(results, key=blended, reverse=True)
+    return results[:top_k]
@@ -2,14 +2,54 @@
 # Lazy-loading module: nothing heavy is imported at module level
 # This ensures the Flask server can start and bind to a port immediately
 import os
+import threading
 from dotenv import load_dotenv
 
+import embedding_service
+import memory_governor
+import shared_cache
+import traffic_capture
+from admission import DeadlineExceeded, clamp_timeout
+from recipe_tags import excluded_mask
+
 load_dotenv()
 
 chroma_client = None
 collection = None
 model = None
-mongo_client = None
+local_index = None
+lexical_index = None  # (IngredientIndex, recipe ids in row order), swapped as one
+embedding_batcher = None
+_model_lock = threading.Lock()
+_batcher_lock = threading.Lock()
+_local_index_lock = threading.Lock()
+_lexical_index_lock = threading.Lock()
+
+# "atlas" (default) queries MongoDB Atlas Vector Search; "local" scores the
+# exported NDJSON corpus in-process (recipe_index.py), for hosts with the RAM.
+SEARCH_BACKEND = os.getenv("RECIPE_SEARCH_BACKEND", "atlas").lower()
+LOCAL_INDEX_PATH = os.getenv("RECIPE_INDEX_PATH", "migration/recipes_dump.ndjson")
+
+# Hybrid retrieval: an ingredient BM25 shortlist (recipe_lexical.py) is
+# dense-rescored and fused with reciprocal rank fusion. Both backends build
+# the lexical index from the corpus dump at RECIPE_INDEX_PATH.
+HYBRID_SEARCH = os.getenv("RECIPE_HYBRID_SEARCH", "").lower() in ("1", "true", "yes")
+HYBRID_SHORTLIST = int(os.getenv("RECIPE_HYBRID_SHORTLIST", 200))
+
+# Longest an in-process embedding may take (capped to the request deadline),
+# matching EMBEDDING_SERVICE_TIMEOUT on the service path
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", 10))
+
+# With a goal or calorie ceiling, this many times top_k candidates are
+# retrieved and then filtered/re-ranked by their precomputed nutrient
+# profiles (recipe_nutrition.py).
+NUTRITION_OVERFETCH = int(os.getenv("RECIPE_NUTRITION_OVERFETCH", 4))
+
+# Finished searches, shared by every worker (shared_cache.py). Invalidate the
+# namespace after re-importing the corpus; bump the version if the result
+# shape changes.
+RECIPE_SEARCH_CACHE_TTL = float(os.getenv("RECIPE_SEARCH_CACHE_TTL", 3600))
+_search_cache = shared_cache.get_cache("recipe_search", version=2, ttl=RECIPE_SEARCH_CACHE_TTL)
 
 
 def _get_chroma_collection():
@@ -38,72 +78,250 @@ def _get_chroma_collection():
 def _get_model():
     """Lazily load SentenceTransformer model."""
     global model
+    loaded = model
+    if loaded is None:
+        # Concurrent first searches wait for one load instead of each loading a copy
+        with _model_lock:
+            loaded = model
+            if loaded is None:
+                print("Loading SentenceTransformer model (all-MiniLM-L6-v2)...")
+                from sentence_transformers import SentenceTransformer
+                loaded = model = SentenceTransformer("all-MiniLM-L6-v2")
+                memory_governor.register("embedding_model", _model_nbytes, _unload_model)
+    memory_governor.touch("embedding_model")
+    return loaded
+
+
+def _model_nbytes():
     if model is None:
-        print("Loading SentenceTransformer model (all-MiniLM-L6-v2)...")
-        from sentence_transformers import SentenceTransformer
-        model = SentenceTransformer("all-MiniLM-L6-v2")
-    return model
+        return 0
+    return sum(p.numel() * p.element_size() for p in model.parameters())
+
+
+def _unload_model():
+    # Reloaded lazily by _get_model() on the next search that needs it
+    global model
+    model = None
+
+
+def embed(texts):
+    """Embed texts with all-MiniLM-L6-v2 as a (len(texts), 384) float32 array.
+
+    Goes through the host-wide embedding service when EMBEDDING_SERVICE_SOCKET
+    is set (see embedding_service.py), so this worker never loads the model
+    itself; otherwise uses the lazily loaded in-process model.
+    """
+    if embedding_service.ENABLED:
+        return embedding_service.encode(texts)
+    return _get_batcher().encode(texts, timeout=clamp_timeout(EMBED_TIMEOUT))
+
+
+def _get_batcher():
+    # Concurrent searches share one batched forward pass (embedding_batcher.py)
+    global embedding_batcher
+    if embedding_batcher is None:
+        with _batcher_lock:
+            if embedding_batcher is None:
+                from embedding_batcher import MicroBatcher
+                embedding_batcher = MicroBatcher(lambda texts: _get_model().encode(texts))
+    return embedding_batcher
+
+
+def embedding_stats():
+    """Micro-batching stats for /metrics, from the service or this process."""
+    if embedding_service.ENABLED:
+        return {"mode": "service", "batcher": embedding_service.stats()}
+    return {"mode": "in-process", "batcher": embedding_batcher.stats() if embedding_batcher else None}
 
 
 def _get_recipe_collection():
     """Lazily connect to the migrated recipe corpus on MongoDB Atlas.
 
     Replaces the old local ChromaDB store (chroma_recipe_db), which is no
-    longer queried here but is left fully intact on disk.
+    longer queried here but is left fully intact on disk. The client's pool
+    and timeouts are configured in recipe_atlas.py.
     """
-    global mongo_client
-    if mongo_client is None:
-        from pymongo import MongoClient
-        mongo_uri = os.getenv("MONGO_URI")
-        mongo_client = MongoClient(mongo_uri)
-    db = mongo_client.get_default_database()
-    return db["recipeEmbeddings"]
+    import recipe_atlas
+    return recipe_atlas.get_collection()
+
+
+def _get_local_index():
+    """Lazily load the local recipe index from the NDJSON corpus dump."""
+    global local_index
+    index = local_index
+    if index is None:
+        # Concurrent first searches wait for one parse of the dump
+        with _local_index_lock:
+            index = local_index
+            if index is None:
+                print(f"Loading local recipe index from {LOCAL_INDEX_PATH}...")
+                from recipe_index import LocalRecipeIndex
+                index = local_index = LocalRecipeIndex.from_ndjson(LOCAL_INDEX_PATH)
+                print(f"Local recipe index loaded ({len(index)} recipes)")
+                memory_governor.register("local_recipe_index", _local_index_nbytes, _unload_local_index)
+    memory_governor.touch("local_recipe_index")
+    return index
+
+
+def _local_index_nbytes():
+    index = local_index
+    return index.nbytes() if index is not None else 0
+
+
+def _unload_local_index():
+    global local_index
+    local_index = None
+
+
+def _get_lexical_index():
+    """Lazily build the ingredient BM25 index used by Atlas hybrid search."""
+    global lexical_index
+    loaded = lexical_index
+    if loaded is None:
+        with _lexical_index_lock:
+            loaded = lexical_index
+            if loaded is None:
+                print(f"Building ingredient index from {LOCAL_INDEX_PATH}...")
+                from recipe_lexical import IngredientIndex
+                loaded = lexical_index = IngredientIndex.from_ndjson(LOCAL_INDEX_PATH)
+                memory_governor.register("lexical_index", _lexical_index_nbytes, _unload_lexical_index)
+    memory_governor.touch("lexical_index")
+    return loaded
+
+
+def _lexical_index_nbytes():
+    loaded = lexical_index
+    return loaded[0].nbytes() if loaded is not None else 0
+
+
+def _unload_lexical_index():
+    global lexical_index
+    lexical_index = None
+
+
+def _atlas_search(query_embedding, top_k, exclude_mask, num_candidates=None):
+    # Adaptive numCandidates, trimmed projection and the brute-force fallback
+    # for servers without $vectorSearch live in recipe_atlas.py
+    import recipe_atlas
+    return recipe_atlas.vector_search(query_embedding, top_k, exclude_mask, num_candidates)
+
+
+def _atlas_hybrid_search(query, query_embedding, top_k, exclude_mask):
+    """Lexical shortlist locally, exact dense scoring of just that shortlist in
+    Atlas, then RRF. Needs `recipeId` declared as a filter field on
+    recipe_vector_index alongside `tagBits`."""
+    import recipe_atlas
+    from recipe_lexical import rrf_fuse
+
+    index, recipe_ids = _get_lexical_index()
+    rows = index.shortlist(query, HYBRID_SHORTLIST)
+    if len(rows) < top_k:
+        return _atlas_search(query_embedding, top_k, exclude_mask)
+    lexical_ranking = [recipe_ids[i] for i in rows]
+
+    dense = recipe_atlas.exact_scores(query_embedding, lexical_ranking, exclude_mask)
+    if len(dense) < top_k:
+        return _atlas_search(query_embedding, top_k, exclude_mask)
+
+    # Only recipes that passed the tag filter come back from the dense stage;
+    # keep the lexical ranking to those too so excluded ones can't be fused in.
+    score_by_id = {d["recipeId"]: d["score"] for d in dense}
+    lexical_ranking = [rid for rid in lexical_ranking if rid in score_by_id]
+    fused = rrf_fuse([lexical_ranking, [d["recipeId"] for d in dense]])[:top_k]
+
+    return recipe_atlas.fetch_results([(rid, score_by_id[rid]) for rid in fused])
 
 
 _FALLBACK_MESSAGE = "No local recipes found. Suggest custom recipes based on these ingredients."
 
 
-def search_recipe(query, top_k=5):
+def search_recipes(query, top_k=5, food_type=None, allergies=None, dietary_restrictions=None,
+                   goal=None, max_calories=None):
     """
     Semantic recipe search via MongoDB Atlas Vector Search, using the same
     384-dim sentence-transformers/all-MiniLM-L6-v2 embeddings originally
     computed into the local ChromaDB store and migrated into the
     `recipeEmbeddings` collection (see js_backend/migration/).
+
+    Recipes whose precomputed ingredient tags clash with food_type, allergies
+    or dietary_restrictions (see recipe_tags.py) are filtered out during the
+    search itself, so all top_k results are usable as-is.
+
+    With a goal ("lose"/"maintain"/"gain") and/or max_calories, candidates
+    are also filtered and re-ranked locally by their precomputed per-serving
+    nutrient profile (recipe_nutrition.apply_goal_fit).
+
+    Returns a list of {"recipeId", "title", "documentText", "score"} dicts,
+    best first, each with a "nutrition" profile when one was precomputed, or
+    [] if nothing matched or the search failed. From Atlas, documentText is
+    cut to the title and ingredients (recipe_atlas.py).
     """
     if not query or not isinstance(query, str):
-        return _FALLBACK_MESSAGE
+        return []
+
+    key = shared_cache.key_for(
+        " ".join(query.lower().split()), top_k, food_type, sorted(allergies or []),
+        sorted(dietary_restrictions or []), goal, max_calories, SEARCH_BACKEND, HYBRID_SEARCH,
+    )
+    # Empty results aren't cached: they may come from a failed search
+    return _search_cache.get_or_compute(
+        key,
+        lambda: _search_recipes(query, top_k, food_type, allergies, dietary_restrictions, goal, max_calories),
+        cache_if=bool,
+    )
+
+
+def _backend_errors():
+    """Failures of the search backends that degrade to "no recipes".
 
+    I/O and timeouts, a missing driver, malformed corpus data, model and
+    embedding-service errors, and anything pymongo raises. Programming
+    errors still propagate. Only evaluated when an exception is raised, so
+    pymongo isn't imported up front.
+    """
+    errors = (OSError, ImportError, ValueError, RuntimeError)
     try:
-        model = _get_model()
-        query_embedding = model.encode([query])[0].tolist()
-
-        collection = _get_recipe_collection()
-        pipeline = [
-            {
-                "$vectorSearch": {
-                    "index": "recipe_vector_index",
-                    "path": "embedding",
-                    "queryVector": query_embedding,
-                    "numCandidates": max(top_k * 20, 100),
-                    "limit": top_k,
-                }
-            },
-            {
-                "$project": {
-                    "_id": 0,
-                    "title": 1,
-                    "documentText": 1,
-                    "score": {"$meta": "vectorSearchScore"},
-                }
-            },
-        ]
-
-        results = list(collection.aggregate(pipeline))
-        if not results:
-            return _FALLBACK_MESSAGE
-
-        return "\n\n".join(r["documentText"] for r in results)
+        from pymongo.errors import PyMongoError
+    except ImportError:
+        return errors
+    return errors + (PyMongoError,)
 
-    except Exception as e:
+
+@traffic_capture.upstream("recipe_search")
+def _search_recipes(query, top_k, food_type, allergies, dietary_restrictions, goal, max_calories):
+    try:
+        query_embedding = embed([query])[0].tolist()
+        exclude_mask = excluded_mask(food_type, allergies, dietary_restrictions)
+        rank_by_nutrition = bool(goal or max_calories)
+        fetch_k = top_k * NUTRITION_OVERFETCH if rank_by_nutrition else top_k
+
+        if SEARCH_BACKEND == "local":
+            index = _get_local_index()
+            if HYBRID_SEARCH:
+                results = index.hybrid_search(query, query_embedding, fetch_k, exclude_mask, HYBRID_SHORTLIST)
+            else:
+                results = index.search(query_embedding, fetch_k, exclude_mask)
+        elif HYBRID_SEARCH:
+            results = _atlas_hybrid_search(query, query_embedding, fetch_k, exclude_mask)
+        else:
+            results = _atlas_search(query_embedding, fetch_k, exclude_mask)
+
+        if rank_by_nutrition:
+            from recipe_nutrition import apply_goal_fit
+            # The local index scores raw cosine; Atlas scores (1 + cosine) / 2
+            results = apply_goal_fit(results, top_k, goal, max_calories, cosine_scores=SEARCH_BACKEND == "local")
+        return results
+
+    except DeadlineExceeded:
+        raise
+    except _backend_errors() as e:
         print(f"Error during recipe vector search: {e}")
-        return _FALLBACK_MESSAGE
\ No newline at end of file
+        return []
+
+
+def search_recipe(query, top_k=5, food_type=None, allergies=None, dietary_restrictions=None):
+    """search_recipes() joined into one text block, or a fallback message."""
+    results = search_recipes(query, top_k, food_type, allergies, dietary_restrictions)
+    if not results:
+        return _FALLBACK_MESSAGE
+    return "\n\n".join(r["documentText"] for r in results)
\ No newline at end of file
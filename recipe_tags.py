@@ -0,0 +1,162 @@
+"""
+Ingredient tags for the recipe corpus, stored as a compact bitset per recipe.
+
+Each bit means "this recipe contains X". Tags are computed once at ingest
+(recepie_chroma.py / migration/dump_chroma_recipes.py) from the ingredient
+list, so recipe search can exclude recipes that clash with the user's diet
+type, allergies or restrictions *while* ranking candidates, instead of
+retrieving extras and discarding them afterwards:
+
+    mask = excluded_mask("vegan", allergies=["nuts"])
+    usable = (tags & mask) == 0
+
+Matching is keyword-based over the ingredient text (the RecipeNLG ingredient
+lines are plain English), with a few exceptions for common false friends
+like "peanut butter", "coconut milk" or "cream of tartar".
+"""
+import re
+
+MEAT = 1 << 0
+FISH = 1 << 1
+SHELLFISH = 1 << 2
+DAIRY = 1 << 3
+EGG = 1 << 4
+HONEY = 1 << 5
+GELATIN = 1 << 6
+GLUTEN = 1 << 7
+WHEAT = 1 << 8
+TREE_NUT = 1 << 9
+PEANUT = 1 << 10
+SOY = 1 << 11
+
+TAG_NAMES = {
+    "meat": MEAT,
+    "fish": FISH,
+    "shellfish": SHELLFISH,
+    "dairy": DAIRY,
+    "egg": EGG,
+    "honey": HONEY,
+    "gelatin": GELATIN,
+    "gluten": GLUTEN,
+    "wheat": WHEAT,
+    "tree_nut": TREE_NUT,
+    "peanut": PEANUT,
+    "soy": SOY,
+}
+
+_TAG_PATTERNS = {
+    MEAT: r"\b(beef|steak|pork|bacon|ham|sausages?|chicken|turkey|lamb|mutton|veal|"
+          r"venison|duck|goose|pepperoni|salami|prosciutto|chorizo|hot dogs?|"
+          r"ground round|meatballs?|broth|bouillon|lard|giblets)\b",
+    FISH: r"\b(fish|salmon|tuna|cod|tilapia|halibut|trout|sardines?|anchov(y|ies)|"
+          r"mackerel|haddock|catfish|snapper|bass|sole|flounder|swordfish)\b",
+    SHELLFISH: r"\b(shrimps?|prawns?|crab|crabmeat|lobster|clams?|mussels?|oysters?|"
+               r"scallops?|crawfish|crayfish|squid|calamari|octopus)\b",
+    DAIRY: r"\b(milk|butter|buttermilk|cheese|cheddar|mozzarella|parmesan|ricotta|"
+           r"cream|yogurt|yoghurt|ghee|whey|casein|custard|velveeta|oleo)\b",
+    EGG: r"\b(eggs?|egg whites?|egg yolks?|yolks?|mayonnaise|mayo|meringue)\b",
+    HONEY: r"\bhoney\b",
+    GELATIN: r"\b(gelatin|gelatine|jell-o|jello|marshmallows?)\b",
+    GLUTEN: r"\b(flour|bread|breadcrumbs|bread crumbs|crumbs|pasta|spaghetti|macaroni|"
+            r"noodles|wheat|barley|rye|couscous|bulgur|semolina|crackers?|"
+            r"biscuits?|bisquick|tortillas?|pie crust|cake mix|croutons|seitan|"
+            r"beer|soy sauce|graham)\b",
+    WHEAT: r"\b(flour|bread|breadcrumbs|bread crumbs|pasta|spaghetti|macaroni|noodles|"
+           r"wheat|couscous|bulgur|semolina|crackers?|bisquick|pie crust|cake mix|"
+           r"croutons|seitan|graham)\b",
+    TREE_NUT: r"\b(nuts?|almonds?|walnuts?|pecans?|cashews?|pistachios?|hazelnuts?|"
+              r"macadamias?|brazil nuts?|pine nuts?|praline|marzipan)\b",
+    PEANUT: r"\b(peanuts?|peanut butter)\b",
+    SOY: r"\b(soy|soya|soybeans?|tofu|tempeh|edamame|miso|soy sauce|tamari)\b",
+}
+
+# Phrases removed before matching because they'd otherwise trip a tag they
+# don't belong to (e.g. "peanut butter" is not dairy, "rice flour" is not wheat).
+_FALSE_FRIENDS = re.compile(
+    r"\b(peanut butter|almond butter|apple butter|cocoa butter|nut butter|"
+    r"coconut (milk|cream)|almond milk|soy milk|oat milk|rice milk|"
+    r"cream of tartar|"
+    r"rice flour|almond flour|coconut flour|corn flour|cornflour|potato flour|"
+    r"gluten-free \w+|vegetable broth|vegetable bouillon|"
+    r"nutmeg|butternut|coconut|water chestnuts?|doughnuts?)\b"
+)
+
+_COMPILED = {bit: re.compile(pattern) for bit, pattern in _TAG_PATTERNS.items()}
+
+# Whole-phrase keepers that _FALSE_FRIENDS would otherwise strip entirely.
+_KEEP = {
+    re.compile(r"\bpeanut butter\b"): PEANUT,
+    re.compile(r"\b(almond|nut) butter\b"): TREE_NUT,
+    re.compile(r"\balmond (milk|flour)\b"): TREE_NUT,
+    re.compile(r"\bsoy milk\b"): SOY,
+}
+
+_DIET_EXCLUDES = {
+    "vegetarian": MEAT | FISH | SHELLFISH | GELATIN,
+    "vegan": MEAT | FISH | SHELLFISH | GELATIN | DAIRY | EGG | HONEY,
+}
+
+# Keys are the lowercased option labels the frontends send (see app.py).
+_ALLERGY_EXCLUDES = {
+    "nuts": TREE_NUT | PEANUT,
+    "tree nuts": TREE_NUT,
+    "peanuts": PEANUT,
+    "dairy": DAIRY,
+    "eggs": EGG,
+    "seafood": FISH | SHELLFISH,
+    "fish": FISH,
+    "shellfish": SHELLFISH,
+    "soy": SOY,
+    "wheat": WHEAT,
+    "gluten": GLUTEN,
+}
+
+_RESTRICTION_EXCLUDES = {
+    "gluten-free": GLUTEN,
+    "dairy-free": DAIRY,
+}
+
+
+def ingredients_section(document_text):
+    """Return just the ingredient part of a recipe documentText blob."""
+    if not document_text:
+        return ""
+    match = re.search(r"Ingredients:(.*?)(?:\nDirections:|$)", document_text, re.S)
+    return match.group(1) if match else document_text
+
+
+def compute_tags(ingredients):
+    """Bitset of TAG_NAMES flags found in a recipe's ingredient text."""
+    if not ingredients:
+        return 0
+    text = ingredients.lower()
+
+    tags = 0
+    for pattern, bit in _KEEP.items():
+        if pattern.search(text):
+            tags |= bit
+    text = _FALSE_FRIENDS.sub(" ", text)
+
+    for bit, pattern in _COMPILED.items():
+        if pattern.search(text):
+            tags |= bit
+    return tags
+
+
+def tag_bits(tags):
+    """Positions of the set bits, e.g. 0b1001 -> [0, 3].
+
+    Atlas $vectorSearch filters can't do bitwise tests, so the Mongo documents
+    carry this list alongside the integer and are filtered with $nin.
+    """
+    return [i for i in range(tags.bit_length()) if tags >> i & 1]
+
+
+def excluded_mask(food_type=None, allergies=None, dietary_restrictions=None):
+    """Bitset of tags a recipe must NOT have for this user."""
+    mask = _DIET_EXCLUDES.get((food_type or "").lower(), 0)
+    for allergy in allergies or []:
+        mask |= _ALLERGY_EXCLUDES.get(allergy.lower(), 0)
+    for restriction in dietary_restrictions or []:
+        mask |= _RESTRICTION_EXCLUDES.get(restriction.lower(), 0)
+    return mask
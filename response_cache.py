@@ -0,0 +1,149 @@
+"""
+End-to-end response cache for /analyze, keyed on a hash of the input.
+
+The key is sha256 of the image digests or normalized meal text plus the
+preference fields (and the requested field subset, if any). Idempotency-Key
+headers are stored as aliases of the content key, begin()/end() make
+identical concurrent requests wait for one computation, and each body's
+ETag supports If-None-Match. Storage is a bounded LRU with TTL
+(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL).
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 256))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 3600))
+
+# Form fields that change the response, besides the meal itself
+_PREFERENCE_FIELDS = ("goal", "dietType", "allergies", "restrictions", "cuisinePreference", "mealType")
+_LIST_FIELDS = ("allergies", "restrictions")
+
+
+def _normalize_text(text):
+    # Only what extract_foods_from_text() discards anyway (case, runs of
+    # whitespace). Order shows up in foodItems, so "banana, rice" and
+    # "rice, banana" are different responses.
+    return re.sub(r"\s+", " ", (text or "").lower()).strip()
+
+
+def _normalize_list(raw):
+    try:
+        values = json.loads(raw) if raw else []
+    except ValueError:
+        values = [raw]
+    if not isinstance(values, list):
+        values = [values]
+    return sorted(str(v).strip().lower() for v in values)
+
+
+def content_key(form, image_digests=None, fields=None):
+    """Content address of an /analyze request: its meal input + preferences.
+
+    `image_digests` are the sha256 hex digests of the uploaded photos, in
+    upload order (image_upload.save_upload computes them while streaming).
+    `fields` is the requested field subset (response_encoding.parse_fields);
+    None, the full response, keeps the key it always had.
+    """
+    h = hashlib.sha256()
+    if image_digests:
+        for digest in image_digests:
+            h.update(b"image\0" + digest.encode("ascii"))
+    else:
+        h.update(b"text\0")
+        h.update(_normalize_text(form.get("text")).encode("utf-8"))
+    for field in _PREFERENCE_FIELDS:
+        raw = form.get(field) or ""
+        value = _normalize_list(raw) if field in _LIST_FIELDS else raw.strip().lower()
+        h.update(b"\0" + field.encode("utf-8") + b"=" + json.dumps(value).encode("utf-8"))
+    if fields is not None:
+        h.update(b"\0fields=" + ",".join(sorted(fields)).encode("utf-8"))
+    return h.hexdigest()
+
+
+def idempotency_alias(idempotency_key):
+    return "idem:" + hashlib.sha256(idempotency_key.encode("utf-8")).hexdigest()
+
+
+def etag_for(body):
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+class ResponseCache:
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires, body, etag)
+        self._aliases = {}             # idempotency alias -> content key
+        self._inflight = {}            # key -> threading.Event
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "coalesced": 0}
+
+    def get(self, key, alias=None):
+        """(body, etag) for key (or its idempotency alias), or None."""
+        with self._lock:
+            if alias and alias in self._aliases:
+                key = self._aliases[alias]
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[1], entry[2]
+
+    def put(self, key, body, alias=None):
+        etag = etag_for(body)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, body, etag)
+            self._entries.move_to_end(key)
+            if alias:
+                self._aliases[alias] = key
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+                for a in [a for a, k in self._aliases.items() if k == evicted]:
+                    del self._aliases[a]
+        return etag
+
+    def begin(self, key, wait):
+        """Claim key for computation. Returns True if this caller should compute
+        it; otherwise waits up to `wait` seconds for the owner and returns False
+        (the caller should then re-check the cache)."""
+        with self._lock:
+            event = self._inflight.get(key)
+            if event is None:
+                self._inflight[key] = threading.Event()
+                return True
+            self._stats["coalesced"] += 1
+        event.wait(wait)
+        return False
+
+    def end(self, key):
+        with self._lock:
+            event = self._inflight.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def nbytes(self):
+        with self._lock:
+            return sum(len(body) for _, body, _ in self._entries.values())
+
+    def shrink(self, fraction):
+        """Drop the least recently used `fraction` of entries (memory pressure)."""
+        with self._lock:
+            for _ in range(int(len(self._entries) * fraction)):
+                evicted, _ = self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+                for a in [a for a, k in self._aliases.items() if k == evicted]:
+                    del self._aliases[a]
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "inflight": len(self._inflight)}
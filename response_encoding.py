@@ -0,0 +1,127 @@
+"""
+Field selection and compact encodings for /analyze responses.
+
+parse_fields() reads the `fields` parameter and stages() says which pipeline
+stages those fields need; no parameter means the full response. encode()
+compresses bodies of at least RESPONSE_COMPRESS_MIN_BYTES with brotli or gzip
+per Accept-Encoding, or returns MessagePack for Accept: application/msgpack
+(brotli and msgpack are optional packages). Each representation gets its own
+ETag suffix ("-gz", "-br", "-mp") and responses carry Vary.
+"""
+import gzip
+import json
+import os
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:  # optional; JSON is always available
+    msgpack = None
+
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", 512))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", 6))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", 5))
+
+FIELDS = ("mealType", "foodItems", "nutrients", "goalAlignment", "suggestion", "aiConsultation")
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+# Pipeline stages each field needs beyond food extraction
+_FIELD_STAGES = {
+    "mealType": (),
+    "foodItems": (),
+    "nutrients": ("nutrients",),
+    "goalAlignment": ("nutrients", "verdict"),
+    "suggestion": ("nutrients", "verdict"),
+    "aiConsultation": ("consultation",),
+}
+# Async consultation bookkeeping travels with aiConsultation
+_CONSULTATION_EXTRAS = ("consultationJobId", "consultationStatus", "consultationError")
+
+
+def parse_fields(raw):
+    """frozenset of requested fields, or None for all; ValueError on unknown names."""
+    if not raw or not raw.strip():
+        return None
+    fields = frozenset(f.strip() for f in raw.split(",") if f.strip())
+    unknown = sorted(fields - set(FIELDS))
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Choose from: {', '.join(FIELDS)}.")
+    return fields
+
+
+def stages(fields):
+    """Pipeline stages ("nutrients", "verdict", "consultation") needed for `fields`."""
+    return {stage for field in (fields or FIELDS) for stage in _FIELD_STAGES[field]}
+
+
+def select(payload, fields):
+    """`payload` restricted to `fields` (None keeps everything)."""
+    if fields is None:
+        return payload
+    keep = set(fields) | (set(_CONSULTATION_EXTRAS) if "aiConsultation" in fields else set())
+    return {k: v for k, v in payload.items() if k in keep}
+
+
+def select_body(body, fields):
+    """A cached full JSON body, restricted to `fields`."""
+    return json.dumps(select(json.loads(body), fields), separators=(",", ":")).encode("utf-8")
+
+
+def negotiate(request):
+    """(media type, content coding or None) for this request's Accept headers."""
+    media = "application/json"
+    if msgpack is not None:
+        best = request.accept_mimetypes.best_match(("application/json",) + MSGPACK_TYPES)
+        if best in MSGPACK_TYPES:
+            media = best
+    offered = ("br", "gzip") if brotli is not None else ("gzip",)
+    return media, request.accept_encodings.best_match(offered)
+
+
+def _compress(body, coding):
+    if coding == "br":
+        return brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL)
+
+
+def encode(request, response):
+    """Re-encode a JSON response per the request's Accept / Accept-Encoding.
+
+    Returns the response to send: `response` re-encoded in place, or a 304
+    if the client already holds this representation (If-None-Match).
+    """
+    if response.mimetype != "application/json" or response.direct_passthrough:
+        return response
+    media, coding = negotiate(request)
+    response.vary.add("Accept-Encoding")
+    if msgpack is not None:
+        response.vary.add("Accept")
+
+    body = response.get_data()
+    if len(body) < RESPONSE_COMPRESS_MIN_BYTES:
+        coding = None
+    suffix = "-".join(part for part in ("mp" if media != "application/json" else "",
+                                        {"br": "br", "gzip": "gz"}.get(coding, "")) if part)
+
+    tag, weak = response.get_etag()
+    if tag and suffix:
+        tag = f"{tag}-{suffix}"
+        response.set_etag(tag, weak)
+    if tag and response.status_code == 200 and request.if_none_match.contains_raw(response.headers["ETag"]):
+        headers = {k: v for k, v in response.headers.items() if k in ("ETag", "Vary", "X-Cache")}
+        return Response(status=304, headers=headers)
+
+    if media != "application/json":
+        body = msgpack.packb(json.loads(body))
+        response.mimetype = media
+    if coding:
+        body = _compress(body, coding)
+        response.headers["Content-Encoding"] = coding
+    response.set_data(body)
+    return response
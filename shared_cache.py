@@ -0,0 +1,358 @@
+"""
+Two-tier cache shared by every worker on the host.
+
+Caches that live inside one process are private to one gunicorn worker: every
+worker warms up separately, and the hit rate drops as workers are added. A
+cache from this module has two tiers:
+
+  - L1: a small per-process LRU (SHARED_CACHE_L1_SIZE entries per namespace)
+    whose entries expire after min(their TTL, SHARED_CACHE_L1_TTL). It
+    answers repeat lookups without I/O.
+  - L2: a SQLite file in WAL mode (SHARED_CACHE_PATH) shared by every
+    process on the host. An L1 miss reads it, so each worker's lookups serve
+    every other worker. Reads don't block writers under WAL. The file is
+    pruned to SHARED_CACHE_MAX_ROWS.
+
+Keys are namespaced ("usda", "recipe_search", ...) and carry the namespace's
+schema version, so changing what a namespace stores only requires bumping its
+version; old rows then simply stop matching. Values are JSON, or numpy arrays,
+stored behind a one-byte format version, so a format change is read as a miss
+rather than misparsed.
+
+Invalidation:
+  - cache.invalidate(key) drops one key from L1 and L2. Other workers' L1s
+    may serve it for up to SHARED_CACHE_L1_TTL seconds.
+  - cache.invalidate() drops the whole namespace by bumping its generation
+    in L2. Every worker notices within a second and ignores older entries.
+  - cache.on_invalidate(fn) registers a hook called as fn(key_or_None) after
+    a local invalidation, for dependent state.
+
+The cache never fails a request: any L2 error is counted and the lookup
+becomes a miss. Setting SHARED_CACHE_PATH to an empty string disables L2.
+stats() reports L1/L2 hits, misses, evictions and errors per namespace.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import memory_governor
+
+SHARED_CACHE_PATH = os.getenv(
+    "SHARED_CACHE_PATH", os.path.join(tempfile.gettempdir(), "ai_nutritionist_cache.sqlite3")
+)
+SHARED_CACHE_L1_SIZE = int(os.getenv("SHARED_CACHE_L1_SIZE", 512))
+SHARED_CACHE_L1_TTL = float(os.getenv("SHARED_CACHE_L1_TTL", 60))
+SHARED_CACHE_MAX_ROWS = int(os.getenv("SHARED_CACHE_MAX_ROWS", 50000))
+
+FORMAT_VERSION = 1
+_FORMAT_JSON = b"j"
+_FORMAT_NDARRAY = b"n"
+_PRUNE_EVERY = 200
+_GENERATION_POLL = 1.0
+
+_local = threading.local()
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+# ----------------------------------------------------------------------------
+# Serialization
+# ----------------------------------------------------------------------------
+
+def _json_default(value):
+    # numpy scalars and arrays inside otherwise plain results (scores, etc.)
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def encode(value):
+    """Versioned bytes for `value` (JSON-serializable, or a numpy array)."""
+    if type(value).__name__ == "ndarray":
+        header = json.dumps({"dtype": value.dtype.str, "shape": value.shape}).encode("utf-8")
+        return (bytes([FORMAT_VERSION]) + _FORMAT_NDARRAY + struct.pack("!I", len(header)) + header
+                + value.tobytes())
+    return bytes([FORMAT_VERSION]) + _FORMAT_JSON + json.dumps(value, default=_json_default).encode("utf-8")
+
+
+def decode(data):
+    """Inverse of encode(); raises ValueError on an unknown format version."""
+    if not data or data[0] != FORMAT_VERSION:
+        raise ValueError(f"unsupported cache format {data[:1]!r}")
+    kind, body = data[1:2], data[2:]
+    if kind == _FORMAT_JSON:
+        return json.loads(body)
+    if kind == _FORMAT_NDARRAY:
+        import numpy as np
+        (length,) = struct.unpack("!I", body[:4])
+        header = json.loads(body[4:4 + length])
+        return np.frombuffer(body[4 + length:], dtype=header["dtype"]).reshape(header["shape"]).copy()
+    raise ValueError(f"unsupported cache value kind {kind!r}")
+
+
+def key_for(*parts):
+    """Stable short key for arbitrary JSON-serializable parts (prompts, filters)."""
+    raw = json.dumps(parts, sort_keys=True, default=_json_default).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+# ----------------------------------------------------------------------------
+# L2: SQLite WAL file
+# ----------------------------------------------------------------------------
+
+def _connect():
+    # One connection per thread (and per process: reset after fork)
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(SHARED_CACHE_PATH, timeout=2, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL, created REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_created ON cache(created)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS generations (namespace TEXT PRIMARY KEY, generation INTEGER NOT NULL)"
+        )
+        _local.conn = conn
+    return conn
+
+
+def _reset_after_fork():
+    # A SQLite connection must not be used across fork()
+    global _local
+    _local = threading.local()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class TwoTierCache:
+    """One namespace of the shared cache. Use get_cache() rather than this directly."""
+
+    def __init__(self, namespace, version=1, ttl=3600, l1_size=SHARED_CACHE_L1_SIZE,
+                 l1_ttl=SHARED_CACHE_L1_TTL, path=SHARED_CACHE_PATH):
+        self.namespace = namespace
+        self.version = version
+        self.ttl = ttl
+        self.l1_size = l1_size
+        self.l1_ttl = l1_ttl
+        self.shared = bool(path)
+        self._l1 = OrderedDict()  # key -> (expires, encoded bytes, generation)
+        self._lock = threading.Lock()
+        self._hooks = []
+        self._generation = 0
+        self._generation_checked = 0.0
+        self._sets = 0
+        self._stats = {"l1Hits": 0, "l2Hits": 0, "misses": 0, "sets": 0, "l1Evictions": 0,
+                       "l2Pruned": 0, "invalidations": 0, "errors": 0}
+
+    # -- generation (namespace-wide invalidation) ---------------------------
+
+    def _current_generation(self):
+        now = time.monotonic()
+        if not self.shared or now - self._generation_checked < _GENERATION_POLL:
+            return self._generation
+        self._generation_checked = now
+        try:
+            row = _connect().execute(
+                "SELECT generation FROM generations WHERE namespace = ?", (self.namespace,)
+            ).fetchone()
+            self._generation = row[0] if row else 0
+        except sqlite3.Error as e:
+            self._error(e)
+        return self._generation
+
+    def _l2_key(self, key, generation):
+        return f"{self.namespace}:{self.version}:{generation}:{key}"
+
+    def _error(self, e):
+        self._stats["errors"] += 1
+        if self._stats["errors"] in (1, 10, 100) or self._stats["errors"] % 1000 == 0:
+            print(f"Shared cache [{self.namespace}] L2 error: {e}")
+
+    # -- lookups ------------------------------------------------------------
+
+    def get(self, key, default=None):
+        """The cached value for `key`, or `default`."""
+        generation = self._current_generation()
+        now = time.time()
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is not None:
+                if entry[0] > now and entry[2] == generation:
+                    self._l1.move_to_end(key)
+                    self._stats["l1Hits"] += 1
+                    return decode(entry[1])
+                del self._l1[key]
+
+        data = None
+        if self.shared:
+            try:
+                row = _connect().execute(
+                    "SELECT value, expires FROM cache WHERE key = ?", (self._l2_key(key, generation),)
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    data, expires = row
+            except sqlite3.Error as e:
+                self._error(e)
+        if data is not None:
+            try:
+                value = decode(data)
+            except ValueError:
+                value, data = None, None
+        if data is None:
+            with self._lock:
+                self._stats["misses"] += 1
+            return default
+
+        with self._lock:
+            self._stats["l2Hits"] += 1
+            self._put_l1(key, data, min(expires, now + self.l1_ttl), generation)
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        data = encode(value)
+        generation = self._current_generation()
+        now = time.time()
+        with self._lock:
+            self._stats["sets"] += 1
+            self._put_l1(key, data, now + min(ttl, self.l1_ttl), generation)
+            self._sets += 1
+            prune = self._sets % _PRUNE_EVERY == 0
+        if self.shared:
+            try:
+                conn = _connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires, created) VALUES (?, ?, ?, ?)",
+                    (self._l2_key(key, generation), sqlite3.Binary(data), now + ttl, now),
+                )
+                if prune:
+                    self._prune(conn, now)
+            except sqlite3.Error as e:
+                self._error(e)
+
+    def get_or_compute(self, key, compute, ttl=None, cache_if=lambda value: value is not None):
+        """Cached value for `key`, else compute() — stored only if cache_if(value)."""
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+        value = compute()
+        if cache_if(value):
+            self.set(key, value, ttl)
+        return value
+
+    def _put_l1(self, key, data, expires, generation):
+        self._l1[key] = (expires, data, generation)
+        self._l1.move_to_end(key)
+        while len(self._l1) > self.l1_size:
+            self._l1.popitem(last=False)
+            self._stats["l1Evictions"] += 1
+
+    def _prune(self, conn, now):
+        # Shared by all namespaces; whichever process hits its prune turn does it
+        pruned = conn.execute("DELETE FROM cache WHERE expires <= ?", (now,)).rowcount
+        pruned += conn.execute(
+            "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (SHARED_CACHE_MAX_ROWS,),
+        ).rowcount
+        self._stats["l2Pruned"] += max(pruned, 0)
+
+    # -- invalidation -------------------------------------------------------
+
+    def invalidate(self, key=None):
+        """Drop `key`, or (key=None) everything in this namespace, in every tier."""
+        with self._lock:
+            self._stats["invalidations"] += 1
+            if key is None:
+                self._l1.clear()
+            else:
+                self._l1.pop(key, None)
+        if self.shared:
+            try:
+                conn = _connect()
+                if key is None:
+                    conn.execute(
+                        "INSERT INTO generations (namespace, generation) VALUES (?, 1) "
+                        "ON CONFLICT(namespace) DO UPDATE SET generation = generation + 1",
+                        (self.namespace,),
+                    )
+                    self._generation_checked = 0.0
+                else:
+                    conn.execute("DELETE FROM cache WHERE key = ?",
+                                 (self._l2_key(key, self._current_generation()),))
+            except sqlite3.Error as e:
+                self._error(e)
+        else:
+            if key is None:
+                self._generation += 1
+        for hook in list(self._hooks):
+            try:
+                hook(key)
+            except Exception as e:
+                print(f"Shared cache [{self.namespace}] invalidation hook failed: {e}")
+
+    def on_invalidate(self, hook):
+        """Call hook(key_or_None) after every invalidation through this process."""
+        self._hooks.append(hook)
+
+    # -- memory governor / metrics -----------------------------------------
+
+    def nbytes(self):
+        with self._lock:
+            return sum(len(data) for _, data, _ in self._l1.values())
+
+    def shrink(self, fraction):
+        """Drop the least recently used `fraction` of L1 (L2 is on disk)."""
+        with self._lock:
+            for _ in range(int(len(self._l1) * fraction)):
+                self._l1.popitem(last=False)
+                self._stats["l1Evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["l1Hits"] + self._stats["l2Hits"] + self._stats["misses"]
+            hits = self._stats["l1Hits"] + self._stats["l2Hits"]
+            return {
+                **self._stats,
+                "version": self.version,
+                "l1Entries": len(self._l1),
+                "hitRate": round(hits / lookups, 3) if lookups else None,
+            }
+
+
+def get_cache(namespace, version=1, ttl=3600, **kwargs):
+    """The process-wide TwoTierCache for `namespace` (created on first use)."""
+    with _registry_lock:
+        cache = _registry.get(namespace)
+        if cache is None:
+            cache = TwoTierCache(namespace, version=version, ttl=ttl, **kwargs)
+            _registry[namespace] = cache
+            memory_governor.register(f"cache:{namespace}", cache.nbytes, cache.shrink, kind="cache")
+        return cache
+
+
+def invalidate(namespace, key=None):
+    """Invalidate `key` (or the whole namespace) on the registered cache."""
+    cache = _registry.get(namespace)
+    if cache is None:
+        cache = get_cache(namespace)
+    cache.invalidate(key)
+
+
+def stats():
+    with _registry_lock:
+        caches = dict(_registry)
+    return {
+        "path": SHARED_CACHE_PATH or None,
+        "namespaces": {name: cache.stats() for name, cache in caches.items()},
+    }
@@ -0,0 +1,183 @@
+"""
+Startup profiler and cold-start budget check for the Python service.
+
+Nothing used to measure what booting the API costs, so a stray module-level
+import of google.generativeai, torch or pymongo could quietly add seconds to
+every cold boot and autoscaled instance. This tool imports each module in a
+fresh interpreter (so nothing is already cached) and reports:
+
+  - import time and RSS delta per project module and per heavy dependency
+  - the slowest modules in `import api_server` (from python -X importtime)
+  - the first-request latency of /health on a freshly imported app
+  - which heavy dependencies importing api_server pulled in (should be none)
+
+Usage:
+    python startup_profiler.py                  # write startup_profile.json
+    python startup_profiler.py --output report.json
+    python startup_profiler.py --check          # also enforce the budgets
+
+--check exits non-zero if api_server's import time or first /health request
+exceeds its budget, or if importing it loads any heavy dependency, so it can
+run as a regression gate in CI.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+IMPORT_BUDGET_SECONDS = float(os.getenv("STARTUP_IMPORT_BUDGET", 2.0))
+FIRST_REQUEST_BUDGET_SECONDS = float(os.getenv("STARTUP_FIRST_REQUEST_BUDGET", 0.5))
+
+PROJECT_MODULES = [
+    "api_server", "admission", "warmup", "jobs", "response_cache", "shared_cache", "image_upload",
+    "memory_governor", "usda_client", "traffic_capture", "response_encoding",
+    "llm_gateway", "text_extraction", "nutrition_info", "diet_analyzer", "goal_scorer",
+    "llm_model", "prompt_builder", "recipe_query", "recipe_atlas", "recipe_tags", "recipe_lexical", "recipe_index",
+]
+
+# Dependencies that must only ever be imported lazily, on first use
+HEAVY_MODULES = [
+    "google.generativeai", "torch", "sentence_transformers", "chromadb", "pymongo",
+    "PIL.Image", "numpy", "pandas", "requests",
+]
+
+_MEASURE_IMPORT = """
+import importlib, json, sys, time
+sys.path.insert(0, {root!r})
+from memory_governor import rss_bytes
+heavy = {heavy!r}
+rss_before = rss_bytes()
+t_start = time.perf_counter()
+error = None
+try:
+    importlib.import_module({name!r})
+except Exception as e:
+    error = f"{{type(e).__name__}}: {{e}}"
+seconds = time.perf_counter() - t_start
+print(json.dumps({{
+    "seconds": round(seconds, 4),
+    "rssDeltaMB": round((rss_bytes() - rss_before) / 1048576, 1),
+    "heavyLoaded": [m for m in heavy if m in sys.modules and m != {name!r}],
+    "error": error,
+}}))
+"""
+
+_MEASURE_FIRST_REQUEST = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+import api_server
+client = api_server.app.test_client()
+t_start = time.perf_counter()
+response = client.get("/health")
+print(json.dumps({{"seconds": round(time.perf_counter() - t_start, 4), "status": response.status_code}}))
+"""
+
+
+def _run(code, *python_args):
+    result = subprocess.run(
+        [sys.executable, *python_args, "-c", code],
+        cwd=ROOT, capture_output=True, text=True, timeout=600,
+    )
+    return result
+
+
+def measure_import(name):
+    result = _run(_MEASURE_IMPORT.format(root=ROOT, heavy=HEAVY_MODULES, name=name))
+    try:
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        return {"seconds": None, "rssDeltaMB": None, "heavyLoaded": [], "error": result.stderr.strip()[-300:]}
+
+
+def slowest_imports(name="api_server", limit=15):
+    """Top `limit` modules by self import time under python -X importtime."""
+    result = _run(f"import sys; sys.path.insert(0, {ROOT!r}); import {name}", "-X", "importtime")
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        # "import time:  <self us> | <cumulative us> | <indented module>"
+        try:
+            self_us, cumulative_us, module = line.split(":", 1)[1].split("|")
+            rows.append({"module": module.strip(), "selfMs": int(self_us) / 1000,
+                         "cumulativeMs": int(cumulative_us) / 1000})
+        except ValueError:
+            continue
+    return sorted(rows, key=lambda r: r["selfMs"], reverse=True)[:limit]
+
+
+def measure_first_request():
+    result = _run(_MEASURE_FIRST_REQUEST.format(root=ROOT))
+    try:
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        return {"seconds": None, "status": None, "error": result.stderr.strip()[-300:]}
+
+
+def profile():
+    return {
+        "python": sys.version.split()[0],
+        "projectModules": {name: measure_import(name) for name in PROJECT_MODULES},
+        "heavyDependencies": {name: measure_import(name) for name in HEAVY_MODULES},
+        "apiServerSlowestImports": slowest_imports(),
+        "firstHealthRequest": measure_first_request(),
+        "budgets": {"importSeconds": IMPORT_BUDGET_SECONDS, "firstRequestSeconds": FIRST_REQUEST_BUDGET_SECONDS},
+    }
+
+
+def check(report):
+    """List of budget violations in a profile() report (empty means pass)."""
+    failures = []
+    api = report["projectModules"]["api_server"]
+    if api.get("error"):
+        failures.append(f"api_server failed to import: {api['error']}")
+    elif api["seconds"] > IMPORT_BUDGET_SECONDS:
+        failures.append(f"api_server import took {api['seconds']:.2f}s (budget {IMPORT_BUDGET_SECONDS:.2f}s)")
+    if api.get("heavyLoaded"):
+        failures.append(f"api_server import pulled in heavy modules: {', '.join(api['heavyLoaded'])}")
+
+    first = report["firstHealthRequest"]
+    if first.get("seconds") is None:
+        failures.append(f"first /health request failed: {first.get('error')}")
+    elif first["seconds"] > FIRST_REQUEST_BUDGET_SECONDS:
+        failures.append(
+            f"first /health request took {first['seconds']:.2f}s (budget {FIRST_REQUEST_BUDGET_SECONDS:.2f}s)"
+        )
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", default=os.path.join(ROOT, "startup_profile.json"))
+    parser.add_argument("--check", action="store_true", help="exit non-zero if a startup budget is exceeded")
+    args = parser.parse_args()
+
+    report = profile()
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'module':<24}{'import s':>10}{'RSS MB':>9}  heavy deps loaded")
+    for section in ("projectModules", "heavyDependencies"):
+        for name, m in report[section].items():
+            seconds = "error" if m.get("error") or m.get("seconds") is None else f"{m['seconds']:.3f}"
+            rss = f"{m['rssDeltaMB']:.1f}" if m.get("rssDeltaMB") is not None else "-"
+            print(f"{name:<24}{seconds:>10}{rss:>9}  {', '.join(m.get('heavyLoaded') or []) or '-'}")
+    first = report["firstHealthRequest"]
+    print(f"\nFirst /health request: {first.get('seconds')}s")
+    print(f"Report written to {args.output}")
+
+    if args.check:
+        failures = check(report)
+        if failures:
+            print("\nSTARTUP BUDGET EXCEEDED:")
+            for failure in failures:
+                print(f"  - {failure}")
+            sys.exit(1)
+        print("\nStartup budgets OK.")
+
+
+if __name__ == "__main__":
+    main()
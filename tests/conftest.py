@@ -0,0 +1,5 @@
+# The service is a flat set of top-level modules; make them importable
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,24 @@
+import time
+
+import pytest
+
+from admission import DeadlineExceeded, check_deadline, clamp_timeout, deadline
+
+
+def test_clamp_timeout_without_deadline():
+    assert clamp_timeout(30) == 30
+
+
+def test_clamp_timeout_caps_to_time_left():
+    with deadline(2):
+        assert 1.5 < clamp_timeout(30) <= 2
+        assert clamp_timeout(1) == 1
+
+
+def test_clamp_timeout_floor_after_expiry():
+    with deadline(0):
+        time.sleep(0.01)
+        assert clamp_timeout(30) == 0.1
+        with pytest.raises(DeadlineExceeded):
+            check_deadline("test")
+    check_deadline("outside any deadline")
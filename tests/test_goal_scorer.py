@@ -0,0 +1,45 @@
+from goal_scorer import GOAL_TARGETS, MEALS_PER_DAY, score_meal
+
+
+def _meal(goal, calorie_ratio=1.0):
+    """A meal at `calorie_ratio` of the goal's per-meal calories, on its macro split."""
+    targets = GOAL_TARGETS[goal]
+    calories = targets["calories"] / MEALS_PER_DAY * calorie_ratio
+    split = targets["split"]
+    return {
+        "calories": calories,
+        "protein": calories * split["protein"] / 4,
+        "carbs": calories * split["carbs"] / 4,
+        "fat": calories * split["fat"] / 9,
+        "fiber": 15,
+    }
+
+
+def test_no_calories_is_neutral():
+    result = score_meal({}, "lose")
+    assert result["score"] == 5
+    assert result["verdict"] == "neutral"
+    assert result["calorieRatio"] is None
+
+
+def test_on_target_meal_helps():
+    result = score_meal(_meal("maintain"), "maintain")
+    assert result["verdict"] == "helping"
+    assert result["calorieRatio"] == 1.0
+    assert result["components"]["balance"] == 1.0
+
+
+def test_overshoot_penalized_for_lose_not_gain():
+    big = _meal("maintain", calorie_ratio=2.0)
+    assert score_meal(big, "lose")["score"] < score_meal(big, "gain")["score"]
+    assert score_meal(big, "lose")["weakest"] == "calories_high"
+
+
+def test_unknown_goal_scores_as_maintain():
+    meal = _meal("maintain")
+    assert score_meal(meal, "bulk") == score_meal(meal, "maintain")
+
+
+def test_score_is_bounded():
+    for meal in ({"calories": 1}, {"calories": 10_000, "fat": 1000}):
+        assert 1 <= score_meal(meal, "lose")["score"] <= 10
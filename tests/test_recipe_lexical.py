@@ -0,0 +1,17 @@
+from recipe_lexical import rrf_fuse
+
+
+def test_rrf_fuse_rewards_agreement():
+    # b is second in both lists; a and c are first in only one
+    assert rrf_fuse([["a", "b"], ["c", "b"]])[0] == "b"
+    assert rrf_fuse([["a", "b", "c"], ["b", "a", "d"]])[2:] in (["c", "d"], ["d", "c"])
+
+
+def test_rrf_fuse_includes_every_id_once():
+    fused = rrf_fuse([["a", "b"], ["c"], []])
+    assert sorted(fused) == ["a", "b", "c"]
+    assert fused[0] in ("a", "c")
+
+
+def test_rrf_fuse_empty():
+    assert rrf_fuse([]) == []
@@ -0,0 +1,59 @@
+import pytest
+
+from recipe_nutrition import apply_goal_fit, goal_fit, parse_ingredient
+
+
+@pytest.mark.parametrize("line, grams, name", [
+    ("2 cups flour", 250, "flour"),
+    ("1 1/2 tbsp olive oil", 22.5, "olive oil"),
+    ("½ lb ground beef", 226.8, "beef"),
+    ("2 large eggs", 100, "eggs"),
+    ("1 (15 oz) can black beans, drained", 400, "black beans"),
+    ("3 zucchini", 600, "zucchini"),
+])
+def test_parse_ingredient(line, grams, name):
+    parsed_grams, parsed_name = parse_ingredient(line)
+    assert parsed_grams == pytest.approx(grams)
+    assert parsed_name == name
+
+
+def test_parse_ingredient_without_quantity():
+    assert parse_ingredient("salt and pepper to taste") == (None, "salt and pepper")
+
+
+def _profile(calories, protein=30, carbs=40, fat=15, fiber=8):
+    return {"coverage": 1.0,
+            "perServing": {"calories": calories, "protein": protein, "carbs": carbs, "fat": fat, "fiber": fiber}}
+
+
+def test_calorie_ceiling_keeps_unprofiled_recipes():
+    results = [
+        {"recipeId": "heavy", "score": 0.9, "nutrition": _profile(1200)},
+        {"recipeId": "light", "score": 0.8, "nutrition": _profile(450)},
+        {"recipeId": "unknown", "score": 0.7},
+    ]
+    kept = apply_goal_fit(results, 5, max_calories=750)
+    assert [r["recipeId"] for r in kept] == ["light", "unknown"]
+
+
+def test_goal_fit_reranks_and_truncates():
+    results = [
+        {"recipeId": "similar", "score": 0.80, "nutrition": _profile(1400, protein=5, fat=90, fiber=0)},
+        {"recipeId": "fits", "score": 0.78, "nutrition": _profile(550)},
+    ]
+    assert [r["recipeId"] for r in apply_goal_fit(results, 1, goal="lose")] == ["fits"]
+
+
+def test_cosine_scores_are_mapped_to_unit_scale():
+    on_target = {"coverage": 1.0,
+                 "perServing": {"calories": 600, "protein": 45, "carbs": 60, "fat": 20, "fiber": 10}}
+    assert goal_fit(on_target, "lose") >= 9
+    results = [
+        {"recipeId": "similar", "score": 0.3},
+        {"recipeId": "fits", "score": 0.0, "nutrition": on_target},
+    ]
+    # As raw cosine the 0.3 similarity gap halves to 0.15, and the fit wins
+    assert [r["recipeId"] for r in apply_goal_fit(results, 2, goal="lose", cosine_scores=True)] == ["fits", "similar"]
+    # Already on the unit scale, the same gap outweighs the fit
+    assert [r["recipeId"] for r in apply_goal_fit(results, 2, goal="lose")] == ["similar", "fits"]
+    assert results[0]["score"] == 0.3  # returned scores are left alone
@@ -0,0 +1,24 @@
+from recipe_tags import (DAIRY, EGG, FISH, GELATIN, GLUTEN, HONEY, MEAT, PEANUT, SHELLFISH, TREE_NUT,
+                         compute_tags, excluded_mask)
+
+
+def test_no_preferences_excludes_nothing():
+    assert excluded_mask() == 0
+    assert excluded_mask("non-veg", [], []) == 0
+
+
+def test_diet_types():
+    assert excluded_mask("vegetarian") == MEAT | FISH | SHELLFISH | GELATIN
+    assert excluded_mask("Vegan") == MEAT | FISH | SHELLFISH | GELATIN | DAIRY | EGG | HONEY
+
+
+def test_allergies_and_restrictions_combine():
+    mask = excluded_mask("non-veg", ["Nuts", "unknown allergy"], ["gluten-free", "low-carb"])
+    assert mask == TREE_NUT | PEANUT | GLUTEN
+
+
+def test_tags_match_exclusions():
+    tags = compute_tags("2 cups milk, 1 lb chicken breast")
+    assert tags & MEAT and tags & DAIRY
+    assert tags & excluded_mask("vegetarian")
+    assert not tags & excluded_mask(allergies=["peanuts"])
@@ -0,0 +1,34 @@
+from response_cache import ResponseCache, content_key
+
+FORM = {"text": "banana, rice", "goal": "lose", "dietType": "vegan", "allergies": '["nuts", "soy"]'}
+
+
+def test_key_ignores_case_whitespace_and_list_order():
+    same = {**FORM, "text": "  Banana,   rice ", "goal": "LOSE", "allergies": '["soy", "Nuts"]'}
+    assert content_key(same) == content_key(FORM)
+
+
+def test_key_keeps_food_order():
+    assert content_key({**FORM, "text": "rice, banana"}) != content_key(FORM)
+
+
+def test_key_depends_on_preferences_fields_and_images():
+    key = content_key(FORM)
+    assert content_key({**FORM, "goal": "gain"}) != key
+    assert content_key(FORM, fields={"nutrients"}) != key
+    assert content_key(FORM, fields={"nutrients", "goalAlignment"}) == content_key(
+        FORM, fields={"goalAlignment", "nutrients"})
+    # Photos replace the text in the key
+    assert content_key(FORM, ["d1"]) == content_key({**FORM, "text": "other"}, ["d1"])
+    assert content_key(FORM, ["d1"]) != content_key(FORM, ["d2"])
+
+
+def test_cache_alias_and_single_flight():
+    cache = ResponseCache(max_entries=2, ttl=60)
+    assert cache.begin("k", wait=0)
+    assert not cache.begin("k", wait=0)  # someone else owns it
+    etag = cache.put("k", b"{}", alias="idem:1")
+    cache.end("k")
+    assert cache.get("k") == (b"{}", etag)
+    assert cache.get("missing", alias="idem:1") == (b"{}", etag)
+    assert cache.begin("k", wait=0)
@@ -0,0 +1,64 @@
+import gzip
+import json
+
+import pytest
+from flask import Flask, jsonify
+
+import response_encoding
+
+
+@pytest.fixture
+def app():
+    return Flask(__name__)
+
+
+def _body(size=2000):
+    return {"mealType": "Lunch", "foodItems": ["rice"], "aiConsultation": "x" * size}
+
+
+def test_parse_fields():
+    assert response_encoding.parse_fields(None) is None
+    assert response_encoding.parse_fields(" ") is None
+    assert response_encoding.parse_fields("nutrients, goalAlignment") == {"nutrients", "goalAlignment"}
+    with pytest.raises(ValueError):
+        response_encoding.parse_fields("nutrients,secrets")
+
+
+def test_stages():
+    assert response_encoding.stages({"foodItems"}) == set()
+    assert response_encoding.stages({"goalAlignment"}) == {"nutrients", "verdict"}
+    assert response_encoding.stages(None) == {"nutrients", "verdict", "consultation"}
+
+
+def test_select_keeps_consultation_extras():
+    payload = {"foodItems": [], "aiConsultation": None, "consultationJobId": "j", "nutrients": {}}
+    assert response_encoding.select(payload, {"aiConsultation"}) == {"aiConsultation": None,
+                                                                    "consultationJobId": "j"}
+    assert response_encoding.select(payload, None) is payload
+
+
+def test_gzip_when_accepted(app):
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        from flask import request
+        response = jsonify(_body())
+        response.set_etag("abc")
+        encoded = response_encoding.encode(request, response)
+        assert encoded.headers["Content-Encoding"] == "gzip"
+        assert encoded.headers["ETag"] == '"abc-gz"'
+        assert "Accept-Encoding" in encoded.headers["Vary"]
+        assert json.loads(gzip.decompress(encoded.get_data())) == _body()
+
+
+def test_small_bodies_stay_uncompressed(app):
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        from flask import request
+        encoded = response_encoding.encode(request, jsonify(_body(size=10)))
+        assert "Content-Encoding" not in encoded.headers
+
+
+def test_matching_etag_gets_304(app):
+    with app.test_request_context(headers={"Accept-Encoding": "gzip", "If-None-Match": '"abc-gz"'}):
+        from flask import request
+        response = jsonify(_body())
+        response.set_etag("abc")
+        assert response_encoding.encode(request, response).status_code == 304
@@ -0,0 +1,9 @@
+import startup_profiler
+
+
+def test_api_server_import_stays_light_and_fast():
+    report = {
+        "projectModules": {"api_server": startup_profiler.measure_import("api_server")},
+        "firstHealthRequest": startup_profiler.measure_first_request(),
+    }
+    assert startup_profiler.check(report) == []
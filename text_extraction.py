@@ -1,8 +1,15 @@
+import contextvars
+import io
 import os
 import re
-import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+import image_upload
+import traffic_capture
+from admission import DeadlineExceeded
+
 load_dotenv()
 
 # Shared instruction used by every vision provider so the extraction task
@@ -14,6 +21,18 @@ _FOOD_PROMPT = (
     "Do not include quantities, descriptions, or other text."
 )
 
+# Several photos of one meal (different angles, or a day's plates) are
+# extracted together: downscaled in parallel, sent to the vision provider
+# concurrently, and their food lists merged, so the request costs about one
+# image's latency instead of one per image.
+_MULTI_FOOD_PROMPT = (
+    "Extract all visible food items from these images of a meal. "
+    "Return only a single comma-separated list of food names, listing each food once. "
+    "Example: 'banana, apple, bread, chicken' "
+    "Do not include quantities, descriptions, or other text."
+)
+VISION_CONCURRENCY = int(os.getenv("VISION_CONCURRENCY", 4))
+
 NVIDIA_INVOKE_URL = "https://integrate.api.nvidia.com/v1/chat/completions"
 NVIDIA_VISION_MODEL = "meta/llama-3.2-90b-vision-instruct"
 
@@ -21,12 +40,11 @@ NVIDIA_VISION_MODEL = "meta/llama-3.2-90b-vision-instruct"
 def _downscale_image_b64(image_path, max_b64_len=170000):
     """Return base64 JPEG of the image, downscaled to fit NVIDIA's inline image
     limit (~180KB base64). Uploaded meal photos are often several MB / thousands
-    of pixels, which the inline endpoint rejects, so shrink until it fits."""
-    import io
+    of pixels, which the inline endpoint rejects, so shrink until it fits.
+    The photo is decoded at a reduced size to begin with (image_upload)."""
     import base64
-    from PIL import Image
 
-    img = Image.open(image_path).convert("RGB")
+    img = image_upload.open_bounded(image_path, max_dim=1024)
     max_dim, quality = 1024, 85
     while True:
         resized = img.copy()
@@ -42,7 +60,44 @@ def _downscale_image_b64(image_path, max_b64_len=170000):
             max_dim = int(max_dim * 0.85)
 
 
-def extract_foods_with_nvidia(image_path):
+_vision_pool = None
+_vision_pool_lock = threading.Lock()
+
+
+def _get_vision_pool():
+    global _vision_pool
+    with _vision_pool_lock:
+        if _vision_pool is None:
+            _vision_pool = ThreadPoolExecutor(max_workers=VISION_CONCURRENCY, thread_name_prefix="vision")
+        return _vision_pool
+
+
+def _map_concurrently(fn, items):
+    """[fn(item) ...] run on the vision pool; exceptions are returned, not raised,
+    except DeadlineExceeded, which ends the whole request.
+
+    Each call runs in a copy of the caller's context, so the request deadline
+    (admission.py) still clamps the timeouts of the network calls it makes.
+    """
+    if len(items) == 1:
+        futures = None
+    else:
+        pool = _get_vision_pool()
+        futures = [pool.submit(contextvars.copy_context().run, fn, item) for item in items]
+
+    results = []
+    for i, item in enumerate(items):
+        try:
+            results.append(fn(item) if futures is None else futures[i].result())
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+@traffic_capture.upstream("vision")
+def extract_foods_with_nvidia(image_path, img_b64=None):
     """Extract food items from an image using NVIDIA-hosted Llama-3.2-90B-Vision.
 
     Primary vision provider (chosen over Gemini after benchmarking: accurate,
@@ -52,12 +107,14 @@ def extract_foods_with_nvidia(image_path):
     food list, or a friendly no-food message, on success.
     """
     import requests
+    from admission import clamp_timeout
 
     api_key = os.getenv("NVIDIA_API_KEY")
     if not api_key:
         raise RuntimeError("NVIDIA_API_KEY not set")
 
-    img_b64 = _downscale_image_b64(image_path)
+    if img_b64 is None:
+        img_b64 = _downscale_image_b64(image_path)
 
     headers = {"Authorization": f"Bearer {api_key}", "Accept": "application/json"}
     payload = {
@@ -72,7 +129,7 @@ def extract_foods_with_nvidia(image_path):
         "stream": False,
     }
 
-    response = requests.post(NVIDIA_INVOKE_URL, headers=headers, json=payload, timeout=60)
+    response = requests.post(NVIDIA_INVOKE_URL, headers=headers, json=payload, timeout=clamp_timeout(60))
     if response.status_code != 200:
         raise RuntimeError(f"NVIDIA API returned {response.status_code}: {response.text[:120]}")
 
@@ -94,21 +151,21 @@ def extract_foods_with_nvidia(image_path):
 
 
 def extract_foods_with_gemini(image_path):
-    """Extract food items from image using Gemini (fallback vision provider)."""
-    try:
-        import google.generativeai as genai
-        from PIL import Image
+    """Extract food items from image using Gemini (fallback vision provider).
 
-        api_key = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("Google API key not found in environment variables")
-
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel("gemini-2.5-flash")
+    `image_path` may also be a list of paths: Gemini takes several images in
+    one request, so a multi-photo fallback costs one call, not one per photo.
+    """
+    try:
+        import llm_gateway
 
-        image = Image.open(image_path)
+        paths = image_path if isinstance(image_path, (list, tuple)) else [image_path]
+        prompt = _FOOD_PROMPT if len(paths) == 1 else _MULTI_FOOD_PROMPT
+        images = [image_upload.open_bounded(path) for path in paths]
 
-        response = model.generate_content([_FOOD_PROMPT, image])
+        response = llm_gateway.generate(
+            [prompt] + images, priority=llm_gateway.PRIORITY_HIGH, max_output_tokens=256
+        )
 
         # Gemini can return a response with no usable Part (e.g. non-food images,
         # or content it declines to describe) — response.text then raises a raw
@@ -123,6 +180,8 @@ def extract_foods_with_gemini(image_path):
 
         return food_text
 
+    except DeadlineExceeded:
+        raise
     except ImportError:
         return "❌ Required packages not installed: pip install google-generativeai pillow"
     except Exception as e:
@@ -156,38 +215,96 @@ def extract_foods_from_text(text):
     return ", ".join(cleaned_foods)
 
 
-def process_input(input_data=None, uploaded_file=None):
+def merge_food_lists(food_texts):
+    """One comma-separated list from several, each food kept once.
+
+    Foods match case-insensitively and ignoring a plural "s", so "Apples"
+    from one photo and "apple" from another are one item; the first spelling
+    seen is kept.
+    """
+    merged, seen = [], set()
+    for text in food_texts:
+        for food in text.split(","):
+            food = re.sub(r"\s+", " ", food).strip().strip(".")
+            key = food.lower()
+            if len(key) > 3 and key.endswith("s") and not key.endswith("ss"):
+                key = key[:-1]
+            if food and key not in seen:
+                seen.add(key)
+                merged.append(food)
+    return ", ".join(merged)
+
+
+def extract_foods_from_images(image_paths):
+    """Extract and merge the foods in one or more meal photos.
+
+    Photos are downscaled in parallel and each is sent to NVIDIA concurrently
+    (its endpoint takes one inline image per request). Photos NVIDIA fails on
+    go to Gemini together in one multi-image request. Returns the merged
+    food list, or the first error message if no photo yielded any food.
+    """
+    # Primary: NVIDIA Llama-3.2-90B-Vision. Fall back to Gemini on any
+    # technical failure (missing key, timeout, non-200) so a single-provider
+    # outage or quota wall doesn't break extraction.
+    encoded = _map_concurrently(_downscale_image_b64, image_paths)
+    results = _map_concurrently(
+        lambda item: extract_foods_with_nvidia(item[0], img_b64=item[1]),
+        [(path, b64) for path, b64 in zip(image_paths, encoded) if not isinstance(b64, Exception)],
+    )
+
+    texts, failed = [], []
+    remaining = iter(results)
+    for path, b64 in zip(image_paths, encoded):
+        result = b64 if isinstance(b64, Exception) else next(remaining)
+        if isinstance(result, Exception):
+            print(f"NVIDIA vision extraction failed for {os.path.basename(path)} ({result}); falling back to Gemini.")
+            failed.append(path)
+        else:
+            texts.append(result)
+    if failed:
+        texts.append(extract_foods_with_gemini(failed if len(failed) > 1 else failed[0]))
+
+    foods = [text for text in texts if not text.startswith("❌")]
+    if not foods:
+        return texts[0]
+    return merge_food_lists(foods)
+
+
+def process_input(input_data=None, uploaded_file=None, uploaded_files=None, image_paths=None):
     """
     Main function to process input and return extracted food text
     Args:
         input_data: text input
         uploaded_file: streamlit uploaded file object
+        uploaded_files: list of uploaded file objects (several photos of one meal)
+        image_paths: photos already streamed to disk and checked by
+            image_upload.accept(); the caller owns (and deletes) these files
     Returns:
         str: extracted food text or error message
     """
     try:
+        uploads = list(uploaded_files or [])
         if uploaded_file is not None:
-            print("Extracting food items from uploaded image...")
-            # Use tempfile for safe temporary file handling
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-                temp_file.write(uploaded_file.getvalue())
-                temp_path = temp_file.name
-
+            uploads.insert(0, uploaded_file)
+        image_paths = list(image_paths or [])
+
+        if uploads or image_paths:
+            if len(uploads) + len(image_paths) > image_upload.MAX_PHOTOS:
+                return f"❌ Too many photos: at most {image_upload.MAX_PHOTOS} per meal."
+            print(f"Extracting food items from {len(uploads) + len(image_paths)} uploaded image(s)...")
+            # In-memory uploads get the same size, format and pixel checks as
+            # streamed ones before anything decodes them
+            saved = []
             try:
-                # Primary: NVIDIA Llama-3.2-90B-Vision. Fall back to Gemini on
-                # any technical failure (missing key, timeout, non-200) so a
-                # single-provider outage or quota wall doesn't break extraction.
-                try:
-                    return extract_foods_with_nvidia(temp_path)
-                except Exception as e:
-                    print(f"NVIDIA vision extraction failed ({e}); falling back to Gemini.")
-                    return extract_foods_with_gemini(temp_path)
+                for upload in uploads:
+                    saved.append(image_upload.accept(io.BytesIO(upload.getvalue())))
+                return extract_foods_from_images(image_paths + [upload.path for upload in saved])
+            except image_upload.UploadRejected as e:
+                return f"❌ {e}"
             finally:
-                # Ensure temp file is deleted even if extraction fails
-                try:
-                    os.unlink(temp_path)
-                except:
-                    pass  # Ignore deletion errors
+                # Ensure temp files are deleted even if extraction fails
+                for upload in saved:
+                    upload.discard()
 
         elif input_data and isinstance(input_data, str):
             print("Extracting food items from text...")
@@ -196,6 +313,8 @@ def process_input(input_data=None, uploaded_file=None):
         else:
             return "❌ No valid input provided"
 
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return f"❌ Error in process_input: {e}"
 
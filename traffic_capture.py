@@ -0,0 +1,248 @@
+"""
+Opt-in capture of /analyze traffic shapes, and upstream stubs for replaying it.
+
+With TRAFFIC_CAPTURE_PATH set, each /analyze request (or a
+TRAFFIC_CAPTURE_SAMPLE fraction) appends one JSON line describing its shape:
+input kind and size, preferences (known option labels only), status, cache
+result and per-upstream latencies. Meal text and photos are never stored,
+and the cache key is recorded as an HMAC under a per-session salt.
+
+@upstream(name) times a call into the request's trace. With
+TRAFFIC_REPLAY_STUBS=1 the wrapped calls sleep for the replayed latency and
+return canned data instead. Never set it in production.
+"""
+import contextvars
+import functools
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import threading
+import time
+
+import response_encoding
+
+TRAFFIC_CAPTURE_PATH = os.getenv("TRAFFIC_CAPTURE_PATH", "")
+TRAFFIC_CAPTURE_SAMPLE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE", 1.0))
+REPLAY_STUBS = os.getenv("TRAFFIC_REPLAY_STUBS", "").lower() in ("1", "true", "yes")
+REPLAY_HEADER = "X-Replay-Upstreams"
+
+# Option labels the frontends send (app.py, frotend/); anything else is "other"
+_KNOWN_LABELS = {
+    "goal": {"lose", "maintain", "gain", "lose weight", "maintain weight", "gain weight"},
+    "dietType": {"vegetarian", "vegan", "non-veg", "non-vegetarian"},
+    "mealType": {"breakfast", "lunch", "dinner", "snack"},
+    "cuisinePreference": {"any", "mediterranean", "asian", "mexican", "italian", "indian"},
+    "allergies": {"nuts", "tree nuts", "peanuts", "dairy", "eggs", "seafood", "fish", "shellfish", "soy",
+                  "wheat", "gluten"},
+    "restrictions": {"low-carb", "high-protein", "gluten-free", "dairy-free", "low-fat", "keto"},
+}
+
+# Inherited by forked and spawned workers, so all of them key alike
+_SALT = bytes.fromhex(os.environ.setdefault("TRAFFIC_CAPTURE_SALT", os.urandom(16).hex()))
+
+_trace = contextvars.ContextVar("traffic_trace", default=None)
+_write_lock = threading.Lock()
+_stub_rng = random.Random(0)
+
+
+class _Trace:
+    def __init__(self, replay=None):
+        self.started = time.time()
+        self.upstreams = []    # [name, ms], appended from any thread
+        self.uploads = []
+        self.cache_key = None
+        self.replay = replay   # {"u": {name: [ms, ...]}, "d": {name: default ms}}
+        self.lock = threading.Lock()
+
+    def next_latency(self, name):
+        """Seconds the stubbed `name` call should take for this replayed request."""
+        if not self.replay:
+            return 0.0
+        with self.lock:
+            recorded = self.replay.get("u", {}).get(name)
+            if recorded:
+                return recorded.pop(0) / 1000.0
+        return self.replay.get("d", {}).get(name, 0.0) / 1000.0
+
+
+def enabled():
+    return bool(TRAFFIC_CAPTURE_PATH) or REPLAY_STUBS
+
+
+def begin(request):
+    """Start tracing an /analyze request (no-op unless capture or stubs are on)."""
+    if not enabled():
+        return
+    replay = None
+    if REPLAY_STUBS and request.headers.get(REPLAY_HEADER):
+        try:
+            replay = json.loads(request.headers[REPLAY_HEADER])
+        except ValueError:
+            replay = None
+    if not REPLAY_STUBS and random.random() >= TRAFFIC_CAPTURE_SAMPLE:
+        return
+    _trace.set(_Trace(replay))
+
+
+def note(uploads=(), cache_key=None):
+    """Attach the accepted photos (image_upload.SavedUpload) and cache key to the trace."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.uploads = [(u.size, u.dimensions) for u in uploads]
+        trace.cache_key = cache_key
+
+
+def _label(field, value):
+    value = str(value).strip().lower()
+    return value if value in _KNOWN_LABELS[field] else "other"
+
+
+def _list_labels(field, raw):
+    try:
+        values = json.loads(raw) if raw else []
+    except ValueError:
+        values = [raw]
+    if not isinstance(values, list):
+        values = [values]
+    return sorted({_label(field, v) for v in values})
+
+
+def _salted(cache_key):
+    if not cache_key:
+        return ""
+    return hmac.new(_SALT, cache_key.encode("utf-8"), hashlib.sha256).hexdigest()[:12]
+
+
+def _record(trace, request, response):
+    # An over-limit body (413) was never parsed and mustn't be now
+    form = request.form if response.status_code != 413 else {}
+    text = form.get("text") or ""
+    record = {
+        "t": round(trace.started, 3),
+        "k": _salted(trace.cache_key),
+        "in": "photo" if trace.uploads else "text",
+        "chars": len(text),
+        "items": len([f for f in re.split(r",|\band\b|;|\+", text) if f.strip()]),
+        "px": [list(dims) for _, dims in trace.uploads if dims],
+        "bytes": [size for size, _ in trace.uploads],
+        "p": {
+            **{field: _label(field, form.get(field) or default)
+               for field, default in (("goal", "lose"), ("dietType", "non-veg"), ("mealType", "Lunch"),
+                                      ("cuisinePreference", "Any"))},
+            "allergies": _list_labels("allergies", form.get("allergies")),
+            "restrictions": _list_labels("restrictions", form.get("restrictions")),
+        },
+        "async": (request.args.get("async") or form.get("async") or "").lower() in ("1", "true", "yes"),
+        "s": response.status_code,
+        "c": response.headers.get("X-Cache"),
+        "ms": round((time.time() - trace.started) * 1000, 1),
+        "u": list(trace.upstreams),
+    }
+    fields = request.args.get("fields") or form.get("fields")
+    if fields:
+        try:
+            record["fields"] = sorted(response_encoding.parse_fields(fields))
+        except ValueError:
+            pass
+    if response.status_code == 200 and response.mimetype == "application/json":
+        payload = response.get_json(silent=True) or {}
+        record["f"] = len(payload.get("foodItems") or [])
+    return record
+
+
+def end(request, response):
+    """Finish the current trace and append its record to the capture log."""
+    trace = _trace.get()
+    _trace.set(None)
+    if trace is None or not TRAFFIC_CAPTURE_PATH or REPLAY_STUBS:
+        return
+    try:
+        line = json.dumps(_record(trace, request, response), separators=(",", ":")) + "\n"
+        with _write_lock, open(TRAFFIC_CAPTURE_PATH, "a", encoding="utf-8") as f:
+            f.write(line)
+    except Exception as e:
+        print(f"Traffic capture failed: {e}")
+
+
+def discard():
+    _trace.set(None)
+
+
+# ----------------------------------------------------------------------------
+# Upstream timing and replay stubs
+# ----------------------------------------------------------------------------
+
+class _StubResponse:
+    """Just enough of a Gemini response for our callers."""
+
+    def __init__(self, text):
+        self.text = text
+        part = type("Part", (), {"text": text})()
+        content = type("Content", (), {"parts": [part]})()
+        self.candidates = [type("Candidate", (), {"content": content})()]
+
+
+_STUB_FOODS = ["rice", "chicken breast", "broccoli", "egg", "banana", "spinach", "bread", "milk",
+               "salmon", "potato", "tomato", "cheese", "apple", "lentils", "yogurt", "oats"]
+
+
+def _stub_vision(image_path, img_b64=None):
+    # As many foods as the recorded request detected
+    trace = _trace.get()
+    count = (trace.replay or {}).get("f") if trace is not None else None
+    count = min(count or _stub_rng.randint(2, 5), len(_STUB_FOODS))
+    return ", ".join(_stub_rng.sample(_STUB_FOODS, count))
+
+
+def _stub_usda(query, nutrient_ids, *args, **kwargs):
+    return [{"fdcId": 0, "description": query, "dataType": "SR Legacy",
+             "nutrients": {nutrient_id: 10.0 for nutrient_id in nutrient_ids}}]
+
+
+def _stub_recipe_search(query, top_k, *args, **kwargs):
+    return [{"title": f"Stub recipe {i}", "score": 1.0 - i / 10,
+             "documentText": f'Title: Stub recipe {i}\nIngredients: ["{query}"]\nDirections: []'}
+            for i in range(top_k)]
+
+
+def _stub_llm(contents, *args, **kwargs):
+    return _StubResponse(json.dumps({
+        "verdict": "neutral", "score": 5,
+        "summary": "Replay stub assessment.", "suggestion": "Replay stub suggestion.",
+    }))
+
+
+_STUBS = {
+    "vision": _stub_vision,
+    "usda": _stub_usda,
+    "recipe_search": _stub_recipe_search,
+    "llm": _stub_llm,
+}
+
+
+def upstream(name):
+    """Decorator: time calls into the request trace; stub them in replay mode."""
+    stub = _STUBS[name]
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            trace = _trace.get()
+            if REPLAY_STUBS:
+                # Never call out from a replay server, traced request or not
+                delay = trace.next_latency(name) if trace is not None else 0.0
+                if delay > 0:
+                    time.sleep(delay)
+                return stub(*args, **kwargs)
+            if trace is None:
+                return fn(*args, **kwargs)
+            t_start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                trace.upstreams.append([name, round((time.perf_counter() - t_start) * 1000, 1)])
+        return wrapper
+    return decorate
@@ -0,0 +1,290 @@
+"""
+Deterministic replay of captured /analyze traffic, for capacity planning.
+
+Re-drives a capture log written by traffic_capture.py (TRAFFIC_CAPTURE_PATH)
+against a local instance at one or more speed-ups, with every upstream
+stubbed out at its recorded latency:
+
+  1. Each record becomes a request of the same shape: a text meal with the
+     same number of items, or JPEG photos of the recorded dimensions, and the
+     same preferences, field selection and async flag. Inputs are derived
+     from the record's cache-key prefix, so requests that were repeats in
+     production are repeats in the replay, and response-cache hits
+     reproduce. Payloads are built before the run, so the generator doesn't
+     compete with the server.
+  2. Requests are sent open-loop at their recorded arrival offsets divided
+     by the speed-up (idle gaps capped at --max-gap), so a slow server can't
+     slow the offered load down. Latency is measured from the scheduled send
+     time, client-side queueing included.
+  3. Each request carries its recorded upstream latencies in the
+     X-Replay-Upstreams header. The server must run with
+     TRAFFIC_REPLAY_STUBS=1, which --spawn does: a fresh gunicorn per
+     speed-up (gunicorn.conf.py, so the production worker/thread layout) on
+     a free port, with a throwaway shared cache file.
+
+For each speed-up it reports offered and achieved request rates, status
+counts, and p50/p90/p99/max latency. The saturation point is the first
+speed-up whose p99 exceeds --slo-ms or whose error rate (5xx and transport
+errors) exceeds --max-error-rate.
+
+    python traffic_replay.py capture.jsonl --spawn [--speeds 1,2,4,8]
+    python traffic_replay.py capture.jsonl --url http://127.0.0.1:5001
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from traffic_capture import REPLAY_HEADER
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+_FOODS = ["rice", "chicken breast", "broccoli", "egg", "banana", "spinach", "whole wheat bread", "milk",
+          "salmon", "sweet potato", "tomato", "cheddar cheese", "apple", "lentils", "greek yogurt", "oats",
+          "avocado", "tofu", "pasta", "beef", "carrot", "almonds", "orange", "quinoa"]
+
+
+def load_capture(path, limit=None):
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+            if limit and len(records) >= limit:
+                break
+    records.sort(key=lambda r: r["t"])
+    return records
+
+
+def upstream_defaults(records):
+    """Median recorded latency per upstream, for calls a record didn't make."""
+    latencies = defaultdict(list)
+    for record in records:
+        for name, ms in record.get("u", []):
+            latencies[name].append(ms)
+    return {name: float(np.median(values)) for name, values in latencies.items()}
+
+
+def schedule(records, speed, max_gap):
+    """Send offsets in seconds: recorded inter-arrival gaps, capped, divided by speed."""
+    offsets, clock = [], 0.0
+    for i, record in enumerate(records):
+        if i:
+            gap = record["t"] - records[i - 1]["t"]
+            clock += min(gap, max_gap) if max_gap else gap
+        offsets.append(clock / speed)
+    return offsets
+
+
+def _jpeg(width, height, seed):
+    from PIL import Image
+    # Low-res noise scaled up: a photo-like byte size at the recorded dimensions
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (max(height // 16, 1), max(width // 16, 1), 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(small).resize((width, height)).save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+def build_request(record, defaults, image_cache):
+    """(form fields, files, headers) reproducing the record's shape."""
+    key = record.get("k") or hashlib.sha256(json.dumps(record, sort_keys=True).encode()).hexdigest()[:12]
+    rng = random.Random(key)
+    prefs = record.get("p", {})
+    form = {field: value for field, value in prefs.items()
+            if field not in ("allergies", "restrictions") and value != "other"}
+    for field in ("allergies", "restrictions"):
+        form[field] = json.dumps([v for v in prefs.get(field, []) if v != "other"])
+    if record.get("async"):
+        form["async"] = "1"
+    if record.get("fields"):
+        form["fields"] = ",".join(record["fields"])
+
+    files = []
+    if record.get("in") == "photo":
+        for i, dims in enumerate(record.get("px") or [[1024, 768]]):
+            cache_key = (key, i, tuple(dims))
+            if cache_key not in image_cache:
+                image_cache[cache_key] = _jpeg(dims[0], dims[1], seed=rng.randrange(1 << 30))
+            files.append(("photo", (f"meal{i}.jpg", image_cache[cache_key], "image/jpeg")))
+    else:
+        items = max(record.get("items") or 1, 1)
+        form["text"] = ", ".join(rng.choice(_FOODS) for _ in range(items))
+
+    upstreams = defaultdict(list)
+    for name, ms in record.get("u", []):
+        upstreams[name].append(ms)
+    replay = {"u": upstreams, "d": defaults}
+    if record.get("f"):
+        replay["f"] = record["f"]
+    headers = {REPLAY_HEADER: json.dumps(replay, separators=(",", ":"))}
+    return form, files, headers
+
+
+def run_speed(url, requests_built, offsets, max_concurrency, timeout):
+    import requests
+
+    local = threading.local()
+    results = [None] * len(requests_built)
+    t_zero = time.perf_counter() + 0.5
+
+    def send(i):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        form, files, headers = requests_built[i]
+        scheduled = t_zero + offsets[i]
+        try:
+            response = session.post(f"{url}/analyze", data=form, files=files or None, headers=headers,
+                                    timeout=timeout)
+            status = response.status_code
+        except requests.RequestException as e:
+            status = f"error:{type(e).__name__}"
+        results[i] = (status, time.perf_counter() - scheduled)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        for i, offset in enumerate(offsets):
+            delay = t_zero + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, i)
+    wall = time.perf_counter() - t_zero
+    return results, wall
+
+
+def summarize(speed, results, offsets, wall, slo_ms, max_error_rate):
+    statuses = Counter(str(status) for status, _ in results)
+    ok = np.array([latency for status, latency in results if isinstance(status, int) and status < 500]) * 1000
+    errors = sum(1 for status, _ in results if not isinstance(status, int) or status >= 500)
+    duration = max(offsets[-1], 1e-9) if len(offsets) > 1 else 1.0
+
+    def pct(q):
+        return round(float(np.percentile(ok, q)), 1) if len(ok) else None
+
+    row = {
+        "speed": speed,
+        "requests": len(results),
+        "offeredRps": round(len(results) / duration, 2),
+        "achievedRps": round(len(ok) / wall, 2) if wall > 0 else None,
+        "statuses": dict(statuses),
+        "errorRate": round(errors / len(results), 4) if results else 0.0,
+        "p50Ms": pct(50), "p90Ms": pct(90), "p99Ms": pct(99),
+        "maxMs": round(float(ok.max()), 1) if len(ok) else None,
+    }
+    row["saturated"] = bool(row["errorRate"] > max_error_rate or (row["p99Ms"] or 0) > slo_ms)
+    return row
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn_server(extra_env=None):
+    """A stubbed gunicorn (or Flask dev server) on a free port; returns (process, url)."""
+    import requests
+
+    port = _free_port()
+    env = {**os.environ, "PORT": str(port), "TRAFFIC_REPLAY_STUBS": "1", "TRAFFIC_CAPTURE_PATH": "",
+           "SHARED_CACHE_PATH": os.path.join(tempfile.mkdtemp(prefix="replay-cache-"), "cache.sqlite3"),
+           **(extra_env or {})}
+    try:
+        import gunicorn  # noqa: F401
+        command = [sys.executable, "-m", "gunicorn", "api_server:app", "--bind", f"127.0.0.1:{port}"]
+    except ImportError:
+        command = [sys.executable, "api_server.py"]
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"replay server exited with {process.returncode}")
+        try:
+            if requests.get(f"{url}/health", timeout=1).status_code == 200:
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("replay server did not become healthy within 60s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured /analyze traffic against a stubbed local server.")
+    parser.add_argument("capture", help="capture log written with TRAFFIC_CAPTURE_PATH")
+    parser.add_argument("--url", help="already-running server (started with TRAFFIC_REPLAY_STUBS=1)")
+    parser.add_argument("--spawn", action="store_true", help="start a fresh stubbed server per speed-up")
+    parser.add_argument("--speeds", default="1,2,4,8", help="comma-separated speed-ups")
+    parser.add_argument("--limit", type=int, help="replay only the first N records")
+    parser.add_argument("--max-gap", type=float, default=10.0, help="cap idle gaps at this many seconds (0 = none)")
+    parser.add_argument("--max-concurrency", type=int, default=256, help="client connections")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--slo-ms", type=float, default=5000.0, help="p99 latency above this counts as saturated")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--output", default="replay_report.json")
+    args = parser.parse_args()
+    if not args.url and not args.spawn:
+        parser.error("pass --url of a stubbed server, or --spawn")
+
+    records = load_capture(args.capture, args.limit)
+    if not records:
+        raise SystemExit(f"No records in {args.capture}")
+    defaults = upstream_defaults(records)
+    kinds = Counter(r.get("in") for r in records)
+    print(f"{len(records)} records ({dict(kinds)}), recorded upstream medians (ms): "
+          f"{ {name: round(ms, 1) for name, ms in defaults.items()} }")
+
+    print("Building payloads...")
+    image_cache = {}
+    built = [build_request(record, defaults, image_cache) for record in records]
+
+    report = []
+    for speed in [float(s) for s in args.speeds.split(",") if s.strip()]:
+        offsets = schedule(records, speed, args.max_gap)
+        process = None
+        try:
+            if args.spawn:
+                process, url = spawn_server()
+            else:
+                url = args.url.rstrip("/")
+            results, wall = run_speed(url, built, offsets, args.max_concurrency, args.timeout)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=30)
+        row = summarize(speed, results, offsets, wall, args.slo_ms, args.max_error_rate)
+        report.append(row)
+        print(f"  {speed:>5g}x  offered {row['offeredRps']:>7.2f} rps  achieved {row['achievedRps']:>7.2f} rps  "
+              f"p50 {row['p50Ms']}ms  p99 {row['p99Ms']}ms  errors {row['errorRate']:.1%}  {row['statuses']}"
+              f"{'  SATURATED' if row['saturated'] else ''}")
+
+    saturation = next((row["speed"] for row in report if row["saturated"]), None)
+    if saturation is None:
+        print(f"\nNo saturation up to {report[-1]['speed']:g}x.")
+    else:
+        print(f"\nSaturates at {saturation:g}x (p99 > {args.slo_ms:g}ms or errors > {args.max_error_rate:.0%}).")
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"capture": args.capture, "records": len(records), "upstreamMedianMs": defaults,
+                   "saturationSpeed": saturation, "results": report}, f, indent=2)
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Lean USDA FoodData Central search client with local best-match ranking.
+
+Search responses are parsed from the raw bytes (orjson when installed, else
+json), keeping only the tracked nutrients by FDC nutrient id, so kJ energy
+can't shadow kcal. rank_candidates() then picks the best match locally:
+token overlap, head noun, raw/generic over processed entries, Foundation
+over SR Legacy, and the API's order as the tie-break. Network errors
+propagate as requests exceptions.
+"""
+import os
+import re
+
+import traffic_capture
+from admission import clamp_timeout
+
+try:
+    import orjson as _json_impl
+except ImportError:  # optional speed-up; stdlib json is API-compatible for loads()
+    import json as _json_impl
+
+BASE_URL = "https://api.nal.usda.gov/fdc/v1/foods/search"
+USDA_PAGE_SIZE = int(os.getenv("USDA_PAGE_SIZE", 5))
+DATA_TYPES = ["Foundation", "SR Legacy"]
+
+# Descriptions with these words are processed/special-purpose variants, ranked
+# below plain entries unless the query itself mentions them
+_PROCESSED_WORDS = {
+    "dehydrated", "dried", "canned", "frozen", "fried", "powder", "powdered", "dry", "sweetened",
+    "babyfood", "infant", "formula", "juice", "concentrate", "sulfured", "stewed", "pickled",
+    "candied", "imitation", "substitute", "mix", "prepared", "restaurant", "fast", "commercial",
+}
+_GENERIC_WORDS = {"raw", "fresh", "plain", "whole", "unprepared"}
+
+_session = None
+
+
+def _get_session():
+    # Shared session: urllib3 keeps the TLS connection alive across lookups
+    global _session
+    if _session is None:
+        import requests
+        _session = requests.Session()
+    return _session
+
+
+def _tokens(text):
+    tokens = []
+    for word in re.findall(r"[a-z]+", text.lower()):
+        if word.endswith("ies") and len(word) > 4:
+            word = word[:-3] + "y"
+        elif word.endswith("oes") and len(word) > 4:
+            word = word[:-2]
+        elif word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+def _match_score(query_tokens, candidate, position):
+    description = candidate["description"]
+    desc_tokens = _tokens(description)
+    if not desc_tokens:
+        return -1.0
+    query_set, desc_set = set(query_tokens), set(desc_tokens)
+    shared = len(query_set & desc_set)
+
+    # Mostly "how much of the query does it cover", a little "how little else"
+    score = 2.0 * shared / len(query_set) + 0.5 * shared / len(desc_set)
+    # USDA descriptions lead with the food itself: "Apples, raw, with skin"
+    head = _tokens(description.split(",")[0])
+    if head and head[-1] in query_set:
+        score += 0.5
+    score += 0.3 * bool(desc_set & _GENERIC_WORDS)
+    score -= 0.3 * len((desc_set & _PROCESSED_WORDS) - query_set)
+    score += 0.1 * (candidate["dataType"] == "Foundation")
+    # An entry without any of the tracked nutrients is useless whatever its name
+    score -= 1.0 * (not candidate["nutrients"])
+    # The API's relevance order breaks ties
+    return score - 0.01 * position
+
+
+def rank_candidates(query, candidates):
+    """`candidates` sorted best match for `query` first."""
+    query_tokens = _tokens(query)
+    if not query_tokens:
+        return list(candidates)
+    scored = [(_match_score(query_tokens, c, i), i) for i, c in enumerate(candidates)]
+    return [candidates[i] for _, i in sorted(scored, key=lambda s: -s[0])]
+
+
+def parse_search(body, nutrient_ids):
+    """[{"fdcId", "description", "dataType", "nutrients": {id: value}}] from a raw search response."""
+    data = _json_impl.loads(body)
+    candidates = []
+    for food in data.get("foods") or ():
+        nutrients = {}
+        for nutrient in food.get("foodNutrients") or ():
+            nutrient_id = nutrient.get("nutrientId")
+            value = nutrient.get("value")
+            if nutrient_id in nutrient_ids and value is not None and nutrient_id not in nutrients:
+                nutrients[nutrient_id] = value
+        candidates.append({
+            "fdcId": food.get("fdcId"),
+            "description": food.get("description") or "",
+            "dataType": food.get("dataType") or "",
+            "nutrients": nutrients,
+        })
+    return candidates
+
+
+@traffic_capture.upstream("usda")
+def search(query, nutrient_ids, page_size=USDA_PAGE_SIZE, timeout=10):
+    """Ranked candidates for `query` with only `nutrient_ids` kept.
+
+    Returns None on a non-200 response, [] when nothing matched.
+    """
+    params = {
+        "query": query,
+        "pageSize": page_size,
+        # Read per call: callers load .env after importing this module
+        "api_key": os.getenv("USDA_API_KEY"),
+        "dataType": DATA_TYPES,
+    }
+    response = _get_session().get(BASE_URL, params=params, timeout=clamp_timeout(timeout))
+    if response.status_code != 200:
+        print(f"USDA API Error ({response.status_code}): {response.text[:200]}")
+        return None
+    return rank_candidates(query, parse_search(response.content, set(nutrient_ids)))
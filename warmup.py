@@ -0,0 +1,141 @@
+"""
+Optional preload + warm-up for the Flask API under gunicorn.
+
+By default nothing heavy is loaded at boot (see api_server.py): each worker
+imports Gemini/PIL/sentence-transformers on its first /analyze call and loads
+the embedding model on its first recipe search. That keeps a 512MB instance
+safe, but with several workers every one of them pays the 30-100s cold path
+separately and holds its own copy of the model.
+
+Setting PRELOAD_MODELS=1 switches gunicorn (see gunicorn.conf.py) to
+preload_app mode:
+  1. preload() runs once in the master, before fork: heavy modules are
+     imported and the embedding model is loaded, then gc.freeze() moves
+     everything into the permanent generation so the collector doesn't touch
+     (and copy-on-write duplicate) those pages in every worker.
+  2. start_warmup() runs in each worker after fork, when the listening socket
+     is already bound: a background thread does the per-process work that
+     must NOT happen before fork (first forward pass / torch thread pools,
+     Mongo connection, which pymongo does not allow to be shared across fork).
+
+With EMBEDDING_SERVICE_SOCKET set, the model lives in the separate embedding
+service (embedding_service.py) instead, and neither step loads it here.
+
+readiness() reports whether that work has finished, separately from liveness.
+"""
+import gc
+import os
+import threading
+import time
+
+PRELOAD_ENABLED = os.getenv("PRELOAD_MODELS", "").lower() in ("1", "true", "yes")
+
+_lock = threading.Lock()
+_state = {
+    "mode": "preload" if PRELOAD_ENABLED else "lazy",
+    "preloaded": False,
+    "warm": False,
+    "warming": False,
+    "error": None,
+    "startedAt": time.time(),
+    "readyAt": None,
+}
+
+
+def preload():
+    """Import heavy modules and load shared read-only state in this process.
+
+    Meant for the gunicorn master before fork. Does not run inference or open
+    network connections — both create per-process state (torch/OpenMP thread
+    pools, sockets) that is unsafe to inherit across fork.
+    """
+    t_start = time.time()
+    print("Preloading heavy modules and embedding model before fork...")
+
+    # Imported for their side effects (module objects live in the shared pages)
+    import PIL.Image  # noqa: F401
+    import google.generativeai  # noqa: F401
+    import text_extraction  # noqa: F401
+    import nutrition_info  # noqa: F401
+    import llm_model  # noqa: F401
+    import diet_analyzer  # noqa: F401
+    import embedding_service
+    import recipe_query
+
+    if not embedding_service.ENABLED:
+        recipe_query._get_model()
+    if recipe_query.SEARCH_BACKEND == "local":
+        recipe_query._get_local_index()
+    elif recipe_query.HYBRID_SEARCH:
+        recipe_query._get_lexical_index()
+
+    # Freeze everything allocated so far so the cyclic GC in each worker never
+    # writes to these objects' headers, which would un-share their pages.
+    gc.collect()
+    gc.freeze()
+
+    with _lock:
+        _state["preloaded"] = True
+    print(f"Preload finished in {time.time() - t_start:.1f}s")
+
+
+def _warm_up():
+    t_start = time.time()
+    try:
+        import recipe_query
+
+        # First forward pass allocates torch's thread pool and kernel caches
+        # (or, with the embedding service, opens this worker's connection);
+        # do it here instead of on the first user's request.
+        recipe_query.embed(["warm up"])
+
+        if recipe_query.SEARCH_BACKEND != "local":
+            try:
+                # Opens the minimum connection pool and finds out whether the
+                # server has $vectorSearch (recipe_atlas.py)
+                import recipe_atlas
+                recipe_atlas.warm_pool()
+            except Exception as e:
+                # Recipe search already degrades to a fallback message without
+                # Mongo, so a failed ping shouldn't keep the worker unready.
+                print(f"Warm-up: recipe database not reachable ({e})")
+
+        with _lock:
+            _state["warm"] = True
+            _state["readyAt"] = time.time()
+        print(f"Warm-up finished in {time.time() - t_start:.1f}s (pid {os.getpid()})")
+    except Exception as e:
+        with _lock:
+            _state["error"] = str(e)
+        print(f"Warm-up failed: {e}")
+    finally:
+        with _lock:
+            _state["warming"] = False
+
+
+def start_warmup():
+    """Start the per-worker warm-up in a daemon thread. No-op in lazy mode."""
+    if not PRELOAD_ENABLED:
+        return
+    with _lock:
+        if _state["warming"] or _state["warm"]:
+            return
+        _state["warming"] = True
+    threading.Thread(target=_warm_up, name="warmup", daemon=True).start()
+
+
+def is_ready():
+    # Lazy mode is "ready" as soon as it can serve: it never warms up, the
+    # first request just pays the cold path.
+    if not PRELOAD_ENABLED:
+        return True
+    with _lock:
+        return _state["warm"]
+
+
+def readiness():
+    with _lock:
+        state = dict(_state)
+    state["ready"] = is_ready()
+    state["pid"] = os.getpid()
+    return state